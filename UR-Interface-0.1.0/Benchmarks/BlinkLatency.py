@@ -0,0 +1,119 @@
+"""
+Benchmark of the BlinkDetector against the blinkStrength packets of the ThinkGear Connector
+
+Record a session with raw output enabled, blink (single and double) a number of times:
+    python -m Benchmarks.BlinkLatency record capture.jsonl 120
+Compare the detector with the connector on the recording:
+    python -m Benchmarks.BlinkLatency capture.jsonl
+
+Run from the UR-Interface-0.1.0 directory.
+Each line of a capture holds the arrival time and the packet: {"time": 1571234567.123, "packet": {...}}
+"""
+import json
+import sys
+import time
+
+import numpy as np
+
+from Communication.ThinkGearConnection import ThinkGearConnection
+from EEG.BlinkDetector import BlinkDetector
+
+
+def record(path, seconds):
+    """
+    Writes all packets of the connector with their arrival time
+    :param path: capture file to write
+    :param seconds: duration of the recording
+    """
+    headset = ThinkGearConnection(raw=True).connect()
+    end = time.time() + seconds
+    with open(path, "w") as file:
+        for packet in headset.packets():
+            file.write(json.dumps({"time": headset.received, "packet": packet}) + "\n")
+            if headset.received > end:
+                break
+    headset.disconnect()
+
+
+def load(path):
+    """
+    :param path: capture file
+    :return: list of (arrival time, packet)
+    """
+    with open(path) as file:
+        return [(record["time"], record["packet"]) for record in map(json.loads, file)]
+
+
+def replay(capture, detector, blink_threshold=50):
+    """
+    Feeds the raw samples to the detector one at a time in arrival order
+    :return: detector events with their arrival time, arrival times of the connector blinks
+    """
+    detections = []
+    connector = []
+    for received, packet in capture:
+        if "rawEeg" in packet:
+            if detector.start_time is None:
+                detector.reset(received)
+            detections.extend((event, received) for event in detector.push(packet["rawEeg"]))
+        if packet.get("blinkStrength", 0) > blink_threshold:
+            connector.append(received)
+    return detections, connector
+
+
+def match(detections, connector, tolerance=1.0):
+    """
+    Pairs every connector blink with a detected blink within the tolerance
+    The connector reports late, so the earliest unpaired detection before the connector blink is preferred
+    :return: list of (detector arrival time, connector arrival time)
+    """
+    available = [received for event, received in detections if event.kind == "blink"]
+    pairs = []
+    for blink in connector:
+        before = [t for t in available if blink - tolerance <= t <= blink]
+        after = [t for t in available if blink < t <= blink + tolerance]
+        if before or after:
+            detected = before[0] if before else after[0]
+            pairs.append((detected, blink))
+            available.remove(detected)
+    return pairs
+
+
+def throughput(capture, chunk=32, repeats=5):
+    """
+    :return: processed samples per second of the detector with chunks of raw samples
+    """
+    samples = np.array([packet["rawEeg"] for _, packet in capture if "rawEeg" in packet], dtype=np.float64)
+    best = np.inf
+    for _ in range(repeats):
+        detector = BlinkDetector()
+        detector.reset(0.0)
+        start = time.perf_counter()
+        for i in range(0, len(samples), chunk):
+            detector.push(samples[i:i + chunk])
+        best = min(best, time.perf_counter() - start)
+    return len(samples) / best
+
+
+def main(path):
+    capture = load(path)
+    detections, connector = replay(capture, BlinkDetector())
+    blinks = [event for event, _ in detections if event.kind == "blink"]
+    doubles = [event for event, _ in detections if event.kind == "double"]
+    pairs = match(detections, connector)
+
+    print("Connector blinks: {}".format(len(connector)))
+    print("Detected blinks:  {} ({} double)".format(len(blinks), len(doubles)))
+    print("Matched:          {}".format(len(pairs)))
+    if pairs:
+        lead = np.array([blink - detected for detected, blink in pairs]) * 1000
+        print("Detector ahead of connector [ms]: median {:.0f}, mean {:.0f}, min {:.0f}, max {:.0f}".format(
+            np.median(lead), np.mean(lead), np.min(lead), np.max(lead)))
+    print("Throughput: {:.0f} samples/s".format(throughput(capture)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 120)
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else "capture.jsonl")
@@ -0,0 +1,134 @@
+"""
+Replays a recorded headset session through the decisions of simple_mindwave_move, against a SimulatedRobot
+
+The clock of the controller and the robot is a SimulatedClock that jumps to the arrival time of every packet,
+so a session replays as fast as it can be processed and every replay sends the same commands.
+Replay a capture of Benchmarks.BlinkLatency, or a synthetic 30 minute session when no capture is given:
+    python -m Benchmarks.MindwaveReplay [capture.jsonl] [speed] [commands.jsonl]
+Use - as capture for the synthetic session.
+
+Run from the UR-Interface-0.1.0 directory.
+speed paces the replay at that many times real time, 0 for as fast as possible. The commands are written
+to commands.jsonl, or compared with it when it exists, as a regression test of the decision logic.
+"""
+import itertools
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from Benchmarks.BlinkLatency import load
+from Diagnostics.Clock import SimulatedClock
+from Robot.UR.SimulatedRobot import SimulatedRobot
+from RobotControllFunctions.MindwaveController import MindwaveController
+
+
+def synthetic_session(minutes=30.0, raw=False, seed=7, start=1571234567.0):
+    """
+    Packets like the ThinkGear Connector sends them: eSense every second with drifting attention and
+    meditation, single and double blinks, a lost connection of 20 seconds every 10 minutes
+    :param raw: include the 512 Hz rawEeg packets
+    :return: generator of (arrival time, packet)
+    """
+    random = np.random.RandomState(seed)
+    attention, meditation = 50.0, 50.0
+    blinks = []
+    for second in range(int(minutes * 60)):
+        now = start + second
+        if random.rand() < 0.05:
+            blinks.append(now + random.rand())
+            if random.rand() < 0.4:
+                blinks.append(blinks[-1] + random.uniform(0.3, 1.5))
+        if raw:
+            for sample in range(512):
+                yield now + sample / 512.0, {"rawEeg": int(random.normal(0, 60))}
+        while blinks and blinks[0] < now + 1:
+            yield blinks.pop(0), {"blinkStrength": int(random.uniform(55, 150))}
+        if second % 600 >= 580:     # connection lost
+            continue
+        attention = float(np.clip(attention + random.normal(0, 8), 1, 100))
+        meditation = float(np.clip(meditation + random.normal(0, 8), 1, 100))
+        yield now + 0.999, {"poorSignalLevel": 0,
+                            "eSense": {"attention": int(attention), "meditation": int(meditation)}}
+
+
+def replay(capture, speed=None, verbose=False):
+    """
+    :param capture: iterable of (arrival time, packet) in arrival order
+    :param speed: times real time, None or 0 for as fast as possible
+    :param verbose: print the decisions
+    :return: the SimulatedRobot with its commands, the number of packets and the seconds of session
+    """
+    capture = iter(capture)
+    first = next(capture, None)
+    if first is None:
+        raise ValueError("The capture has no packets")
+    clock = SimulatedClock(first[0])
+    robot = SimulatedRobot(clock)
+    controller = MindwaveController(robot, clock, verbose=verbose)
+
+    started = time.perf_counter()
+    count = 0
+    for received, packet in itertools.chain((first,), capture):
+        if speed:
+            delay = started + (received - first[0]) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        clock.advance_to(received)
+        controller.process(packet)
+        count += 1
+    controller.close()
+    return robot, count, clock.time() - first[0]
+
+
+def save(commands, path):
+    with open(path, "w") as file:
+        for moment, name, arguments in commands:
+            file.write(json.dumps([moment, name, list(arguments)]) + "\n")
+
+
+def compare(commands, path):
+    """
+    :return: None if the commands equal the saved commands, otherwise a description of the first difference
+    """
+    with open(path) as file:
+        expected = [json.loads(line) for line in file]
+    actual = [json.loads(json.dumps([moment, name, list(arguments)])) for moment, name, arguments in commands]
+    for i, (a, e) in enumerate(zip(actual, expected)):
+        if a != e:
+            return "command {}: {} instead of {}".format(i, a, e)
+    if len(actual) != len(expected):
+        return "{} commands instead of {}".format(len(actual), len(expected))
+    return None
+
+
+def main(path=None, speed=0.0, expected=None):
+    capture = load(path) if path is not None else synthetic_session()
+    start = time.perf_counter()
+    robot, count, session = replay(capture, speed)
+    elapsed = time.perf_counter() - start
+    commands = robot.commands
+
+    print("Replayed {} packets, {:.0f} s of session in {:.2f} s ({:.0f}x real time)".format(
+        count, session, elapsed, session / max(elapsed, 1e-9)))
+    names = Counter(name for _, name, _ in commands)
+    magnet = sum(1 for _, name, arguments in commands if name == "set_io" and arguments[0] == 8)
+    print("Commands: {}, magnet changes {}".format(dict(names), magnet))
+    if expected is not None:
+        if os.path.exists(expected):
+            difference = compare(commands, expected)
+            print("Same commands as {}".format(expected) if difference is None else "Differs: " + difference)
+            return difference is None
+        save(commands, expected)
+        print("Commands written to {}".format(expected))
+    return True
+
+
+if __name__ == '__main__':
+    ok = main(sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None,
+              float(sys.argv[2]) if len(sys.argv) > 2 else 0.0,
+              sys.argv[3] if len(sys.argv) > 3 else None)
+    sys.exit(0 if ok else 1)
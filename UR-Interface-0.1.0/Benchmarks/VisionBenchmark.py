@@ -0,0 +1,108 @@
+"""
+Benchmark of the camera capture and coin detection without a camera
+
+Runs the Camera with a SyntheticSource and a DetectionStage for a number of seconds per resolution:
+    python -m Benchmarks.VisionBenchmark [seconds] [fps]
+Or replays recorded frames (a .npy stack or a directory, see Vision.FrameSource):
+    python -m Benchmarks.VisionBenchmark 10 30 frames.npy
+
+Run from the UR-Interface-0.1.0 directory.
+The NumpyDetector is used, or the HoughDetector when OpenCV is installed. Radii and distances scale with
+the width of the frames, relative to the 50-70 pixel coins in 1280 x 720 frames.
+"""
+import sys
+import time
+
+import numpy as np
+
+from Vision.Camera import Camera
+from Vision.Detection import DetectionStage, NumpyDetector, HoughDetector, cv2
+from Vision.FrameSource import SyntheticSource, ReplaySource
+
+RESOLUTIONS = ((640, 360), (1280, 720), (1920, 1080))
+
+
+def errors(detection, source, tolerance):
+    """
+    Compares a detection with the coins the synthetic source rendered in that frame
+    :return: found coins, number of coins and the centre errors in pixels of the found coins
+    """
+    truth = source.truth(detection.sequence)
+    if truth is None:
+        return 0, 0, []
+    found = []
+    for x, y, _ in truth:
+        if len(detection.circles):
+            distance = np.hypot(detection.circles[:, 0] - x, detection.circles[:, 1] - y).min()
+            if distance <= tolerance:
+                found.append(distance)
+    return len(found), len(truth), found
+
+
+def run(source, seconds, width, workers=1):
+    """
+    Captures and detects the frames of a source
+    :return: dict with the capture and detection rates, latency percentiles, CPU time per frame and accuracy
+    """
+    scale = width / 1280.0
+    detector = HoughDetector() if cv2 is not None else NumpyDetector()
+    camera = Camera(source).start()
+    detection = DetectionStage(camera, detector, min_radius=50 * scale, max_radius=70 * scale,
+                               min_dist=200 * scale, margin=16 * scale, workers=workers).start()
+
+    found, total, distances = 0, 0, []
+    start, cpu = time.perf_counter(), time.process_time()
+    checked = None
+    while time.perf_counter() - start < seconds:
+        time.sleep(0.05)
+        latest = detection.latest()
+        if latest is not None and latest is not checked and hasattr(source, "truth"):
+            checked = latest
+            hits, count, errors_found = errors(latest, source, tolerance=10 * scale)
+            found, total = found + hits, total + count
+            distances.extend(errors_found)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    statistics = camera.statistics()
+    latency = detection.latency()
+    detection.stop()
+    camera.stop()
+
+    return {"capture_fps": statistics["fps"], "detect_fps": detection.processed / elapsed,
+            "coarse": detection.coarse / max(detection.processed, 1),
+            "dropped": sum(s["dropped"] for s in statistics["subscribers"]),
+            "latency": latency, "cpu_ms": cpu * 1000 / max(detection.processed, 1),
+            "recall": found / total if total else None,
+            "error": float(np.mean(distances)) if distances else None}
+
+
+def print_result(name, result):
+    print(name)
+    print("  capture {:.1f} fps, detection {:.1f} fps, {:.0%} coarse passes".format(
+        result["capture_fps"], result["detect_fps"], result["coarse"]))
+    latency = result["latency"]
+    if latency:
+        print("  capture to detection [ms]: p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, processing p50 {:.1f}".format(
+            latency["p50"], latency["p90"], latency["p99"], latency["process_p50"]))
+    print("  CPU per detected frame {:.1f} ms, {} frames not detected".format(result["cpu_ms"], result["dropped"]))
+    if result["recall"] is not None:
+        print("  coins found {:.0%}, centre error {}".format(
+            result["recall"], "{:.1f} px".format(result["error"]) if result["error"] is not None else "-"))
+
+
+def main(seconds=5.0, fps=30.0, replay=None):
+    print("Detector: {}".format("HoughDetector" if cv2 is not None else "NumpyDetector"))
+    if replay is not None:
+        source = ReplaySource(replay, fps=fps)
+        width = source.read()[1].shape[1]
+        print_result("Replay {}".format(replay), run(source, seconds, width))
+        return
+    for width, height in RESOLUTIONS:
+        scale = width / 1280.0
+        source = SyntheticSource(width, height, radius=(50 * scale, 70 * scale), speed=4 * scale, fps=fps)
+        print_result("{} x {}".format(width, height), run(source, seconds, width))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 30.0,
+         sys.argv[3] if len(sys.argv) > 3 else None)
@@ -0,0 +1,106 @@
+import json
+import socket
+import time
+
+from Diagnostics.Tracer import tracer
+
+
+class ThinkGearConnection:
+    """
+    Defines a simple interface for reading the ThinkGear Connector (TG_Connector)
+
+    The connector streams one JSON object per line.
+    eSense and eegPower packets arrive about once a second,
+    raw samples arrive as {"rawEeg": value} at 512 Hz when raw output is enabled.
+    """
+    def __init__(self, host="localhost", port=13854, raw=False):
+        """
+        :param host: The IP to connect with
+        :param port: Port to connect with (standard 13854)
+        :param raw: Boolean to enable the raw EEG output of the connector
+        """
+        self.host = host
+        self.port = port
+        self.raw = raw
+        self.opened = False
+        self.s = None
+        self.stream = None
+        self.received = None    # time.time() at which the last packet was read
+
+    def connect(self):
+        """
+        Opens the connection with the connector and switches it to JSON output
+        :return: self as object
+        """
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.connect((self.host, self.port))
+
+        # by default raw data is hidden and data is received in binary
+        config = json.dumps({"enableRawOutput": self.raw, "format": "Json"})
+        self.s.send(config.encode())
+
+        self.stream = self.s.makefile(encoding='utf8', errors='ignore')
+        self.opened = True
+        return self
+
+    def read_packet(self):
+        """
+        Reads the next valid packet from the connector
+        Invalid packets are skipped, the first line after the switch to JSON is usually malformed
+        Starts the trace of the packet when it is sampled by the tracer
+        :return: The packet as dict, None if the connection has been closed
+        """
+        while True:
+            try:
+                line = self.stream.readline()
+            except UnicodeDecodeError:
+                print('Skipping invalid packet')
+                continue
+            if not line:
+                return None
+            self.received = time.time()
+            tracer.begin()
+            try:
+                with tracer.span("parse"):
+                    return json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+    def wait_for_signal(self, timeout=30.0):
+        """
+        Reads packets until the first valid eSense packet, the headset then has contact
+        Attention and meditation are both 0 while the connector has no signal
+        :param timeout: maximum seconds to wait
+        :return: the first valid eSense packet, None on a timeout or when the connection closed
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            packet = self.read_packet()
+            if packet is None:
+                return None
+            esense = packet.get('eSense')
+            if esense and esense.get('attention', 0) + esense.get('meditation', 0) > 0:
+                return packet
+        return None
+
+    def packets(self):
+        """
+        Generator over all packets until the connection closes
+        """
+        packet = self.read_packet()
+        while packet is not None:
+            yield packet
+            packet = self.read_packet()
+
+    def disconnect(self):
+        """
+        Closes the connection with the connector
+        """
+        self.opened = False
+        try:
+            if self.stream is not None:
+                self.stream.close()
+            if self.s is not None:
+                self.s.close()
+        except OSError as error:
+            print("Disconnecting OS error: {0}".format(error))
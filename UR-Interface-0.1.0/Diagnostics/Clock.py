@@ -0,0 +1,103 @@
+import heapq
+import threading
+import time
+
+
+class Clock:
+    """
+    The wall clock, time.time(), time.sleep() and threading.Timer behind one interface
+
+    The control logic takes a clock instead of calling time directly, so a recorded session can drive it
+    with a SimulatedClock faster than real time.
+    """
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def call_later(self, seconds, function):
+        """
+        Calls a function on a timer thread
+        :return: the started timer, cancel() stops it
+        """
+        timer = threading.Timer(seconds, function)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+class ScheduledCall:
+    """
+    A call of a SimulatedClock, cancel() prevents it like Timer.cancel()
+    """
+
+    def __init__(self, due, function):
+        self.due = due
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SimulatedClock:
+    """
+    A clock that only moves when it is told to, for deterministic replays
+
+    Time advances with advance_to() or sleep(), scheduled calls run on the calling thread when their time
+    is passed, in order of their due time and then in the order they were scheduled.
+
+    Example:
+    clock = SimulatedClock(capture[0][0])
+    for received, packet in capture:
+        clock.advance_to(received)
+        controller.process(packet)
+    """
+
+    def __init__(self, start=0.0):
+        """
+        :param start: the time at the start in seconds
+        """
+        self.now = float(start)
+        self._calls = []
+        self._scheduled = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + seconds)
+
+    def call_later(self, seconds, function):
+        """
+        :return: ScheduledCall, cancel() prevents the call
+        """
+        call = ScheduledCall(self.now + seconds, function)
+        heapq.heappush(self._calls, (call.due, self._scheduled, call))
+        self._scheduled += 1
+        return call
+
+    def advance_to(self, moment):
+        """
+        Moves the time forward and runs the calls that are due, the time never moves back
+        :param moment: time to move to in seconds
+        """
+        moment = max(float(moment), self.now)
+        while self._calls and self._calls[0][0] <= moment:
+            due, _, call = heapq.heappop(self._calls)
+            if not call.cancelled:
+                self.now = due
+                call.function()
+        self.now = moment
+
+    def pending(self):
+        """
+        :return: number of scheduled calls that have not run and are not cancelled
+        """
+        return sum(not call.cancelled for _, _, call in self._calls)
+
+
+# the wall clock, used when no clock is given
+clock = Clock()
@@ -0,0 +1,90 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from Diagnostics.Clock import clock as wall_clock
+
+
+def wait_until(condition, timeout=10.0, interval=0.05, clock=None):
+    """
+    Polls a readiness probe instead of sleeping for a fixed time
+    :param condition: function returning a true value when ready
+    :param timeout: maximum seconds to wait
+    :param interval: seconds between polls
+    :param clock: Diagnostics.Clock to wait on, the wall clock when None
+    :return: True when the condition was met, False on a timeout
+    """
+    if clock is None:
+        clock = wall_clock
+    deadline = clock.time() + timeout
+    while not condition():
+        if clock.time() >= deadline:
+            return False
+        clock.sleep(interval)
+    return True
+
+
+class Startup:
+    """
+    Runs the startup tasks of a control script in parallel and times every phase
+
+    Example:
+    startup = Startup()
+    results = startup.run({"robot": start_robot, "headset": start_headset})
+    startup.print_report()
+
+    Inside a task, sub phases are timed with startup.phase(name).
+    """
+
+    def __init__(self):
+        self.epoch = time.perf_counter()
+        self.phases = []    # (name, start, end, ok), seconds since the epoch
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the with block as a phase, a phase that raises is reported as failed
+        """
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self._lock:
+                self.phases.append((name, start - self.epoch, time.perf_counter() - self.epoch, ok))
+
+    def run(self, tasks):
+        """
+        Runs every task in its own thread and waits for all of them
+        A task that raises is printed and returns None, the other tasks continue
+        :param tasks: dict of name: function without arguments
+        :return: dict of name: result of the function
+        """
+        results = {}
+
+        def run_task(name, task):
+            try:
+                with self.phase(name):
+                    results[name] = task()
+            except Exception as error:
+                print("Startup of {} failed: {}".format(name, error))
+                results[name] = None
+
+        threads = [threading.Thread(target=run_task, args=item, daemon=True) for item in tasks.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def print_report(self):
+        """
+        Prints the start, end and duration of every phase in the order they started
+        """
+        total = max([phase[2] for phase in self.phases], default=0)
+        print("{:<24} {:>8} {:>8} {:>8}".format("startup phase", "start", "end", "seconds"))
+        for name, start, end, ok in sorted(self.phases, key=lambda phase: phase[1]):
+            print("{:<24} {:8.2f} {:8.2f} {:8.2f}{}".format(name, start, end, end - start, "" if ok else "  failed"))
+        print("{:<24} {:>26.2f}".format("total", total))
@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Trace:
+    """
+    The spans recorded for a single headset packet
+
+    A trace starts when the packet is read from the socket and collects a span for every stage
+    that handles it (parse, features, decision, send_script).
+    Times are time.perf_counter() stamps in seconds.
+    """
+
+    def __init__(self, trace_id, name, start):
+        self.id = trace_id
+        self.name = name
+        self.start = start
+        self.spans = []     # (name, start, end, thread id)
+
+    def add(self, name, start, end):
+        """
+        Records a span measured elsewhere, e.g. on another thread
+        """
+        self.spans.append((name, start, end, threading.get_ident()))
+
+    @contextmanager
+    def span(self, name):
+        """
+        Records the duration of the with block as a span
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, start, time.perf_counter())
+
+    def end(self):
+        """
+        :return: end of the last span, the start if nothing has been recorded
+        """
+        return max([span[2] for span in self.spans], default=self.start)
+
+
+class Tracer:
+    """
+    Sampled latency tracing from headset packet to robot command
+
+    begin() starts a trace for a packet and makes it the current trace of the thread,
+    the previous trace of the thread is finished at that moment.
+    Every stage wraps its work in tracer.span(name), which records on the current trace
+    and does nothing when the packet was not sampled, so tracing can stay enabled.
+    A trace can be handed to another thread with activate(trace).
+
+    Finished traces are kept in a bounded buffer and can be exported as Chrome trace-event JSON
+    (open in chrome://tracing or Perfetto) or summarised as latency percentiles per stage.
+    """
+
+    def __init__(self, sample_rate=0.01, max_traces=10000):
+        """
+        :param sample_rate: fraction of the packets that is traced, 0 disables tracing
+        :param max_traces: number of finished traces kept
+        """
+        self.sample_rate = sample_rate
+        self.epoch = time.perf_counter()
+        self.traces = deque(maxlen=max_traces)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def begin(self, name="packet", start=None):
+        """
+        Starts the trace of a new packet on this thread when it is sampled
+        :param name: name of the trace
+        :param start: perf_counter stamp of the socket read, now when None
+        :return: the new Trace, None if the packet is not sampled
+        """
+        self.finish()
+        with self._lock:
+            self._count += 1
+            count = self._count
+        if int(count * self.sample_rate) == int((count - 1) * self.sample_rate):
+            return None
+        trace = Trace(count, name, time.perf_counter() if start is None else start)
+        self._local.trace = trace
+        return trace
+
+    def finish(self):
+        """
+        Finishes the current trace of this thread
+        """
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            self._local.trace = None
+            with self._lock:
+                self.traces.append(trace)
+
+    def current(self):
+        """
+        :return: the current Trace of this thread, None if there is none
+        """
+        return getattr(self._local, "trace", None)
+
+    def activate(self, trace):
+        """
+        Makes a trace started on another thread the current trace of this thread, without finishing it
+        """
+        self._local.trace = trace
+
+    @contextmanager
+    def span(self, name):
+        """
+        Records the with block as a span on the current trace, if there is one
+        """
+        trace = self.current()
+        if trace is None:
+            yield None
+        else:
+            with trace.span(name):
+                yield trace
+
+    def _finished(self):
+        with self._lock:
+            return list(self.traces)
+
+    def chrome_trace(self, path=None):
+        """
+        Exports the finished traces as Chrome trace-event JSON
+        :param path: file to write, None to only return the events
+        :return: dict with the trace events
+        """
+        events = []
+        for trace in self._finished():
+            events.append({"name": trace.name, "ph": "i", "s": "t", "pid": 1, "tid": 0,
+                           "ts": (trace.start - self.epoch) * 1e6, "args": {"trace": trace.id}})
+            for name, start, end, thread in trace.spans:
+                events.append({"name": name, "ph": "X", "pid": 1, "tid": thread,
+                               "ts": (start - self.epoch) * 1e6, "dur": (end - start) * 1e6,
+                               "args": {"trace": trace.id}})
+        result = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path is not None:
+            with open(path, "w") as file:
+                json.dump(result, file)
+        return result
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Latency percentiles per stage in milliseconds
+        "total" is the time from the socket read to the end of the last span of a trace,
+        only for traces that reached the robot (a send_script span)
+        :return: dict stage -> dict with count and p<percentile> values
+        """
+        durations = {}
+        for trace in self._finished():
+            for name, start, end, _ in trace.spans:
+                durations.setdefault(name, []).append(end - start)
+            if any(span[0] == "send_script" for span in trace.spans):
+                durations.setdefault("total", []).append(trace.end() - trace.start)
+
+        summary = {}
+        for name, values in durations.items():
+            values = np.array(values) * 1000
+            summary[name] = {"count": len(values)}
+            for p, value in zip(percentiles, np.percentile(values, percentiles)):
+                summary[name]["p{}".format(p)] = value
+        return summary
+
+    def print_summary(self):
+        """
+        Prints the per stage latency percentiles in the console
+        """
+        for name, stats in sorted(self.summary().items()):
+            print("{:<12} n={:<6} ".format(name, stats["count"]) +
+                  " ".join("{}={:.2f}ms".format(key, value) for key, value in stats.items() if key != "count"))
+
+
+# Shared tracer of the control process, 1% of the packets are traced
+tracer = Tracer()
@@ -0,0 +1,110 @@
+import numpy as np
+
+from EEG.Features import BANDS, FFTFeatures
+
+
+class BandPower:
+    """
+    Streaming band power over a sliding window of raw EEG samples
+
+    Raw samples are pushed as they arrive (one at a time or in chunks).
+    Every hop the last window of samples is tapered and transformed with an rfft,
+    the power spectrum is binned into the bands with a single precomputed matrix product (see FFTFeatures).
+    All windows that became due during one push are transformed together in one rfft call.
+
+    Example, band powers at 16 Hz over a 1 second window:
+    bp = BandPower(fs=512, window=512, rate=16)
+    indices, features = bp.push(samples)
+    """
+
+    def __init__(self, fs=512, window=512, rate=16, bands=BANDS, log=False, max_pending=16):
+        """
+        :param fs: sample rate of the raw signal in Hz
+        :param window: number of samples in the sliding window
+        :param rate: number of feature vectors emitted per second, the hop is fs / rate samples
+        :param bands: sequence of (name, low, high) frequency bands in Hz
+        :param log: if True, emit the natural log of the band powers
+        :param max_pending: maximum number of windows computed per push,
+        older windows are dropped when a burst of samples arrives at once
+        """
+        if fs % rate != 0:
+            raise ValueError("Rate {} does not divide the sample rate {}".format(rate, fs))
+
+        self.fs = fs
+        self.window = window
+        self.rate = rate
+        self.hop = fs // rate
+        self.log = log
+        self.max_pending = max_pending
+        self.names = [band[0] for band in bands]
+
+        # Hann tapered band powers, the taper and band matrix are computed once
+        self.features = FFTFeatures(fs, taper="hann", log=log, bands=bands)
+        self.features.plan(window)
+
+        self._buffer = np.zeros(2 * window, dtype=np.float32)
+        self._fill = 0
+        self._until_hop = self.hop
+
+        self.count = 0          # total number of samples pushed
+        self.latest = None      # latest feature vector
+        self.latest_index = -1  # sample count at the end of the window of the latest feature vector
+
+    def push(self, samples):
+        """
+        Add raw samples to the window and compute the band powers of every hop that completed
+        :param samples: a single sample or a sequence of samples
+        :return: sample counts at the end of each emitted window (n,) and the band powers (n, bands)
+        """
+        samples = np.asarray(samples, dtype=np.float32).ravel()
+        windows = []
+        indices = []
+
+        offset = 0
+        while offset < len(samples):
+            if self._fill == len(self._buffer):
+                # Move the last window to the front, the buffer is compacted once every window samples
+                self._buffer[:self.window] = self._buffer[self.window:]
+                self._fill = self.window
+
+            n = min(len(samples) - offset, len(self._buffer) - self._fill, self._until_hop)
+            self._buffer[self._fill:self._fill + n] = samples[offset:offset + n]
+            self._fill += n
+            self._until_hop -= n
+            self.count += n
+            offset += n
+
+            if self._until_hop == 0:
+                self._until_hop = self.hop
+                if self.count >= self.window:
+                    windows.append(self._buffer[self._fill - self.window:self._fill].copy())
+                    indices.append(self.count)
+
+        if not windows:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(self.names)), dtype=np.float32)
+
+        windows = windows[-self.max_pending:]
+        indices = np.array(indices[-self.max_pending:], dtype=np.int64)
+        features = self.compute(np.stack(windows))
+
+        self.latest = features[-1]
+        self.latest_index = int(indices[-1])
+        return indices, features
+
+    def compute(self, windows):
+        """
+        Band powers of complete windows
+        :param windows: 2-D array (n, window) of raw samples
+        :return: 2-D float32 array (n, bands)
+        """
+        return self.features(windows)
+
+    def reset(self):
+        """
+        Clears the window, e.g. after the headset lost contact
+        """
+        self._fill = 0
+        self._until_hop = self.hop
+        self.count = 0
+        self.latest = None
+        self.latest_index = -1
@@ -0,0 +1,161 @@
+import queue
+import threading
+
+import numpy as np
+
+
+class BatchGenerator:
+    """
+    Mini-batches of overlapping sub-windows of the trials, drawn and augmented on the fly
+
+    Every trial (a row of 1000 samples) gives many training windows: a window of `window` samples starts at
+    one of the offsets, optionally moved by a random jitter. Windows are read per batch from the memory-mapped
+    recordings, only the rows of the batch are read. The augmentations are vectorised over the batch:
+    a random amplitude scale per window and gaussian noise.
+
+    An epoch makes windows_per_row passes over the rows, every pass in a new random order, and holds only
+    one permutation of the rows and the prefetched batches in memory, however many windows it yields.
+    A prefetch thread prepares the next batches while the current one is used for training.
+
+    Example:
+    train = BatchGenerator(dataset, rows=train_rows, window=512, offsets=range(300, 489, 8),
+                           scale=(0.9, 1.1), jitter=4, noise=2.0, features=FFTFeatures(log=True))
+    for x, y in train:
+        model.train_on_batch(x, y)
+    """
+
+    def __init__(self, dataset, rows=None, window=512, offsets=(300,), windows_per_row=None, batch_size=64,
+                 scale=None, jitter=0, noise=0.0, features=None, shuffle=True, prefetch=4, seed=7):
+        """
+        :param dataset: EEG.Dataset
+        :param rows: row indices to draw from, all rows when None
+        :param window: samples per window
+        :param offsets: possible start columns of a window in a row
+        :param windows_per_row: windows drawn per row in an epoch, len(offsets) when None
+        :param batch_size: windows per batch
+        :param scale: (low, high) range of the random amplitude scale, None for no scaling
+        :param jitter: maximum random shift of the offset in samples
+        :param noise: standard deviation of the added gaussian noise in raw units, 0 for no noise
+        :param features: optional function turning a float32 (n, window) array into features, e.g. FFTFeatures
+        :param shuffle: draw rows and offsets at random, when False the windows are yielded in order
+        (row by row for every offset) for validation
+        :param prefetch: number of batches prepared ahead by the prefetch thread, 0 for no thread
+        :param seed: seed of the random draws, every epoch continues the sequence
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if np.any(self.offsets < 0) or np.any(self.offsets + window > dataset.width):
+            raise ValueError("Offsets {} with window {} do not fit in rows of {} samples".format(
+                list(self.offsets), window, dataset.width))
+        self.dataset = dataset
+        self.rows = np.arange(len(dataset)) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.window = window
+        self.windows_per_row = windows_per_row or len(self.offsets)
+        self.batch_size = batch_size
+        self.scale = scale
+        self.jitter = jitter
+        self.noise = noise
+        self.features = features
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.random = np.random.RandomState(seed)
+
+    def __len__(self):
+        """
+        :return: number of batches in an epoch
+        """
+        return self.windows_per_row * -(-len(self.rows) // self.batch_size)
+
+    def _batches(self):
+        """
+        The rows and window starts of every batch of an epoch
+        """
+        for p in range(self.windows_per_row):
+            order = self.random.permutation(self.rows) if self.shuffle else self.rows
+            for first in range(0, len(order), self.batch_size):
+                rows = order[first:first + self.batch_size]
+                if self.shuffle:
+                    starts = self.offsets[self.random.randint(len(self.offsets), size=len(rows))]
+                else:
+                    starts = np.full(len(rows), self.offsets[p % len(self.offsets)])
+                if self.jitter:
+                    starts = starts + self.random.randint(-self.jitter, self.jitter + 1, size=len(rows))
+                    starts = np.clip(starts, 0, self.dataset.width - self.window)
+                yield rows, starts
+
+    def make_batch(self, rows, starts):
+        """
+        Reads and augments the windows of a batch
+        :param rows: dataset row per window
+        :param starts: start column per window
+        :return: float32 windows (n, window) or their features, and the labels (n,)
+        """
+        first, last = int(starts.min()), int(starts.max()) + self.window
+        samples = self.dataset.take(rows, slice(first, last))
+        columns = (starts - first)[:, None] + np.arange(self.window)
+        x = samples[np.arange(len(rows))[:, None], columns].astype(np.float32)
+
+        if self.scale is not None:
+            x *= self.random.uniform(self.scale[0], self.scale[1], size=(len(rows), 1)).astype(np.float32)
+        if self.noise:
+            x += self.random.normal(0, self.noise, size=x.shape).astype(np.float32)
+        if self.features is not None:
+            x = self.features(x)
+        return x, self.dataset.labels[rows]
+
+    def __iter__(self):
+        """
+        Yields the (x, y) batches of one epoch
+        """
+        batches = (self.make_batch(rows, starts) for rows, starts in self._batches())
+        if not self.prefetch:
+            return batches
+        return self._prefetched(batches)
+
+    def _prefetched(self, batches):
+        buffer = queue.Queue(self.prefetch)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            """
+            Waits for room in the buffer, gives up when the consumer stopped
+            :return: Boolean, True if the item was put
+            """
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not put(batch):
+                        return
+                put(end)
+            except Exception as error:  # raised again in the consuming thread
+                put(error)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:  # also when the consumer stops early
+            stop.set()
+            thread.join()
+
+    def forever(self):
+        """
+        Yields batches epoch after epoch, e.g. for Keras fit_generator with steps_per_epoch=len(generator)
+        """
+        while True:
+            for batch in self:
+                yield batch
@@ -0,0 +1,146 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# kind: "blink" or "double", index: sample count of the stream at the onset,
+# time: timestamp of that sample in seconds, amplitude: filtered amplitude at the onset
+BlinkEvent = namedtuple("BlinkEvent", "kind index time amplitude")
+
+
+class BlinkDetector:
+    """
+    Detects blinks directly in the raw EEG stream
+
+    A blink is a large slow deflection on the forehead electrode.
+    The raw signal is band-passed by subtracting a long moving average (drift) from a short moving average (noise),
+    both computed over whole chunks with cumulative sums.
+    A blink starts where the filtered signal crosses an adaptive threshold, a multiple of the running noise level
+    (the mean filtered magnitude outside blinks).
+    Crossings within the refractory period of a blink are ignored,
+    a second blink within the double blink window results in a double blink event as well.
+
+    Events are reported at the onset crossing, with the sample index and its timestamp
+    derived from the sample rate, so they do not depend on when the chunk was processed.
+    """
+
+    def __init__(self, fs=512, short=0.03, long=0.5, factor=6.0, min_amplitude=60.0,
+                 refractory=0.3, double_window=1.0, adaptation=2.0, polarity=1):
+        """
+        :param fs: sample rate of the raw signal in Hz
+        :param short: length of the smoothing moving average in seconds
+        :param long: length of the drift moving average in seconds
+        :param factor: threshold as a multiple of the noise level
+        :param min_amplitude: lower bound of the threshold in raw units
+        :param refractory: seconds after a blink in which no new blink can start
+        :param double_window: maximum seconds between the onsets of the two blinks of a double blink
+        :param adaptation: time constant of the running noise level in seconds
+        :param polarity: 1 to detect positive deflections, -1 for negative and 0 for both.
+        With both the undershoot after a large blink can be detected as a second blink
+        """
+        self.fs = fs
+        self.short = max(1, int(round(short * fs)))
+        self.long = max(self.short + 1, int(round(long * fs)))
+        self.factor = factor
+        self.min_amplitude = min_amplitude
+        self.refractory = int(round(refractory * fs))
+        self.double_window = int(round(double_window * fs))
+        self.adaptation = adaptation
+        self.polarity = polarity
+        self.reset()
+
+    def reset(self, start_time=None):
+        """
+        Clears the filter state
+        :param start_time: timestamp of the next sample, the time of the first push when None
+        """
+        self.start_time = start_time
+        self.count = 0
+        self.noise = None
+        self._history = np.zeros(self.long, dtype=np.float64)
+        self._above = False
+        self._last_blink = -self.refractory - 1
+        self._pending_double = None
+
+    def threshold(self):
+        """
+        :return: the current detection threshold in raw units
+        """
+        if self.noise is None:
+            return np.inf
+        return max(self.factor * self.noise, self.min_amplitude)
+
+    def filter(self, samples):
+        """
+        Band-passes a chunk, continuing from the previous chunk
+        :param samples: 1-D array of raw samples
+        :return: filtered samples, same length
+        """
+        x = np.concatenate((self._history, samples))
+        cumulative = np.concatenate(([0.0], np.cumsum(x)))
+        n = len(samples)
+        end = np.arange(self.long + 1, self.long + n + 1)
+        smooth = (cumulative[end] - cumulative[end - self.short]) / self.short
+        drift = (cumulative[end] - cumulative[end - self.long]) / self.long
+        self._history = x[-self.long:]
+        return smooth - drift
+
+    def push(self, samples):
+        """
+        Processes a chunk of raw samples
+        :param samples: a single sample or a sequence of samples
+        :return: list of BlinkEvent found in this chunk
+        """
+        samples = np.asarray(samples, dtype=np.float64).ravel()
+        if len(samples) == 0:
+            return []
+        if self.start_time is None:
+            self.start_time = time.time()
+
+        first = self.count
+        filtered = self.filter(samples)
+        magnitude = np.abs(filtered) if self.polarity == 0 else self.polarity * filtered
+        self.count += len(samples)
+        if first < self.long:
+            # The drift average is still filling up with zeros, the samples before long are skipped.
+            # A chunk that crosses long is split, its samples after long are detected on
+            skip = self.long - first
+            if skip >= len(samples):
+                return []
+            first, magnitude = self.long, magnitude[skip:]
+            if self.noise is None:
+                self._adapt(magnitude)
+
+        above = magnitude > self.threshold()
+        onsets = np.flatnonzero(above & ~np.concatenate(([self._above], above[:-1])))
+        self._above = bool(above[-1])
+
+        events = []
+        for onset in onsets:
+            index = first + int(onset)
+            if index - self._last_blink <= self.refractory:
+                continue
+            self._last_blink = index
+            events.append(self._event("blink", index, magnitude[onset]))
+            if self._pending_double is not None and index - self._pending_double <= self.double_window:
+                events.append(self._event("double", index, magnitude[onset]))
+                self._pending_double = None
+            else:
+                self._pending_double = index
+
+        # Learn the noise level from the samples outside blinks
+        self._adapt(magnitude[~above])
+        return events
+
+    def _adapt(self, magnitude):
+        if len(magnitude) == 0:
+            return
+        level = float(np.mean(np.abs(magnitude)))
+        if self.noise is None:
+            self.noise = level
+        else:
+            weight = 1 - np.exp(-len(magnitude) / (self.adaptation * self.fs))
+            self.noise += weight * (level - self.noise)
+
+    def _event(self, kind, index, amplitude):
+        return BlinkEvent(kind, index, self.start_time + index / self.fs, float(amplitude))
@@ -0,0 +1,305 @@
+"""
+Compact export of a trained scaler and model, with a NumPy only runtime
+
+export() converts a StandardScaler and a Keras network of Dense layers or an MLPClassifier, a linear sklearn classifier
+(LogisticRegression, SGDClassifier, LinearSVC, LinearDiscriminantAnalysis, ...) or a binary SVC into a
+single .npz file of float32 weights, optionally quantized to int8 with a scale per column (per output of a layer).
+CompactModel loads such a file and runs the forward pass with NumPy only, so the control process does not
+import Keras, TensorFlow or sklearn.
+
+Export (from the UR-Interface-0.1.0 directory, needs the libraries of the model):
+    python -m EEG.CompactModel export scaler.pkl model.json model.npz [int8]
+Check the cold start of a runtime process:
+    python -m EEG.CompactModel model.npz
+"""
+import sys
+import time
+
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+    "elu": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    "softmax": lambda x: softmax(x),
+}
+
+
+def softmax(x):
+    e = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return e / np.sum(e, axis=1, keepdims=True)
+
+
+def quantize(weights):
+    """
+    Symmetric int8 quantization with a scale per column, one per output of an (in, out) weight matrix
+    :param weights: 2-D float array
+    :return: int8 weights and float32 scales (1, columns), weights ~= quantized * scales
+    """
+    weights = np.asarray(weights, dtype=np.float32)
+    scales = np.max(np.abs(weights), axis=0, keepdims=True) / 127
+    scales[scales == 0] = 1
+    return np.clip(np.rint(weights / scales), -127, 127).astype(np.int8), scales.astype(np.float32)
+
+
+def _dense(model):
+    """
+    Weights and activations of a Keras model of Dense layers, Dropout and Activation layers are folded in
+    """
+    weights, biases, activations = [], [], []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        config = layer.get_config()
+        if kind == "Dense":
+            w, b = layer.get_weights() if config.get("use_bias", True) else (layer.get_weights()[0], None)
+            weights.append(w)
+            biases.append(b if b is not None else np.zeros(w.shape[1]))
+            activations.append(config["activation"])
+        elif kind == "Activation" and activations and activations[-1] == "linear":
+            activations[-1] = config["activation"]
+        elif kind not in ("Dropout", "InputLayer", "Flatten"):
+            raise ValueError("Layer {} of type {} can not be exported".format(layer.name, kind))
+    for activation in activations:
+        if activation not in ACTIVATIONS:
+            raise ValueError("Activation {} can not be exported".format(activation))
+    return weights, biases, activations
+
+
+def _link(model):
+    """
+    How the decision function of a linear sklearn model turns into its predict_proba
+    """
+    name = type(model).__name__
+    loss = getattr(model, "loss", None)
+    if name == "SGDClassifier":
+        if loss in ("log", "log_loss"):
+            return "sigmoid" if len(model.classes_) == 2 else "ovr"
+        if loss == "modified_huber":
+            return "modified_huber"
+    elif name == "LogisticRegression":
+        if len(model.classes_) == 2:
+            return "sigmoid"
+        multi_class = getattr(model, "multi_class", "auto")
+        if multi_class == "ovr" or (multi_class == "auto" and model.solver == "liblinear"):
+            return "ovr"
+        return "softmax"
+    elif name == "LinearDiscriminantAnalysis":
+        return "sigmoid" if len(model.classes_) == 2 else "softmax"
+    # no predict_proba, the sigmoid of the decision function as used by EEG.InferenceService
+    return "decision"
+
+
+def _classes(classes):
+    """
+    :return: the class labels with their dtype, object arrays of strings as unicode so they load without pickle
+    """
+    classes = np.asarray(classes)
+    return classes.astype(str) if classes.dtype.kind == "O" else classes
+
+
+def export(path, model, scaler=None, quantized=False):
+    """
+    Writes a scaler and model as a compact .npz file
+    :param path: output path
+    :param model: Keras model of Dense layers, MLPClassifier, linear sklearn classifier or binary SVC,
+    an sklearn Pipeline of a StandardScaler and one of those is split into the scaler and the model
+    :param scaler: fitted StandardScaler, None for no scaling
+    :param quantized: store the weights as int8 with a float32 scale per column
+    """
+    if hasattr(model, "steps"):  # sklearn Pipeline, e.g. from EEG.ModelComparison
+        if len(model.steps) != 2 or scaler is not None:
+            raise ValueError("Only a pipeline of a scaler and a model can be exported")
+        scaler, model = model.steps[0][1], model.steps[1][1]
+
+    arrays = {}
+    matrices = {}
+    if scaler is not None:
+        if not hasattr(scaler, "mean_"):
+            raise ValueError("Only a StandardScaler can be exported, got {}".format(type(scaler).__name__))
+        arrays["mean"] = scaler.mean_ if scaler.mean_ is not None else np.zeros(len(scaler.scale_))
+        arrays["scale"] = scaler.scale_ if scaler.scale_ is not None else np.ones(len(scaler.mean_))
+
+    if hasattr(model, "layers"):
+        weights, biases, activations = _dense(model)
+        arrays["kind"] = "dense"
+        arrays["activations"] = np.array(activations)
+        arrays["classes"] = np.arange(weights[-1].shape[1] if weights[-1].shape[1] > 1 else 2)
+        for i, (w, b) in enumerate(zip(weights, biases)):
+            matrices["w{}".format(i)] = w
+            arrays["b{}".format(i)] = b
+    elif hasattr(model, "coefs_"):  # MLPClassifier
+        names = {"identity": "linear", "logistic": "sigmoid"}
+        arrays["kind"] = "dense"
+        arrays["activations"] = np.array([names.get(model.activation, model.activation)] * (len(model.coefs_) - 1)
+                                         + [names.get(model.out_activation_, model.out_activation_)])
+        arrays["classes"] = _classes(model.classes_)
+        for i, (w, b) in enumerate(zip(model.coefs_, model.intercepts_)):
+            matrices["w{}".format(i)] = w
+            arrays["b{}".format(i)] = b
+    elif hasattr(model, "coef_") and not hasattr(model, "support_vectors_"):
+        arrays["kind"] = "linear"
+        arrays["link"] = _link(model)
+        arrays["classes"] = _classes(model.classes_)
+        matrices["w0"] = np.asarray(model.coef_).T
+        arrays["b0"] = np.atleast_1d(model.intercept_)
+    elif hasattr(model, "support_vectors_"):
+        if len(model.classes_) != 2:
+            raise ValueError("Only binary SVMs can be exported")
+        if model.kernel not in ("linear", "rbf", "poly", "sigmoid"):
+            raise ValueError("Kernel {} can not be exported".format(model.kernel))
+        arrays["kind"] = "svm"
+        arrays["classes"] = _classes(model.classes_)
+        matrices["support"] = model.support_vectors_
+        arrays["coefficients"] = model.dual_coef_[0]
+        arrays["b0"] = model.intercept_
+        arrays["kernel"] = model.kernel
+        arrays["kernel_parameters"] = np.array([model._gamma, model.coef0, model.degree])
+        if len(getattr(model, "probA_", ())):
+            arrays["platt"] = np.array([model.probA_[0], model.probB_[0]])
+    else:
+        raise ValueError("Model {} can not be exported".format(type(model).__name__))
+
+    for name, matrix in matrices.items():
+        if quantized:
+            arrays[name], arrays[name + "_scale"] = quantize(matrix)
+        else:
+            arrays[name] = matrix
+    arrays = {name: np.asarray(value).astype(np.float32)
+              if np.asarray(value).dtype.kind == "f" and name != "classes" else np.asarray(value)
+              for name, value in arrays.items()}
+    np.savez(path, **arrays)
+
+
+class CompactModel:
+    """
+    Runs an exported scaler and model with NumPy only
+
+    The scaler is part of the model, use it in EEG.InferenceService without a scaler:
+    service = InferenceService(None, CompactModel('model.npz'))
+    """
+
+    def __init__(self, path):
+        """
+        :param path: .npz file written by export()
+        """
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.kind = str(arrays["kind"])
+        self.classes_ = arrays["classes"]
+        self.mean = arrays.get("mean")
+        self.scale = arrays.get("scale")
+
+        def matrix(name):  # int8 weights are dequantized once when loading
+            if name + "_scale" in arrays:
+                return arrays[name].astype(np.float32) * arrays[name + "_scale"]
+            return arrays[name]
+
+        if self.kind == "dense":
+            self.activations = [str(a) for a in arrays["activations"]]
+            self.weights = [matrix("w{}".format(i)) for i in range(len(self.activations))]
+            self.biases = [arrays["b{}".format(i)] for i in range(len(self.activations))]
+        elif self.kind == "linear":
+            self.link = str(arrays["link"])
+            self.weights, self.bias = matrix("w0"), arrays["b0"]
+        else:
+            self.support, self.coefficients, self.bias = matrix("support"), arrays["coefficients"], arrays["b0"]
+            self.kernel = str(arrays["kernel"])
+            self.gamma, self.coef0, self.degree = (float(p) for p in arrays["kernel_parameters"])
+            self.platt = arrays.get("platt")
+            self.link = "decision"
+        inputs = {"dense": lambda: self.weights[0].shape[0], "linear": lambda: self.weights.shape[0],
+                  "svm": lambda: self.support.shape[1]}
+        self.n_features_in_ = inputs[self.kind]()
+
+    def _kernel(self, x):
+        if self.kernel == "linear":
+            return x @ self.support.T
+        if self.kernel == "rbf":
+            distances = (np.sum(x * x, axis=1)[:, None] - 2 * x @ self.support.T
+                         + np.sum(self.support * self.support, axis=1)[None, :])
+            return np.exp(-self.gamma * np.maximum(distances, 0))
+        if self.kernel == "poly":
+            return (self.gamma * x @ self.support.T + self.coef0) ** self.degree
+        return np.tanh(self.gamma * x @ self.support.T + self.coef0)
+
+    def _scaled(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if self.mean is not None:
+            x = (x - self.mean) / self.scale
+        return x
+
+    def decision_function(self, x):
+        """
+        :param x: 2-D array (n, features) of unscaled features
+        :return: decision values (n,) for two classes and linear or SVM models, (n, outputs) otherwise
+        """
+        x = self._scaled(x)
+        if self.kind == "dense":
+            for w, b, activation in zip(self.weights[:-1], self.biases[:-1], self.activations[:-1]):
+                x = ACTIVATIONS[activation](x @ w + b)
+            return x @ self.weights[-1] + self.biases[-1]
+        if self.kind == "linear":
+            d = x @ self.weights + self.bias
+        else:
+            d = self._kernel(x) @ self.coefficients[:, None] + self.bias
+        return d[:, 0] if d.shape[1] == 1 else d
+
+    def _squash(self, d):
+        if self.link == "modified_huber":
+            return (np.clip(d, -1, 1) + 1) / 2
+        return 1 / (1 + np.exp(-d))
+
+    def predict_proba(self, x):
+        """
+        :param x: 2-D array (n, features) of unscaled features
+        :return: float32 probabilities (n, classes)
+        """
+        d = self.decision_function(x)
+        if self.kind == "dense":
+            p = ACTIVATIONS[self.activations[-1]](d)
+            return (np.concatenate((1 - p, p), axis=1) if p.shape[1] == 1 else p).astype(np.float32)
+
+        if self.kind == "svm" and self.platt is not None:
+            # libsvm's decision values have the opposite sign of sklearn's for two classes
+            p = 1 / (1 + np.exp(-self.platt[0] * d + self.platt[1]))
+            p = np.stack((p, 1 - p), axis=1)
+        elif d.ndim == 1:
+            p = self._squash(d)
+            p = np.stack((1 - p, p), axis=1)
+        elif self.link == "softmax":
+            p = softmax(d)
+        else:  # one versus rest, normalised as sklearn does
+            p = self._squash(d)
+            total = np.sum(p, axis=1, keepdims=True)
+            p = np.where(total > 0, p / np.where(total > 0, total, 1), 1.0 / p.shape[1])
+        return p.astype(np.float32)
+
+    def predict(self, x):
+        """
+        :param x: 2-D array (n, features) of unscaled features
+        :return: most likely class per row
+        """
+        if self.kind != "dense":
+            d = self.decision_function(x)
+            if d.ndim == 1:
+                return self.classes_[(d > 0).astype(int)]
+            return self.classes_[np.argmax(d, axis=1)]
+        return self.classes_[np.argmax(self.predict_proba(x), axis=1)]
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == "export":
+        from EEG.InferenceService import load_model
+        export(sys.argv[4], load_model(sys.argv[3]), load_model(sys.argv[2]) if sys.argv[2] != "none" else None,
+               quantized=len(sys.argv) > 5 and sys.argv[5] == "int8")
+    else:
+        start = time.perf_counter()
+        compact = CompactModel(sys.argv[1])
+        loaded = time.perf_counter()
+        compact.predict_proba(np.zeros((1, compact.n_features_in_), dtype=np.float32))
+        done = time.perf_counter()
+        print("Loaded in {:.1f} ms, first prediction in {:.1f} ms".format(1000 * (loaded - start), 1000 * (done - loaded)))
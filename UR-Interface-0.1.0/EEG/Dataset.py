@@ -0,0 +1,217 @@
+"""
+Compact storage of the recordings in RawData_Collection
+
+Every CSV recording (rows of v1..vN samples and a label) is converted to
+    <name>.samples.npy  int16 sample matrix (rows, samples)
+    <name>.labels.npy   uint8 label codes (rows,)
+    <name>.quality.npy  per row quality index, see EEG.Ingest
+    <name>.json         metadata: subject, session, label names, shape and source file
+
+Convert all recordings once with EEG.Ingest (from the UR-Interface-0.1.0 directory):
+    python -m EEG.Ingest ../RawData_Collection ../RawData_Collection/npy
+and open them as one dataset:
+    dataset = Dataset('../RawData_Collection/npy')
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def parse_name(path):
+    """
+    Derives subject and session from the file name of a recording, rawData_<subject>.csv
+    :param path: path of the recording
+    :return: subject, session
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    rest = stem[len("rawData"):] if stem.startswith("rawData") else stem
+    rest = rest.lstrip("_")
+    if not rest or rest.isdigit():
+        return "unknown", rest or "1"
+    return rest, "1"
+
+
+def write_meta(target, name, labels, rows, samples, subject, session, source=None):
+    """
+    Writes the metadata of a converted recording
+    :param target: output directory
+    :param name: name of the recording
+    :param labels: label names, the label codes index this list
+    :param rows: number of rows
+    :param samples: number of samples per row
+    :param subject: name of the subject
+    :param session: name of the session
+    :param source: file the recording was converted from
+    :return: path of the metadata file
+    """
+    meta = {
+        "name": name,
+        "subject": subject,
+        "session": session,
+        "labels": list(labels),
+        "rows": int(rows),
+        "samples": int(samples),
+        "source": os.path.basename(source) if source else None,
+    }
+    path = os.path.join(target, name + ".json")
+    with open(path, "w") as file:
+        json.dump(meta, file, indent=2)
+    return path
+
+
+class Dataset:
+    """
+    All converted recordings of a directory as one lazily concatenated dataset
+
+    The sample matrices are memory-mapped, rows are only read from disk when indexed.
+    Labels are unified over the recordings, dataset.labels holds the codes of dataset.label_names.
+
+    Example:
+    dataset = Dataset('../RawData_Collection/npy')
+    x = dataset[0:100, 300:1000]            # int16 rows
+    y = dataset.labels[0:100]
+    robert = dataset.select(subject='Robert')
+    """
+
+    def __init__(self, directory, recordings=None):
+        """
+        :param directory: directory with the converted recordings
+        :param recordings: names of the recordings to open, all when None
+        """
+        self.directory = directory
+        paths = sorted(glob.glob(os.path.join(directory, "*.json")))
+        self.meta = []
+        for path in paths:
+            with open(path) as file:
+                meta = json.load(file)
+            if recordings is None or meta["name"] in recordings:
+                self.meta.append(meta)
+        if not self.meta:
+            raise ValueError("No recordings found in {}".format(directory))
+
+        widths = {meta["samples"] for meta in self.meta}
+        if len(widths) != 1:
+            raise ValueError("Recordings have a different number of samples per row: {}".format(sorted(widths)))
+        self.width = widths.pop()
+
+        self.samples = [np.load(self._path(meta, "samples"), mmap_mode="r") for meta in self.meta]
+        self.offsets = np.cumsum([0] + [meta["rows"] for meta in self.meta])
+
+        self.label_names = sorted({label for meta in self.meta for label in meta["labels"]})
+        labels = []
+        for meta in self.meta:
+            recode = np.array([self.label_names.index(label) for label in meta["labels"]], dtype=np.uint8)
+            labels.append(recode[np.load(self._path(meta, "labels"))])
+        self.labels = np.concatenate(labels)
+
+        # per row quality index of EEG.Ingest, None when a recording has none
+        paths = [self._path(meta, "quality") for meta in self.meta]
+        self.quality = np.concatenate([np.load(path) for path in paths]) if all(map(os.path.exists, paths)) else None
+
+        # recording index of every row, to look up subject and session
+        self.recording = np.repeat(np.arange(len(self.meta)), [meta["rows"] for meta in self.meta])
+        self.subjects = [meta["subject"] for meta in self.meta]
+
+    def _path(self, meta, kind):
+        return os.path.join(self.directory, "{}.{}.npy".format(meta["name"], kind))
+
+    def sample_path(self, recording):
+        """
+        :param recording: index of the recording
+        :return: path of the .npy sample matrix of the recording
+        """
+        return self._path(self.meta[recording], "samples")
+
+    @property
+    def shape(self):
+        return int(self.offsets[-1]), self.width
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        """
+        Reads rows (and columns) from the recordings
+        :param key: row index, slice or index array, optionally followed by a column index
+        :return: int16 array
+        """
+        columns = slice(None)
+        if isinstance(key, tuple):
+            key, columns = key
+        if isinstance(key, (int, np.integer)):
+            index = int(key) + len(self) if key < 0 else int(key)
+            if not 0 <= index < len(self):
+                raise IndexError("Row {} out of range for {} rows".format(key, len(self)))
+            recording = int(np.searchsorted(self.offsets, index, side="right")) - 1
+            return np.array(self.samples[recording][index - self.offsets[recording], columns])
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self.rows(start, stop, columns)
+            key = np.arange(start, stop, step)
+        return self.take(key, columns)
+
+    def rows(self, start, stop, columns=slice(None)):
+        """
+        Reads a contiguous range of rows, copying only the parts of the recordings it covers
+        :return: int16 array
+        """
+        parts = []
+        for recording in range(len(self.meta)):
+            first = max(start, self.offsets[recording])
+            last = min(stop, self.offsets[recording + 1])
+            if first < last:
+                local = slice(first - self.offsets[recording], last - self.offsets[recording])
+                parts.append(self.samples[recording][local, columns])
+        if not parts:
+            return np.empty((0, len(range(self.width)[columns])), dtype=np.int16)
+        return np.concatenate(parts)
+
+    def take(self, indices, columns=slice(None)):
+        """
+        Reads arbitrary rows, in the order given
+        :param indices: 1-D array of row indices, negative indices count from the end
+        :return: int16 array
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        outside = (indices < -len(self)) | (indices >= len(self))
+        if outside.any():
+            raise IndexError("Row {} out of range for {} rows".format(indices[outside][0], len(self)))
+        indices = np.where(indices < 0, indices + len(self), indices)
+        recordings = np.searchsorted(self.offsets, indices, side="right") - 1
+        result = np.empty((len(indices), len(range(self.width)[columns])), dtype=np.int16)
+        for recording in np.unique(recordings):
+            mask = recordings == recording
+            result[mask] = self.samples[recording][indices[mask] - self.offsets[recording]][:, columns]
+        return result
+
+    def select(self, subject=None, session=None):
+        """
+        Indices of the rows of a subject and/or session
+        :return: 1-D array of row indices
+        """
+        keep = [i for i, meta in enumerate(self.meta)
+                if (subject is None or meta["subject"] == subject) and (session is None or meta["session"] == session)]
+        return np.flatnonzero(np.isin(self.recording, keep))
+
+    def filter(self, max_duplicate_ratio=None, min_effective_rate=None, exclude_flags=0):
+        """
+        Indices of the rows that pass the quality index, without reading the samples
+        :param max_duplicate_ratio: maximum fraction of duplicated samples
+        :param min_effective_rate: minimum rate of new values in Hz
+        :param exclude_flags: bitmask of EEG.Ingest flags (DUPLICATES, FLAT, CLIPPED) to exclude
+        :return: 1-D array of row indices
+        """
+        if self.quality is None:
+            raise ValueError("No quality index, convert the recordings with EEG.Ingest")
+        keep = (self.quality["flags"] & exclude_flags) == 0
+        if max_duplicate_ratio is not None:
+            keep &= self.quality["duplicate_ratio"] <= max_duplicate_ratio
+        if min_effective_rate is not None:
+            keep &= self.quality["effective_rate"] >= min_effective_rate
+        return np.flatnonzero(keep)
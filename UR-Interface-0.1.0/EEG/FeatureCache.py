@@ -0,0 +1,170 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+
+def describe_columns(columns):
+    """
+    :param columns: column slice of the rows
+    :return: JSON serialisable description of the slice
+    """
+    return [columns.start, columns.stop, columns.step]
+
+
+def describe_stage(stage):
+    """
+    :param stage: feature stage, e.g. FFTFeatures
+    :return: JSON serialisable description of the stage: class, version and parameters
+    """
+    if not hasattr(stage, "params"):
+        raise ValueError("{} has no params(), its features can not be cached".format(type(stage).__name__))
+    return [type(stage).__name__, getattr(stage, "version", 0), stage.params()]
+
+
+class FeatureCache:
+    """
+    On-disk cache of computed features, addressed by the content they were computed from
+
+    The key of an entry is a hash of the digest of the sample file, the row range, the columns used
+    and the class, version and parameters of every feature stage, so every stage needs a params() method.
+    Changing the recording, skipping other samples or changing a feature function (bump its version)
+    therefore results in a new key, stale entries are never returned.
+
+    Entries are stored as .npy files and returned memory-mapped.
+    When the cache grows beyond max_bytes the least recently used entries are removed. The total size is
+    counted from the directory once and then kept up to date by put(), the directory is only scanned again
+    to evict entries.
+
+    Example:
+    pipeline = Pipeline(stages, columns=slice(300, 1000), cache=FeatureCache('feature_cache'))
+    """
+
+    def __init__(self, directory, max_bytes=2 * 2 ** 30):
+        """
+        :param directory: directory of the cache, created when missing
+        :param max_bytes: maximum total size of the cached entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}
+        self._total = None  # total size of the entries, counted on the first put()
+        os.makedirs(directory, exist_ok=True)
+
+    def file_digest(self, path):
+        """
+        SHA-256 of a file, remembered for as long as its size and modification time do not change
+        """
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(2 ** 20), b""):
+                digest.update(block)
+        self._digests[path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        return digest.hexdigest()
+
+    def key(self, path, start, stop, columns, stages):
+        """
+        :param path: sample file the features are computed from
+        :param start: first row
+        :param stop: end row (exclusive)
+        :param columns: column slice of the rows
+        :param stages: feature stages
+        :return: hex key of the entry
+        """
+        description = {
+            "data": self.file_digest(path),
+            "rows": [int(start), int(stop)],
+            "columns": describe_columns(columns),
+            "stages": [describe_stage(stage) for stage in stages],
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def get(self, key):
+        """
+        :param key: key of the entry
+        :return: the memory-mapped features, None if they are not cached
+        """
+        path = self._path(key)
+        try:
+            features = np.load(path, mmap_mode="r")
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return features
+
+    def put(self, key, features):
+        """
+        Stores features, the file is written under a temporary name and then renamed,
+        so an interrupted write never leaves a partial entry
+        """
+        if self._total is None:
+            self._total = self.size()
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        with os.fdopen(handle, "wb") as file:
+            np.save(file, np.asarray(features, dtype=np.float32))
+        self._total += os.path.getsize(temporary) - replaced
+        os.replace(temporary, path)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """
+        :return: list of (last use, size, path) of all entries, least recently used first
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npy")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        """
+        :return: total size of the entries in bytes
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._total = total
+
+    def clear(self):
+        """
+        Removes all entries
+        """
+        for _, _, path in self.entries():
+            os.remove(path)
+        self._total = 0
@@ -0,0 +1,175 @@
+import numpy as np
+
+# Default EEG bands in Hz, (name, low, high). A band contains the frequencies low <= f < high
+BANDS = (
+    ("delta", 0.5, 4.0),
+    ("theta", 4.0, 8.0),
+    ("alpha", 8.0, 13.0),
+    ("beta", 13.0, 30.0),
+    ("gamma", 30.0, 50.0),
+)
+
+# Window functions applied before the FFT, None is a rectangular window
+TAPERS = {
+    None: np.ones,
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+}
+
+
+class FFTFeatures:
+    """
+    Spectral features of a matrix of windows, one window per row
+
+    All rows of a chunk are transformed with a single rfft along axis 1 in float32.
+    The result is the one-sided power spectral density of every row, optionally in log and
+    optionally summed into frequency bands. Tapers, scale and band matrices are computed once per
+    window length.
+
+    The same object is used offline on the whole dataset (transform) and online on live windows
+    (as the features function of InferenceService, and inside BandPower),
+    so training and inference features are computed by the same code.
+
+    Example:
+    fft = FFTFeatures(fs=512, taper='hann', log=True, bands=BANDS)
+    x = fft.transform(dataset, columns=slice(300, 1000))
+    """
+    # Increase when the computed features change, used to invalidate cached features
+    version = 1
+
+    def __init__(self, fs=512, taper=None, log=False, bands=None, max_bytes=64 * 2 ** 20):
+        """
+        :param fs: sample rate of the windows in Hz
+        :param taper: name of the window function, see TAPERS
+        :param log: if True, return the natural log of the power
+        :param bands: sequence of (name, low, high) bands in Hz to sum the power over, None for all bins
+        :param max_bytes: approximate memory used per chunk of rows
+        """
+        if taper not in TAPERS:
+            raise ValueError("Unknown taper {}, choose from {}".format(taper, list(TAPERS)))
+        self.fs = fs
+        self.taper = taper
+        self.log = log
+        self.bands = tuple(bands) if bands is not None else None
+        self.max_bytes = max_bytes
+        self._plans = {}
+
+    def params(self):
+        """
+        :return: dict of the parameters that determine the features
+        """
+        return {"fs": self.fs, "taper": self.taper, "log": self.log,
+                "bands": [list(band) for band in self.bands] if self.bands is not None else None}
+
+    def plan(self, n):
+        """
+        Taper, scale and band matrix for windows of n samples, computed on first use
+        :return: taper (n,), scale, band matrix (bins, bands) or None
+        """
+        if n not in self._plans:
+            taper = TAPERS[self.taper](n).astype(np.float32)
+            scale = np.float32(2.0 / (self.fs * np.sum(taper.astype(np.float64) ** 2)))
+            matrix = None
+            if self.bands is not None:
+                freqs = np.fft.rfftfreq(n, 1.0 / self.fs)
+                matrix = np.zeros((len(freqs), len(self.bands)), dtype=np.float32)
+                for i, (name, low, high) in enumerate(self.bands):
+                    in_band = (freqs >= low) & (freqs < high)
+                    if not in_band.any():
+                        raise ValueError("Band {} ({} - {} Hz) contains no frequency bins, "
+                                         "use a longer window".format(name, low, high))
+                    matrix[in_band, i] = 1
+            self._plans[n] = (taper, scale, matrix)
+        return self._plans[n]
+
+    def names(self, n):
+        """
+        :param n: window length in samples
+        :return: column names of the features
+        """
+        if self.bands is not None:
+            return [band[0] for band in self.bands]
+        return ["{:.2f}Hz".format(f) for f in np.fft.rfftfreq(n, 1.0 / self.fs)]
+
+    def size(self, n):
+        """
+        :param n: window length in samples
+        :return: number of features per window
+        """
+        return len(self.bands) if self.bands is not None else n // 2 + 1
+
+    def __call__(self, windows):
+        """
+        Features of a 2-D array of windows (n, samples), in one chunk
+        :return: float32 array (n, size)
+        """
+        windows = np.asarray(windows, dtype=np.float32)
+        taper, scale, matrix = self.plan(windows.shape[1])
+        spectrum = np.fft.rfft(windows * taper, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2).astype(np.float32, copy=False)
+        power *= scale
+        if matrix is not None:
+            power = power @ matrix
+        if self.log:
+            np.log(power + np.float32(1e-12), out=power)
+        return power
+
+    def chunk_rows(self, n):
+        """
+        :param n: window length in samples
+        :return: number of rows per chunk within max_bytes
+        """
+        # float32 input and tapered copy, complex spectrum and float32 power per sample
+        return max(1, int(self.max_bytes // (n * 4 * 6)))
+
+    def transform(self, matrix, columns=slice(None), out=None):
+        """
+        Features of all rows of a matrix, in chunks of rows bounded by max_bytes
+        :param matrix: 2-D array or EEG.Dataset (rows, samples), rows are read one chunk at a time
+        :param columns: columns of the rows to use, e.g. slice(300, 1000) to skip the first 300 samples
+        :param out: optional float32 array (rows, size) to write to, e.g. a memory-mapped array
+        :return: float32 array (rows, size)
+        """
+        rows, width = matrix.shape
+        n = len(range(width)[columns])
+        if out is None:
+            out = np.empty((rows, self.size(n)), dtype=np.float32)
+        step = self.chunk_rows(n)
+        for start in range(0, rows, step):
+            stop = min(start + step, rows)
+            out[start:stop] = self(matrix[start:stop, columns])
+        return out
+
+
+class StatisticsFeatures:
+    """
+    Time domain statistics of every row: mean, standard deviation, minimum, maximum, peak to peak
+    and mean absolute difference between successive samples
+    """
+    version = 1
+    names = ["mean", "std", "min", "max", "ptp", "mean_abs_diff"]
+
+    def params(self):
+        """
+        :return: dict of the parameters that determine the features
+        """
+        return {}
+
+    def size(self, n):
+        """
+        :param n: window length in samples
+        :return: number of features per window
+        """
+        return len(self.names)
+
+    def __call__(self, windows):
+        """
+        :param windows: 2-D array (n, samples)
+        :return: float32 array (n, 6)
+        """
+        windows = np.asarray(windows, dtype=np.float32)
+        minimum = windows.min(axis=1)
+        maximum = windows.max(axis=1)
+        return np.stack((windows.mean(axis=1), windows.std(axis=1), minimum, maximum, maximum - minimum,
+                         np.abs(np.diff(windows, axis=1)).mean(axis=1)), axis=1).astype(np.float32)
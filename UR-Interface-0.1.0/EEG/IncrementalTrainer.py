@@ -0,0 +1,220 @@
+"""
+Incremental training on new recording sessions
+
+The scaler and the model are kept in a directory and updated with every new session instead of being
+refitted on all recordings. The scaler keeps a running mean and variance (StandardScaler.partial_fit),
+the model must support partial_fit, e.g. SGDClassifier, PassiveAggressiveClassifier, Perceptron,
+MultinomialNB/GaussianNB or MLPClassifier. Only the rows of the new session are read and
+transformed, so an update costs time proportional to the new data.
+
+A part of every new session is held out. The accuracy on it is reported before and after the update,
+together with the accuracy on the held-out rows of the earlier sessions.
+The scaler.pkl and model.pkl files can be loaded by EEG.InferenceService.
+
+Example (from the UR-Interface-0.1.0 directory):
+    python -m EEG.IncrementalTrainer model ../RawData_Collection/npy [recording names]
+"""
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+from EEG.Dataset import Dataset
+from EEG.FeatureCache import describe_columns, describe_stage
+from EEG.Features import BANDS, FFTFeatures, StatisticsFeatures
+from EEG.InferenceService import load_model
+from EEG.ModelComparison import build
+
+try:
+    import joblib
+except ImportError:
+    joblib = None
+
+DEFAULT_MODEL = {"name": "SGD", "estimator": "sklearn.linear_model.SGDClassifier",
+                 "params": {"loss": "modified_huber", "random_state": 0}}
+
+
+def save_model(obj, path):
+    """
+    Saves a scaler or model the way the notebook does, with joblib when available
+    """
+    if joblib is not None:
+        joblib.dump(obj, path)
+    else:
+        with open(path, "wb") as file:
+            pickle.dump(obj, file)
+
+
+class IncrementalTrainer:
+    """
+    Persistent scaler and model that are updated with partial_fit, one session at a time
+
+    Example:
+    trainer = IncrementalTrainer('model')
+    report = trainer.update(Dataset('../RawData_Collection/npy', recordings=['Robert_session3']))
+    """
+
+    def __init__(self, directory, stages=None, columns=slice(300, 1000), model=DEFAULT_MODEL,
+                 classes=("left", "right"), batch_rows=64, epochs=5, holdout=0.2, seed=7):
+        """
+        :param directory: directory of the persisted state, created on the first update
+        :param stages: feature stages (see EEG.Pipeline), Hann tapered log band powers and statistics when None
+        :param columns: columns of the rows to use
+        :param model: estimator spec of a partial_fit capable model (see EEG.ModelComparison), used for a new state
+        :param classes: all label names the model can predict, partial_fit needs them up front
+        :param batch_rows: rows per mini-batch
+        :param epochs: passes over the rows of a new session
+        :param holdout: share of every new session held out for validation
+        :param seed: seed of the holdout selection and the batch order
+        """
+        self.directory = directory
+        self.stages = stages if stages is not None else [FFTFeatures(taper="hann", log=True, bands=BANDS),
+                                                          StatisticsFeatures()]
+        self.columns = columns
+        self.batch_rows = batch_rows
+        self.epochs = epochs
+        self.holdout = holdout
+        self.random = np.random.RandomState(seed)
+
+        self.state = {"classes": list(classes), "columns": describe_columns(columns),
+                      "stages": [describe_stage(stage) for stage in self.stages], "model": model, "sessions": []}
+        self.scaler = None
+        self.model = None
+        self.validation = (np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=object))
+        if os.path.exists(self._path("state.json")):
+            self.load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """
+        Loads the persisted state, the stages and columns must match the ones it was trained with
+        """
+        with open(self._path("state.json")) as file:
+            state = json.load(file)
+        if state["stages"] != self.state["stages"] or state["columns"] != self.state["columns"]:
+            raise ValueError("The model in {} was trained on other features: {} {}".format(
+                self.directory, state["stages"], state["columns"]))
+        self.state = state
+        self.scaler = load_model(self._path("scaler.pkl"))
+        self.model = load_model(self._path("model.pkl"))
+        with np.load(self._path("validation.npz"), allow_pickle=True) as validation:
+            self.validation = (validation["x"], validation["y"])
+
+    def save(self):
+        """
+        Writes the state, each file is replaced only after it has been written completely
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name, obj in (("scaler.pkl", self.scaler), ("model.pkl", self.model)):
+            save_model(obj, self._path(name + ".tmp"))
+            os.replace(self._path(name + ".tmp"), self._path(name))
+        with open(self._path("validation.npz.tmp"), "wb") as file:
+            np.savez(file, x=self.validation[0], y=self.validation[1])
+        os.replace(self._path("validation.npz.tmp"), self._path("validation.npz"))
+        with open(self._path("state.json.tmp"), "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(self._path("state.json.tmp"), self._path("state.json"))
+
+    def features(self, dataset, rows):
+        """
+        Features of dataset rows, computed per mini-batch
+        :param dataset: EEG.Dataset
+        :param rows: 1-D array of row indices
+        :return: float32 array (rows, features)
+        """
+        parts = []
+        for start in range(0, len(rows), self.batch_rows):
+            windows = dataset.take(rows[start:start + self.batch_rows], self.columns).astype(np.float32)
+            parts.append(np.concatenate([stage(windows) for stage in self.stages], axis=1))
+        return np.concatenate(parts)
+
+    def accuracy(self, x, y):
+        """
+        :return: accuracy of the current model on the features and label names, None without a model or rows
+        """
+        if self.model is None or len(y) == 0:
+            return None
+        return float(np.mean(self.model.predict(self.scaler.transform(x)) == y))
+
+    def update(self, dataset, rows=None):
+        """
+        Folds new rows into the scaler and the model and saves the state
+        :param dataset: EEG.Dataset with the new session
+        :param rows: row indices to train on, all rows of recordings that were not trained on before when None
+        :return: dict with the recordings, row counts, timing and the accuracies before and after the update
+        """
+        start = time.perf_counter()
+        trained = {name for session in self.state["sessions"] for name in session["recordings"]}
+        if rows is None:
+            new = [i for i, meta in enumerate(dataset.meta) if meta["name"] not in trained]
+            rows = np.flatnonzero(np.isin(dataset.recording, new))
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return None
+
+        names = np.array(dataset.label_names, dtype=object)[dataset.labels[rows]]
+        unknown = set(names) - set(self.state["classes"])
+        if unknown:
+            raise ValueError("Labels {} are not in the classes {}".format(sorted(unknown), self.state["classes"]))
+
+        held = self.random.rand(len(rows)) < self.holdout
+        x = self.features(dataset, rows)
+        x_train, y_train = x[~held], names[~held]
+        x_held, y_held = x[held], names[held]
+        x_old, y_old = self.validation
+        report = {
+            "recordings": sorted({dataset.meta[i]["name"] for i in np.unique(dataset.recording[rows])}),
+            "rows": int(len(rows)), "held_out": int(np.sum(held)),
+            "before": self.accuracy(x_held, y_held), "before_previous": self.accuracy(x_old, y_old),
+        }
+
+        if self.scaler is None:
+            from sklearn.preprocessing import StandardScaler
+            self.scaler = StandardScaler()
+            self.model = build(self.state["model"])
+        for first in range(0, len(x_train), self.batch_rows):
+            self.scaler.partial_fit(x_train[first:first + self.batch_rows])
+
+        scaled = self.scaler.transform(x_train)
+        classes = np.array(self.state["classes"], dtype=object)
+        for epoch in range(self.epochs):
+            order = self.random.permutation(len(scaled))
+            for first in range(0, len(order), self.batch_rows):
+                batch = order[first:first + self.batch_rows]
+                self.model.partial_fit(scaled[batch], y_train[batch], classes=classes)
+
+        if len(y_held):
+            self.validation = (np.concatenate((x_old, x_held)) if len(y_old) else x_held,
+                               np.concatenate((y_old, y_held)))
+        report.update(after=self.accuracy(x_held, y_held), after_previous=self.accuracy(x_old, y_old),
+                      seconds=time.perf_counter() - start, time=time.time())
+        self.state["sessions"].append(report)
+        self.save()
+        return report
+
+
+def print_report(report):
+    """
+    Prints the result of an update
+    """
+    def percentage(accuracy):
+        return "-" if accuracy is None else "{:.1f}%".format(100 * accuracy)
+
+    print("Trained on {} rows of {} in {:.2f}s, {} rows held out".format(
+        report["rows"] - report["held_out"], ", ".join(report["recordings"]), report["seconds"], report["held_out"]))
+    print("New session:       {} -> {}".format(percentage(report["before"]), percentage(report["after"])))
+    print("Earlier sessions:  {} -> {}".format(percentage(report["before_previous"]),
+                                               percentage(report["after_previous"])))
+
+
+if __name__ == '__main__':
+    report = IncrementalTrainer(sys.argv[1]).update(Dataset(sys.argv[2], sys.argv[3:] or None))
+    if report is None:
+        print("No new recordings")
+    else:
+        print_report(report)
@@ -0,0 +1,251 @@
+import os
+import pickle
+import time
+from collections import deque, namedtuple
+from threading import Thread, Condition, Lock
+
+import numpy as np
+
+from Diagnostics.Tracer import tracer
+
+# A single classification of a window
+# index: the index passed with the window, probabilities: float32 array per class,
+# label: most likely class, probability: its probability, submitted / done: time.perf_counter() stamps
+Prediction = namedtuple("Prediction", "index probabilities label probability submitted done")
+
+
+def load_model(path):
+    """
+    Loads a trained scaler or model as saved by the notebook
+    .pkl files are loaded with joblib (or pickle), .json files as a Keras model with the weights in the .h5 file,
+    .npz files as an EEG.CompactModel export
+    :param path: path to the .pkl, .json or .npz file
+    :return: the loaded object
+    """
+    root, extension = os.path.splitext(path)
+    if extension == ".json":
+        from keras.models import model_from_json
+        with open(path) as file:
+            model = model_from_json(file.read())
+        model.load_weights(root + ".h5")
+        return model
+    if extension == ".npz":
+        from EEG.CompactModel import CompactModel
+        return CompactModel(path)
+    try:  # imported here, a NumPy only runtime loading a .npz does not need it
+        import joblib
+    except ImportError:  # scalers saved with joblib.dump need joblib, plain pickles do not
+        joblib = None
+    if joblib is not None:
+        return joblib.load(path)
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+
+def probability_function(model):
+    """
+    Selects the function returning class probabilities of a model
+    :param model: sklearn estimator, Keras model or any object with predict_proba
+    :return: function mapping a 2-D array of scaled features to a 2-D array of probabilities
+    """
+    if hasattr(model, "predict_proba"):
+        return model.predict_proba
+    if hasattr(model, "layers"):  # Keras, the output layer is a softmax
+        return lambda x: model.predict(x, batch_size=len(x), verbose=0)
+    if hasattr(model, "decision_function"):
+        def decision(x):
+            p = 1 / (1 + np.exp(-np.asarray(model.decision_function(x), dtype=np.float64)))
+            return np.stack((1 - p, p), axis=1)
+        return decision
+
+    def hard(x):  # regressors as used in the notebook, rounded to the nearest class
+        classes = np.clip(np.rint(model.predict(x)), 0, 1).astype(int)
+        return np.eye(2)[classes]
+    return hard
+
+
+class InferenceService:
+    """
+    Classifies windows of the live stream in a background thread
+
+    Windows are submitted from the stream, all pending windows are classified together in one batch.
+    The control loop polls the most recent prediction with latest(), which is thread safe.
+    The scaler and model can be swapped while running, the new pair is warmed up before it replaces
+    the old one so the stream is never paused.
+
+    Example:
+    service = InferenceService.load('scaler.pkl', 'classifier.pkl').start()
+    service.submit(window)
+    prediction = service.latest()
+    """
+
+    def __init__(self, scaler, model, features=None, classes=("left", "right"), max_batch=32, n_features=None,
+                 max_pending=256):
+        """
+        :param scaler: fitted scaler with transform(), None to skip scaling
+        :param model: trained model, see probability_function
+        :param features: optional function turning a 2-D array of windows into the model features,
+        e.g. FFTFeatures or WaveletFeatures.transform, must be the same function that was used for training
+        :param classes: class names in the order of the model outputs
+        :param max_batch: maximum number of windows classified together
+        :param n_features: length of a submitted window, used for the warm up.
+        Read from the scaler when not given and no features function is used
+        :param max_pending: maximum number of windows waiting for classification, the oldest are dropped
+        when the classification falls behind, only the latest prediction is kept anyway
+        """
+        self.features = features
+        self.classes = classes
+        self.max_batch = max_batch
+        self.n_features = n_features
+
+        self._pipeline = self._warm(scaler, model)
+        self._pending = deque(maxlen=max_pending)
+        self.dropped = 0    # windows dropped before classification
+        self.failed = 0     # batches that raised
+        self._condition = Condition()
+        self._lock = Lock()
+        self._latest = None
+        self._latencies = deque(maxlen=1000)
+
+        self.thread = None
+        self.running = False
+
+    @classmethod
+    def load(cls, scaler_path="scaler.pkl", model_path="classifier.pkl", **kwargs):
+        """
+        Loads the scaler and model once at startup
+        :param scaler_path: path of the scaler, None for no scaling
+        :param model_path: path of the model (.pkl, Keras .json or CompactModel .npz)
+        :return: InferenceService
+        """
+        scaler = load_model(scaler_path) if scaler_path is not None else None
+        return cls(scaler, load_model(model_path), **kwargs)
+
+    def _warm(self, scaler, model, repeats=3):
+        """
+        Runs the pair on dummy windows so the first real window does not pay for lazy initialisation
+        :return: the (scaler, probability function) pair
+        """
+        predict = probability_function(model)
+        n_features = self.n_features
+        if n_features is None and scaler is not None and self.features is None:
+            n_features = getattr(scaler, "n_features_in_", None)
+            if n_features is None and getattr(scaler, "mean_", None) is not None:
+                n_features = len(scaler.mean_)
+        if n_features is None and scaler is None and self.features is None:
+            n_features = getattr(model, "n_features_in_", None)
+        if n_features:
+            dummy = np.zeros((self.max_batch, n_features), dtype=np.float32)
+            for _ in range(repeats):
+                self._run((scaler, predict), dummy)
+        return scaler, predict
+
+    def _run(self, pipeline, windows):
+        scaler, predict = pipeline
+        x = windows if self.features is None else self.features(windows)
+        if scaler is not None:
+            x = scaler.transform(x)
+        return np.asarray(predict(x), dtype=np.float32)
+
+    def swap(self, scaler, model):
+        """
+        Replaces the scaler and model without pausing the stream
+        The new pair is warmed up on the calling thread, windows in flight finish on the old pair
+        """
+        pipeline = self._warm(scaler, model)
+        with self._lock:
+            self._pipeline = pipeline
+
+    def start(self):
+        """
+        Start classifying submitted windows
+        :return: self as object
+        """
+        if self.running:
+            return None
+        self.running = True
+        self.thread = Thread(target=self._update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the classification thread
+        """
+        if self.running:
+            self.running = False
+            with self._condition:
+                self._condition.notify()
+            self.thread.join(1)
+
+    def submit(self, window, index=None):
+        """
+        Queue a window for classification
+        :param window: 1-D array with the samples or features of one window
+        :param index: identifier returned with the prediction, e.g. the sample count of the stream
+        """
+        item = (index, np.asarray(window, dtype=np.float32), time.perf_counter(), tracer.current())
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(item)
+            self._condition.notify()
+
+    def _update(self):
+        while self.running:
+            with self._condition:
+                while self.running and not self._pending:
+                    self._condition.wait()
+                batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch))]
+            if batch:
+                try:
+                    self._classify(batch)
+                except Exception as error:  # a bad window must not end the service
+                    self.failed += 1
+                    print("Inference error, {} windows skipped: {!r}".format(len(batch), error))
+
+    def _classify(self, batch):
+        with self._lock:
+            pipeline = self._pipeline
+        start = time.perf_counter()
+        probabilities = self._run(pipeline, np.stack([item[1] for item in batch]))
+        done = time.perf_counter()
+
+        (index, _, submitted, _), p = batch[-1], probabilities[-1]
+        best = int(np.argmax(p))
+        prediction = Prediction(index, p, self.classes[best], float(p[best]), submitted, done)
+        with self._lock:
+            self._latest = prediction
+            self._latencies.extend(done - item[2] for item in batch)
+        for item in batch:
+            if item[3] is not None:
+                item[3].add("inference", start, done)
+
+    def predict(self, windows):
+        """
+        Classifies windows directly on the calling thread
+        :param windows: 2-D array (n, window)
+        :return: float32 probabilities (n, classes)
+        """
+        with self._lock:
+            pipeline = self._pipeline
+        return self._run(pipeline, np.asarray(windows, dtype=np.float32))
+
+    def latest(self):
+        """
+        :return: the most recent Prediction, None if no window has been classified yet
+        """
+        with self._lock:
+            return self._latest
+
+    def latency(self):
+        """
+        Latency from submit to prediction over the last 1000 windows
+        :return: dict with the 50th, 90th and 99th percentile in milliseconds
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+        if len(latencies) == 0:
+            return {}
+        p50, p90, p99 = np.percentile(latencies * 1000, (50, 90, 99))
+        return {"p50": p50, "p90": p90, "p99": p99}
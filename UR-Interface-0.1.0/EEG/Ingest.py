@@ -0,0 +1,189 @@
+"""
+Chunked ingest of the CSV recordings with a per row quality index
+
+The CSV is parsed a fixed number of rows at a time and written straight into the memory-mapped
+sample matrix of the compact format (see EEG.Dataset), so memory does not grow with the file size.
+For every row the quality index stores:
+    duplicate_ratio  fraction of samples equal to the previous sample (sample-and-hold duplicates)
+    runs             number of runs of identical samples
+    longest_run      length of the longest run of identical samples
+    effective_rate   rate of new values in Hz, rate * runs / samples
+    clip_ratio       fraction of samples at or beyond the clipping level
+    flags            bitmask of DUPLICATES, FLAT and CLIPPED
+
+The recorder (mindwave-recorder) samples the latest raw value of the headset much faster than the
+headset sends them, every value is held for about 14 samples. Duplicates and flat runs are therefore
+flagged relative to this expected hold: a clean row has a duplicate ratio of about 0.93.
+
+Convert all recordings (from the UR-Interface-0.1.0 directory):
+    python -m EEG.Ingest ../RawData_Collection ../RawData_Collection/npy
+"""
+import csv
+import glob
+import os
+import sys
+
+import numpy as np
+
+from EEG.Dataset import INT16_MIN, INT16_MAX, parse_name, write_meta
+
+# Quality flags
+DUPLICATES = 1      # more duplicated samples than max_duplicate_ratio
+FLAT = 2            # a run of identical samples longer than flat_samples
+CLIPPED = 4         # samples at the clipping level
+
+# Rate of the raw values of the headset in Hz
+HEADSET_RATE = 512.0
+# Rate at which the recorder takes samples in Hz: it sleeps 100 us between samples, with the overhead
+# of the sleeps about 72 of the 1000 samples of a row in RawData_Collection are new values
+RECORDER_RATE = 7100.0
+
+QUALITY_DTYPE = np.dtype([
+    ("duplicate_ratio", np.float32),
+    ("runs", np.int32),
+    ("longest_run", np.int32),
+    ("effective_rate", np.float32),
+    ("clip_ratio", np.float32),
+    ("flags", np.uint8),
+])
+
+
+def count_rows(path):
+    """
+    Counts the data rows of a CSV without parsing it
+    """
+    with open(path, "rb") as file:
+        return max(0, sum(1 for line in file if line.strip()) - 1)
+
+
+def iter_csv(path, chunk_rows=256):
+    """
+    Parses a recording CSV a fixed number of rows at a time
+    :param path: path of the CSV
+    :param chunk_rows: rows per chunk
+    :return: generator of (int16 samples (rows, samples), list of labels)
+    """
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        if header[-1] != "label":
+            raise ValueError("{}: last column should be the label".format(path))
+        width = len(header) - 1
+
+        rows = []
+        for row in reader:
+            if row:
+                rows.append(row)
+            if len(rows) == chunk_rows:
+                yield _parse(path, rows, width)
+                rows = []
+        if rows:
+            yield _parse(path, rows, width)
+
+
+def _parse(path, rows, width):
+    samples = np.array([row[:-1] for row in rows], dtype=np.int64).reshape(len(rows), width)
+    if samples.min() < INT16_MIN or samples.max() > INT16_MAX:
+        raise ValueError("{}: samples do not fit in int16".format(path))
+    return samples.astype(np.int16), [row[-1] for row in rows]
+
+
+def quality(samples, rate=RECORDER_RATE, source_rate=HEADSET_RATE, clip=2047, max_duplicate_ratio=None,
+            flat_samples=None):
+    """
+    Run-length analysis of a block of rows
+    :param samples: 2-D array (rows, samples)
+    :param rate: rate at which the samples of a row were taken in Hz
+    :param source_rate: rate of new values in Hz, every value is held for rate / source_rate samples
+    :param clip: absolute value at which the signal is clipped
+    :param max_duplicate_ratio: duplicate ratio above which a row is flagged with DUPLICATES,
+    when None a row is flagged with less than half the expected new values
+    :param flat_samples: run length from which a row is flagged with FLAT,
+    when None a value held for 8 values of the source
+    :return: structured array (rows,) of QUALITY_DTYPE
+    """
+    hold = max(rate / source_rate, 1.0)
+    if max_duplicate_ratio is None:
+        max_duplicate_ratio = 1 - 0.5 / hold
+    if flat_samples is None:
+        flat_samples = int(round(8 * hold))
+    samples = np.asarray(samples)
+    n_rows, n = samples.shape
+    result = np.zeros(n_rows, dtype=QUALITY_DTYPE)
+    if n_rows == 0 or n == 0:
+        return result
+
+    # A run starts at the first sample of a row and wherever the value changes
+    starts = np.ones((n_rows, n), dtype=bool)
+    starts[:, 1:] = samples[:, 1:] != samples[:, :-1]
+    runs = starts.sum(axis=1)
+
+    # Run lengths over the flattened rows, every row starts a new run so runs never cross rows
+    positions = np.flatnonzero(starts.ravel())
+    lengths = np.diff(np.append(positions, n_rows * n))
+    first_run = np.concatenate(([0], np.cumsum(runs)[:-1]))
+    longest = np.maximum.reduceat(lengths, first_run)
+
+    result["runs"] = runs
+    result["longest_run"] = longest
+    result["duplicate_ratio"] = (n - runs) / max(n - 1, 1)
+    result["effective_rate"] = rate * runs / n
+    result["clip_ratio"] = np.mean(np.abs(samples.astype(np.int32)) >= clip, axis=1)
+
+    flags = np.zeros(n_rows, dtype=np.uint8)
+    flags[result["duplicate_ratio"] > max_duplicate_ratio] |= DUPLICATES
+    flags[longest >= flat_samples] |= FLAT
+    flags[result["clip_ratio"] > 0] |= CLIPPED
+    result["flags"] = flags
+    return result
+
+
+def ingest(source, target, chunk_rows=256, **quality_options):
+    """
+    Converts a CSV recording to the compact format with its quality index
+    :param source: path of the CSV
+    :param target: output directory
+    :param chunk_rows: rows parsed at a time
+    :param quality_options: options passed to quality()
+    :return: path of the metadata file
+    """
+    name = os.path.splitext(os.path.basename(source))[0]
+    os.makedirs(target, exist_ok=True)
+    n_rows = count_rows(source)
+    with open(source, newline="") as file:
+        width = len(next(csv.reader(file))) - 1
+
+    samples = np.lib.format.open_memmap(os.path.join(target, name + ".samples.npy"), mode="w+",
+                                        dtype=np.int16, shape=(n_rows, width))
+    index = np.lib.format.open_memmap(os.path.join(target, name + ".quality.npy"), mode="w+",
+                                      dtype=QUALITY_DTYPE, shape=(n_rows,))
+    labels = []
+    row = 0
+    for chunk, chunk_labels in iter_csv(source, chunk_rows):
+        samples[row:row + len(chunk)] = chunk
+        index[row:row + len(chunk)] = quality(chunk, **quality_options)
+        labels.extend(chunk_labels)
+        row += len(chunk)
+    samples.flush()
+    index.flush()
+    del samples, index
+
+    names = sorted(set(labels))
+    codes = {label: code for code, label in enumerate(names)}
+    np.save(os.path.join(target, name + ".labels.npy"), np.array([codes[label] for label in labels], dtype=np.uint8))
+    subject, session = parse_name(source)
+    return write_meta(target, name, names, n_rows, width, subject, session, source)
+
+
+def ingest_directory(source, target, chunk_rows=256, **quality_options):
+    """
+    Converts all CSV recordings of a directory
+    :return: list of metadata paths
+    """
+    return [ingest(path, target, chunk_rows, **quality_options)
+            for path in sorted(glob.glob(os.path.join(source, "*.csv")))]
+
+
+if __name__ == '__main__':
+    for path in ingest_directory(sys.argv[1], sys.argv[2]):
+        print(path)
@@ -0,0 +1,358 @@
+"""
+Parallel cross-validation of many estimators on the same feature matrix
+
+Every (estimator, fold) pair is a job. Jobs run on a pool of worker processes that memory-map the
+feature matrix, so the matrix is in memory once and shared through the page cache.
+A job that runs longer than the timeout is stopped by terminating its worker, which is then replaced.
+The timeout of a job starts when its worker is ready, after it started and imported the estimators.
+Results are appended to a CSV file as soon as a job finishes, an interrupted comparison continues
+where it stopped when it is run again with the same results file. Jobs that timed out are run again then.
+
+Example (from the UR-Interface-0.1.0 directory):
+    comparison = ModelComparison(DEFAULT_SPECS, folds=10, timeout=600, memory_limit=4 * 2 ** 30)
+    comparison.run(x, dataset.labels, 'comparison.csv')
+    comparison.print_summary('comparison.csv')
+Or with features and labels saved as .npy files and optionally the specs in a JSON file:
+    python -m EEG.ModelComparison features.npy labels.npy comparison.csv [specs.json]
+"""
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows, memory limits are then not applied
+    resource = None
+
+# An estimator spec: the name in the results, the import path of the class, its parameters and
+# whether the features are standardised first (fitted on the training rows of the fold only)
+DEFAULT_SPECS = [
+    {"name": "LR", "estimator": "sklearn.linear_model.LogisticRegression", "params": {}, "scale": True},
+    {"name": "LDA", "estimator": "sklearn.discriminant_analysis.LinearDiscriminantAnalysis", "params": {}},
+    {"name": "KNN", "estimator": "sklearn.neighbors.KNeighborsClassifier",
+     "params": {"n_neighbors": 3, "leaf_size": 10}, "scale": True},
+    {"name": "CART", "estimator": "sklearn.tree.DecisionTreeClassifier", "params": {}},
+    {"name": "SVC", "estimator": "sklearn.svm.SVC", "params": {"gamma": "scale"}, "scale": True},
+    {"name": "NuSVC", "estimator": "sklearn.svm.NuSVC", "params": {"gamma": "scale"}, "scale": True},
+    {"name": "RandomForest", "estimator": "sklearn.ensemble.RandomForestClassifier",
+     "params": {"n_estimators": 700, "max_depth": 2, "random_state": 0}},
+    {"name": "ExtraTrees", "estimator": "sklearn.ensemble.ExtraTreesClassifier",
+     "params": {"n_estimators": 700, "random_state": 0}},
+    {"name": "AdaBoost", "estimator": "sklearn.ensemble.AdaBoostClassifier", "params": {}},
+    {"name": "MLP", "estimator": "sklearn.neural_network.MLPClassifier",
+     "params": {"alpha": 1, "max_iter": 1000}, "scale": True},
+    {"name": "GaussianProcess", "estimator": "sklearn.gaussian_process.GaussianProcessClassifier",
+     "params": {}, "scale": True},
+    {"name": "XGBoost", "estimator": "xgboost.XGBClassifier", "params": {}},
+]
+
+FIELDS = ["model", "fold", "folds", "status", "accuracy", "fit_time", "predict_time", "model_bytes",
+          "train_rows", "test_rows"]
+
+
+def build(spec):
+    """
+    :param spec: estimator spec, see DEFAULT_SPECS
+    :return: a new unfitted estimator
+    """
+    module, name = spec["estimator"].rsplit(".", 1)
+    estimator = getattr(importlib.import_module(module), name)(**spec.get("params", {}))
+    if spec.get("scale"):
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        estimator = make_pipeline(StandardScaler(), estimator)
+    return estimator
+
+
+def assign_folds(labels, folds, seed=7):
+    """
+    Stratified assignment of the rows to folds, every fold gets about the same share of every label
+    :param labels: label per row
+    :param folds: number of folds
+    :param seed: seed of the shuffle
+    :return: int32 fold per row
+    """
+    labels = np.asarray(labels)
+    if not 2 <= folds <= len(labels):
+        raise ValueError("Number of folds must be between 2 and the number of rows ({})".format(len(labels)))
+    random = np.random.RandomState(seed)
+    assignment = np.empty(len(labels), dtype=np.int32)
+    offset = 0
+    for label in np.unique(labels):
+        rows = random.permutation(np.flatnonzero(labels == label))
+        assignment[rows] = (offset + np.arange(len(rows))) % folds
+        offset += len(rows)
+    return assignment
+
+
+def run_job(x, y, assignment, spec, fold):
+    """
+    Fits and scores one estimator on one fold
+    :return: dict of the result, see FIELDS
+    """
+    test = assignment == fold
+    result = {"model": spec["name"], "fold": fold, "train_rows": int(np.sum(~test)), "test_rows": int(np.sum(test))}
+    try:
+        model = build(spec)
+        start = time.perf_counter()
+        model.fit(x[~test], y[~test])
+        fit_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predicted = model.predict(x[test])
+        predict_time = time.perf_counter() - start
+
+        result.update(status="ok", accuracy=float(np.mean(predicted == y[test])), fit_time=fit_time,
+                      predict_time=predict_time, model_bytes=len(pickle.dumps(model)))
+    except MemoryError:
+        result["status"] = "memory"
+    except Exception as e:
+        result["status"] = "error: {}: {}".format(type(e).__name__, e)
+    return result
+
+
+def worker(connection, directory, memory_limit, modules=()):
+    """
+    Worker process, imports the modules of the estimators, reports "ready" and then runs the (spec, fold)
+    jobs received on the connection until it receives None
+    """
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception:  # reported by the jobs that need it
+            pass
+    x = np.load(os.path.join(directory, "features.npy"), mmap_mode="r")
+    y = np.load(os.path.join(directory, "labels.npy"))
+    assignment = np.load(os.path.join(directory, "folds.npy"))
+    connection.send("ready")
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        connection.send(run_job(x, y, assignment, *job))
+
+
+def read_results(path):
+    """
+    :param path: results CSV file
+    :return: list of result rows, empty when the file does not exist
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as file:
+        return list(csv.DictReader(file))
+
+
+class ModelComparison:
+    """
+    Cross-validates a list of estimator specs on a pool of worker processes
+
+    Every result row holds the accuracy, the fit and predict time in seconds and the pickled size of the
+    fitted model of one (model, fold) pair. Jobs that fail get a status instead of an accuracy:
+    timeout, memory (the memory limit was reached), crashed (the worker died) or the error message.
+    A job with a status in retry is run again by the next run(), the last row of a pair counts.
+    """
+
+    def __init__(self, specs=DEFAULT_SPECS, folds=10, workers=None, timeout=600, memory_limit=None, seed=7,
+                 retry=("timeout",)):
+        """
+        :param specs: list of estimator specs, see DEFAULT_SPECS
+        :param folds: number of cross-validation folds
+        :param workers: number of worker processes, os.cpu_count() when None
+        :param timeout: maximum seconds of a single job, None for no limit
+        :param memory_limit: maximum address space of a worker in bytes, None for no limit (not on Windows)
+        :param seed: seed of the fold assignment
+        :param retry: statuses of jobs that are run again when the comparison is resumed
+        """
+        names = [spec["name"] for spec in specs]
+        if len(set(names)) != len(names):
+            raise ValueError("Spec names must be unique")
+        self.specs = list(specs)
+        self.folds = folds
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.seed = seed
+        self.retry = tuple(retry)
+
+    def latest(self, results):
+        """
+        :param results: path of the results file
+        :return: dict of (model, fold) to the last result row of this number of folds
+        """
+        return {(row["model"], int(row["fold"])): row for row in read_results(results)
+                if int(row["folds"]) == self.folds}
+
+    def jobs(self, results):
+        """
+        :param results: path of the results file
+        :return: list of (spec, fold) that have no result yet, or whose last status is in retry
+        """
+        done = {key for key, row in self.latest(results).items() if row["status"] not in self.retry}
+        return [(spec, fold) for spec in self.specs for fold in range(self.folds)
+                if (spec["name"], fold) not in done]
+
+    def run(self, x, y, results="comparison.csv"):
+        """
+        Runs all jobs that are not in the results file yet, or whose last status is in retry
+        :param x: 2-D feature matrix (rows, features), e.g. the output of EEG.Pipeline
+        :param y: label per row
+        :param results: path of the CSV file the results are appended to
+        :return: number of jobs run
+        """
+        jobs = self.jobs(results)
+        if not jobs:
+            return 0
+        directory = tempfile.mkdtemp(prefix="comparison")
+        try:
+            np.save(os.path.join(directory, "features.npy"), np.asarray(x, dtype=np.float32))
+            np.save(os.path.join(directory, "labels.npy"), np.asarray(y))
+            np.save(os.path.join(directory, "folds.npy"), assign_folds(y, self.folds, self.seed))
+
+            new = not os.path.exists(results)
+            with open(results, "a", newline="") as file:
+                writer = csv.DictWriter(file, FIELDS)
+                if new:
+                    writer.writeheader()
+
+                def record(result):
+                    result["folds"] = self.folds
+                    writer.writerow(result)
+                    file.flush()
+                    print("{:<20} fold {:4d} {}".format(result["model"], result["fold"], result.get(
+                        "accuracy", result["status"])))
+
+                self._schedule(jobs, directory, record)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return len(jobs)
+
+    def _start(self, directory):
+        modules = sorted({spec["estimator"].rsplit(".", 1)[0] for spec in self.specs}
+                         | {"sklearn.pipeline", "sklearn.preprocessing"})
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=worker, args=(child, directory, self.memory_limit, modules),
+                                          daemon=True)
+        process.start()
+        child.close()
+        return {"process": process, "connection": parent, "job": None, "started": None, "ready": False}
+
+    def _stop(self, slot):
+        slot["process"].terminate()
+        slot["process"].join()
+        slot["connection"].close()
+
+    def _schedule(self, jobs, directory, record):
+        """
+        Hands the jobs to the workers once they are ready and records their results, replaces workers that
+        time out or die
+        """
+        pending = list(reversed(jobs))
+        slots = [self._start(directory) for _ in range(min(self.workers, len(jobs)))]
+        try:
+            while True:
+                for slot in slots:
+                    if slot["ready"] and slot["job"] is None and pending:
+                        slot["job"] = pending.pop()
+                        slot["started"] = time.perf_counter()
+                        slot["connection"].send(slot["job"])
+                busy = [slot for slot in slots if slot["job"] is not None]
+                if not busy and not pending:
+                    break
+
+                wait_time = None
+                if self.timeout is not None and busy:
+                    deadline = min(slot["started"] for slot in busy) + self.timeout
+                    wait_time = max(0.0, deadline - time.perf_counter())
+                starting = [slot for slot in slots if not slot["ready"]] if pending else []
+                ready = wait([slot["connection"] for slot in busy + starting], wait_time)
+
+                for i, slot in enumerate(slots):
+                    if not slot["ready"]:
+                        if slot["connection"] in ready:
+                            try:
+                                slot["connection"].recv()
+                            except EOFError:
+                                raise RuntimeError("A worker died while starting, is the memory limit too low?")
+                            slot["ready"] = True
+                        continue
+                    if slot["job"] is None:
+                        continue
+                    spec, fold = slot["job"]
+                    status = None
+                    if slot["connection"] in ready:
+                        try:
+                            record(slot["connection"].recv())
+                            slot["job"] = None
+                            continue
+                        except EOFError:
+                            status = "crashed"
+                    elif self.timeout is not None and time.perf_counter() - slot["started"] >= self.timeout:
+                        status = "timeout"
+                    if status is not None:
+                        record({"model": spec["name"], "fold": fold, "status": status})
+                        self._stop(slot)
+                        slots[i] = self._start(directory)
+        finally:
+            for slot in slots:
+                if slot["job"] is None:
+                    slot["connection"].send(None)
+                    slot["process"].join()
+                else:
+                    self._stop(slot)
+
+    def summary(self, results="comparison.csv"):
+        """
+        :param results: path of the results file
+        :return: list of dicts per model: mean and std accuracy, mean fit and predict time, mean model size
+        and the number of ok and failed folds, best model first
+        """
+        models = {}
+        for (model, _), row in self.latest(results).items():
+            models.setdefault(model, []).append(row)
+
+        summary = []
+        for name, rows in models.items():
+            ok = [row for row in rows if row["status"] == "ok"]
+
+            def mean(field):
+                return float(np.mean([float(row[field]) for row in ok])) if ok else float("nan")
+
+            summary.append({"model": name, "accuracy": mean("accuracy"),
+                            "std": float(np.std([float(row["accuracy"]) for row in ok])) if ok else float("nan"),
+                            "fit_time": mean("fit_time"), "predict_time": mean("predict_time"),
+                            "model_bytes": mean("model_bytes"), "ok": len(ok), "failed": len(rows) - len(ok)})
+        return sorted(summary, key=lambda entry: -entry["accuracy"] if entry["ok"] else 1.0)
+
+    def print_summary(self, results="comparison.csv"):
+        """
+        Prints the summary table of the results
+        """
+        print("{:<20} {:>8} {:>7} {:>10} {:>12} {:>12} {:>5} {:>6}".format(
+            "model", "accuracy", "std", "fit (s)", "predict (s)", "size (kB)", "ok", "failed"))
+        for entry in self.summary(results):
+            print("{:<20} {:8.3f} {:7.3f} {:10.4f} {:12.5f} {:12.1f} {:5d} {:6d}".format(
+                entry["model"], entry["accuracy"], entry["std"], entry["fit_time"], entry["predict_time"],
+                entry["model_bytes"] / 1024, entry["ok"], entry["failed"]))
+
+
+if __name__ == '__main__':
+    specs = DEFAULT_SPECS
+    if len(sys.argv) > 4:
+        with open(sys.argv[4]) as spec_file:
+            specs = json.load(spec_file)
+    comparison = ModelComparison(specs)
+    comparison.run(np.load(sys.argv[1], mmap_mode="r"), np.load(sys.argv[2]), sys.argv[3])
+    comparison.print_summary(sys.argv[3])
@@ -0,0 +1,195 @@
+"""
+Parallel feature computation over all converted recordings
+
+The dataset is split into shards of rows per recording. Every shard is computed by a worker of a
+process pool, which memory-maps the sample matrix of its recording and writes its features straight
+into a shared memory-mapped output matrix, so no arrays are pickled between the processes.
+The rows of the output are in dataset order, independent of the number of workers.
+
+Example (from the UR-Interface-0.1.0 directory):
+    pipeline = Pipeline([FFTFeatures(log=True), WaveletFeatures(), StatisticsFeatures()], columns=slice(300, 1000))
+    x = pipeline.run(Dataset('../RawData_Collection/npy'))
+    pipeline.print_report()
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def run_shard(task):
+    """
+    Computes the features of one shard, runs in a worker process
+    :param task: (sample path, start row, stop row, columns, stages, output path, output row, chunk rows)
+    :return: seconds spent on reading, on each stage and on writing
+    """
+    path, start, stop, columns, stages, out_path, out_row, chunk_rows = task
+    samples = np.load(path, mmap_mode="r")
+    out = np.load(out_path, mmap_mode="r+")
+    timings = np.zeros(len(stages) + 2)
+
+    for first in range(start, stop, chunk_rows):
+        last = min(first + chunk_rows, stop)
+        begin = time.perf_counter()
+        windows = np.asarray(samples[first:last, columns], dtype=np.float32)
+        timings[0] += time.perf_counter() - begin
+
+        parts = []
+        for i, stage in enumerate(stages):
+            begin = time.perf_counter()
+            parts.append(stage(windows))
+            timings[i + 1] += time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        row = out_row + first - start
+        out[row:row + last - first] = np.concatenate(parts, axis=1)
+        timings[-1] += time.perf_counter() - begin
+
+    out.flush()
+    return timings
+
+
+class Pipeline:
+    """
+    Runs feature stages over a dataset on a process pool
+
+    A stage is any picklable object with stage(windows) -> float32 (n, k) and stage.size(samples) -> k,
+    e.g. FFTFeatures, WaveletFeatures or StatisticsFeatures.
+    The features of the stages are concatenated in the order of the stages, see columns_of().
+    With a FeatureCache, shards computed before with the same data and stages are read from the cache,
+    the stages then need a params() method that returns the parameters that determine their features.
+    """
+
+    def __init__(self, stages, columns=slice(None), shard_rows=128, chunk_rows=64, cache=None):
+        """
+        :param stages: list of feature stages
+        :param columns: columns of the rows to use, e.g. slice(300, 1000) to skip the first 300 samples
+        :param shard_rows: maximum number of rows per shard
+        :param chunk_rows: rows a worker computes at a time, bounds the memory per worker
+        :param cache: optional FeatureCache for the features of the shards
+        """
+        self.stages = list(stages)
+        self.columns = columns
+        self.shard_rows = shard_rows
+        self.chunk_rows = chunk_rows
+        self.cache = cache
+        self.timings = None
+
+    def sizes(self, width):
+        """
+        :param width: samples per row of the dataset
+        :return: number of features of every stage
+        """
+        n = len(range(width)[self.columns])
+        return [stage.size(n) for stage in self.stages]
+
+    def columns_of(self, width):
+        """
+        :param width: samples per row of the dataset
+        :return: the column slice of every stage in the output
+        """
+        ends = np.cumsum([0] + self.sizes(width))
+        return [slice(int(a), int(b)) for a, b in zip(ends[:-1], ends[1:])]
+
+    def shards(self, dataset, rows=None):
+        """
+        Splits the dataset by recording and row range
+        :param dataset: EEG.Dataset
+        :param rows: optional (start, stop) range of dataset rows
+        :return: list of (recording, start row in recording, stop row in recording, output row)
+        """
+        start, stop = rows if rows is not None else (0, len(dataset))
+        shards = []
+        for recording in range(len(dataset.meta)):
+            first = max(start, int(dataset.offsets[recording]))
+            last = min(stop, int(dataset.offsets[recording + 1]))
+            for row in range(first, last, self.shard_rows):
+                local = row - int(dataset.offsets[recording])
+                shards.append((recording, local, local + min(self.shard_rows, last - row), row - start))
+        return shards
+
+    def run(self, dataset, out=None, rows=None, workers=None):
+        """
+        Computes the features of the dataset
+        :param dataset: EEG.Dataset
+        :param out: path of the .npy file to write the features to, the result is then memory-mapped.
+        When None the result is returned in memory
+        :param rows: optional (start, stop) range of dataset rows
+        :param workers: number of worker processes, os.cpu_count() when None, 0 to run in this process
+        :return: float32 feature matrix (rows, sum of the stage sizes)
+        """
+        start = time.perf_counter()
+        first, last = rows if rows is not None else (0, len(dataset))
+        shape = (last - first, sum(self.sizes(dataset.width)))
+
+        temporary = out is None
+        if temporary:
+            handle, out = tempfile.mkstemp(suffix=".npy")
+            os.close(handle)
+        try:
+            np.lib.format.open_memmap(out, mode="w+", dtype=np.float32, shape=shape).flush()
+
+            tasks = [(dataset.sample_path(recording), a, b, self.columns, self.stages, out, row, self.chunk_rows)
+                     for recording, a, b, row in self.shards(dataset, rows)]
+
+            cached = 0
+            keys = []
+            if self.cache is not None:
+                result = np.load(out, mmap_mode="r+")
+                missing = []
+                for task in tasks:
+                    path, a, b, _, _, _, row, _ = task
+                    key = self.cache.key(path, a, b, self.columns, self.stages)
+                    features = self.cache.get(key)
+                    if features is None:
+                        keys.append(key)
+                        missing.append(task)
+                    else:
+                        result[row:row + b - a] = features
+                        cached += 1
+                result.flush()
+                del result
+                tasks = missing
+
+            if workers == 0:
+                timings = [run_shard(task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(workers) as pool:
+                    timings = list(pool.map(run_shard, tasks))
+
+            result = np.load(out, mmap_mode="r")
+            for task, key in zip(tasks, keys):
+                _, a, b, _, _, _, row, _ = task
+                self.cache.put(key, result[row:row + b - a])
+            if temporary:
+                result = np.array(result)
+        finally:
+            # the temporary file is removed also when a worker raised
+            if temporary:
+                os.remove(out)
+
+        names = ["read"] + [type(stage).__name__ for stage in self.stages] + ["write"]
+        totals = np.sum(timings, axis=0) if timings else np.zeros(len(names))
+        self.timings = dict(zip(names, totals))
+        self.timings["wall"] = time.perf_counter() - start
+        self.timings["rows"] = shape[0]
+        self.timings["shards"] = len(tasks) + cached
+        self.timings["cached"] = cached
+        return result
+
+    def print_report(self):
+        """
+        Prints the time spent per stage (summed over the workers) and the wall time of the last run
+        """
+        if self.timings is None:
+            return
+        timings = dict(self.timings)
+        wall, rows, shards = timings.pop("wall"), timings.pop("rows"), timings.pop("shards")
+        cached = timings.pop("cached")
+        busy = sum(timings.values())
+        for name, seconds in timings.items():
+            print("{:<20} {:8.3f}s".format(name, seconds))
+        print("{:<20} {:8.3f}s for {} rows in {} shards ({} cached), {:.0f} rows/s, parallelism {:.1f}".format(
+            "wall", wall, rows, shards, cached, rows / wall if wall else 0, busy / wall if wall else 0))
@@ -0,0 +1,324 @@
+"""
+Labelled recording sessions of the raw headset stream
+
+Every raw sample is stored with its running index and the arrival time of its packet. Samples are appended
+to the active chunk file in small batches and a chunk is closed (fsync, then renamed from .part to .bin)
+when it holds chunk_samples samples, so memory use does not grow with the length of a session.
+Cues, labels and the other packets of the connector (eSense, blinkStrength, poorSignalLevel) are written
+to a separate event stream, one JSON object per line with the sample index at which they happened.
+
+A session directory holds:
+    samples-000000.bin, ...     records of RECORD_DTYPE
+    samples-000003.part         the active chunk, whole records up to the last flush
+    events.jsonl                {"index": ..., "time": ..., "kind": ..., "value": ...} per line
+    session.json                written when the session is finalised
+
+A session that was not finalised (crash, power loss) is finalised by recover(), which drops a partly
+written record and closes the active chunk. Because every record carries its index, lost or duplicated
+samples would show up as gaps, see Session.check().
+
+Record a session from the UR-Interface-0.1.0 directory, with cues in the console:
+    python -m EEG.SessionRecorder sessions/robert1 30
+"""
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+# index of the sample in the session, arrival time of its packet (time.time()) and the raw value
+RECORD_DTYPE = np.dtype([("index", "<i8"), ("time", "<f8"), ("value", "<i2")])
+
+# samples before and from the cue on in a trial, the 1000 sample rows of RawData_Collection,
+# the feature pipelines skip the first 300 samples with columns=slice(300, 1000)
+BEFORE = 300
+AFTER = 700
+
+
+def _write_json(path, data):
+    """
+    Writes a JSON file under a temporary name and renames it, a reader never sees a partial file
+    """
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class SessionRecorder:
+    """
+    Streams samples and events of a session to disk
+
+    Example:
+    with SessionRecorder('sessions/robert1') as recorder:
+        recorder.add_sample(value, arrival_time)
+        recorder.add_event('cue', 'left')
+    """
+
+    def __init__(self, directory, chunk_samples=65536, flush_samples=256, meta=None):
+        """
+        :param directory: new session directory
+        :param chunk_samples: samples per chunk file
+        :param flush_samples: samples buffered in memory before they are appended to the active chunk
+        :param meta: optional dict stored in session.json, e.g. subject and session
+        """
+        if os.path.exists(os.path.join(directory, "events.jsonl")):
+            raise ValueError("{} already contains a session".format(directory))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_samples = chunk_samples
+        self.meta = dict(meta or {})
+        self.started = time.time()
+        self.count = 0          # samples recorded
+        self.chunks = 0         # closed chunks
+
+        self._buffer = np.empty(flush_samples, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self._in_chunk = 0
+        self._chunk = None
+        self._lock = threading.Lock()
+        self._events = open(os.path.join(directory, "events.jsonl"), "a")
+        self.closed = False
+
+    def _chunk_path(self, number, extension):
+        return os.path.join(self.directory, "samples-{:06d}.{}".format(number, extension))
+
+    def add_sample(self, value, arrival=None):
+        """
+        Records a raw sample
+        :param value: raw value of the sample
+        :param arrival: time.time() at which its packet arrived, now when None
+        """
+        with self._lock:
+            record = self._buffer[self._buffered]
+            record["index"] = self.count
+            record["time"] = time.time() if arrival is None else arrival
+            record["value"] = value
+            self._buffered += 1
+            self.count += 1
+            if self._buffered == len(self._buffer) or self._in_chunk + self._buffered == self.chunk_samples:
+                self._flush()
+
+    def add_event(self, kind, value=None, arrival=None):
+        """
+        Records an event at the current sample index
+        :param kind: e.g. 'cue', 'label', 'packet'
+        :param value: JSON serialisable value
+        :param arrival: time.time() of the event, now when None
+        """
+        with self._lock:
+            line = json.dumps({"index": self.count, "time": time.time() if arrival is None else arrival,
+                               "kind": kind, "value": value})
+            self._events.write(line + "\n")
+            self._events.flush()
+
+    def _flush(self):
+        """
+        Appends the buffered records to the active chunk and closes the chunk when it is full
+        """
+        if self._buffered == 0:
+            return
+        if self._chunk is None:
+            self._chunk = open(self._chunk_path(self.chunks, "part"), "ab")
+        self._chunk.write(self._buffer[:self._buffered].tobytes())
+        self._chunk.flush()
+        self._in_chunk += self._buffered
+        self._buffered = 0
+        if self._in_chunk == self.chunk_samples:
+            self._close_chunk()
+
+    def _close_chunk(self):
+        os.fsync(self._chunk.fileno())
+        self._chunk.close()
+        os.replace(self._chunk_path(self.chunks, "part"), self._chunk_path(self.chunks, "bin"))
+        self._chunk = None
+        self._in_chunk = 0
+        self.chunks += 1
+
+    def close(self):
+        """
+        Flushes all samples, closes the active chunk and writes session.json
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self._flush()
+            if self._chunk is not None:
+                self._close_chunk()
+            os.fsync(self._events.fileno())
+            self._events.close()
+            self.closed = True
+            meta = dict(self.meta, started=self.started, finished=time.time(), samples=self.count,
+                        chunks=self.chunks, chunk_samples=self.chunk_samples)
+            _write_json(os.path.join(self.directory, "session.json"), meta)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, connection, stop=None):
+        """
+        Records every packet of a ThinkGearConnection (opened with raw=True) until it closes or stop is set
+        Raw samples get the arrival time of their packet, other packets are recorded as 'packet' events
+        :param connection: connected ThinkGearConnection
+        :param stop: optional threading.Event
+        """
+        while stop is None or not stop.is_set():
+            try:
+                packet = connection.read_packet()
+            except (OSError, ValueError):  # the connection was closed by another thread
+                break
+            if packet is None:
+                break
+            if "rawEeg" in packet:
+                self.add_sample(packet["rawEeg"], connection.received)
+            else:
+                self.add_event("packet", packet, connection.received)
+
+
+def recover(directory):
+    """
+    Finalises a session that was not closed: drops a partly written record, closes the active chunk
+    and writes session.json
+    :param directory: session directory
+    :return: number of recovered samples
+    """
+    parts = sorted(glob.glob(os.path.join(directory, "samples-*.part")))
+    for path in parts:
+        size = os.path.getsize(path)
+        with open(path, "r+b") as file:
+            file.truncate(size - size % RECORD_DTYPE.itemsize)
+            os.fsync(file.fileno())
+        os.replace(path, path[:-len(".part")] + ".bin")
+    session = Session(directory, finalised=False)
+    samples = len(session.samples())
+    meta = {"started": None, "finished": None, "samples": samples, "chunks": len(session.paths),
+            "chunk_samples": None, "recovered": True}
+    _write_json(os.path.join(directory, "session.json"), meta)
+    return samples
+
+
+class Session:
+    """
+    A recorded session directory
+    """
+
+    def __init__(self, directory, finalised=True):
+        """
+        :param directory: session directory
+        :param finalised: require session.json, see recover()
+        """
+        path = os.path.join(directory, "session.json")
+        if finalised and not os.path.exists(path):
+            raise ValueError("Session {} was not finalised, run recover() first".format(directory))
+        self.directory = directory
+        self.meta = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.meta = json.load(file)
+        self.paths = sorted(glob.glob(os.path.join(directory, "samples-*.bin")))
+
+    def samples(self):
+        """
+        :return: all records of the session, chunk files are memory-mapped and then concatenated
+        """
+        chunks = [np.memmap(path, dtype=RECORD_DTYPE, mode="r") for path in self.paths if os.path.getsize(path)]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=RECORD_DTYPE)
+
+    def events(self, kind=None):
+        """
+        :param kind: only return events of this kind
+        :return: list of event dicts
+        """
+        events = []
+        with open(os.path.join(self.directory, "events.jsonl")) as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:  # last line of a crashed session
+                    continue
+                if kind is None or event["kind"] == kind:
+                    events.append(event)
+        return events
+
+    def check(self):
+        """
+        :return: number of missing and duplicated sample indices
+        """
+        steps = np.diff(self.samples()["index"])
+        return int(np.sum(steps[steps > 1] - 1)), int(np.sum(steps < 1))
+
+    def trials(self, before=BEFORE, after=AFTER):
+        """
+        Cut the session into trials around every cue, in the layout of the recorder CSV files
+        :param before: samples before the cue
+        :param after: samples from the cue on
+        :return: int16 array (trials, before + after) and the label of every trial
+        """
+        values = self.samples()["value"]
+        rows, labels = [], []
+        for cue in self.events("cue"):
+            start = cue["index"] - before
+            if start >= 0 and cue["index"] + after <= len(values):
+                rows.append(values[start:cue["index"] + after])
+                labels.append(cue["value"])
+        return np.array(rows, dtype=np.int16).reshape(len(rows), before + after), labels
+
+    def export_csv(self, path, before=BEFORE, after=AFTER):
+        """
+        Appends the trials to a CSV file with the v1, ..., vN, label layout of RawData_Collection
+        """
+        rows, labels = self.trials(before, after)
+        new = not os.path.exists(path)
+        with open(path, "a") as file:
+            if new:
+                file.write(",".join("v{}".format(i + 1) for i in range(before + after)) + ",label\n")
+            for row, label in zip(rows, labels):
+                file.write(",".join(map(str, row)) + "," + label + "\n")
+        return len(rows)
+
+
+def run_cues(recorder, trials, before=BEFORE, after=AFTER, pause=0.5, modes=("left", "right")):
+    """
+    Shows random cues in the console, timed by the number of recorded samples
+    """
+    def wait_samples(n):
+        target = recorder.count + n
+        while recorder.count < target:
+            time.sleep(0.01)
+
+    for i in range(trials):
+        mode = random.choice(modes)
+        print("Trial {} / {}: rest".format(i + 1, trials))
+        wait_samples(before)
+        recorder.add_event("cue", mode)
+        print("  " + ("<<<<< LEFT" if mode == "left" else "RIGHT >>>>>"))
+        wait_samples(after)
+        recorder.add_event("label", mode)
+        time.sleep(pause)
+
+
+if __name__ == '__main__':
+    from Communication.ThinkGearConnection import ThinkGearConnection
+
+    directory = sys.argv[1]
+    headset = ThinkGearConnection(raw=True).connect()
+    recorder = SessionRecorder(directory)
+    reader = threading.Thread(target=recorder.record, args=(headset,), daemon=True)
+    reader.start()
+    try:
+        run_cues(recorder, int(sys.argv[2]) if len(sys.argv) > 2 else 30)
+    finally:
+        headset.disconnect()
+        reader.join(1)
+        recorder.close()
+    session = Session(directory)
+    print("Recorded {} samples, {} missing, {} duplicated".format(len(session.samples()), *session.check()))
+    print("Exported {} trials".format(session.export_csv(os.path.join(directory, "rawData.csv"))))
@@ -0,0 +1,233 @@
+import numpy as np
+
+# Decomposition filter banks (low pass, high pass), identical to pywt.Wavelet(name).dec_lo / dec_hi
+FILTER_BANKS = {
+    "db4": (
+        (-0.010597401785069032, 0.0328830116668852, 0.030841381835560764, -0.18703481171909309,
+         -0.027983769416859854, 0.6308807679298589, 0.7148465705529157, 0.2303778133088965),
+        (-0.2303778133088965, 0.7148465705529157, -0.6308807679298589, -0.027983769416859854,
+         0.18703481171909309, 0.030841381835560764, -0.0328830116668852, -0.010597401785069032),
+    ),
+}
+
+# Statistics computed over the coefficients of every level
+STATISTICS = ("energy", "mean_abs", "std", "max_abs")
+
+
+class WaveletFeatures:
+    """
+    Multilevel discrete wavelet decomposition of windows of raw EEG samples
+
+    Each level convolves the approximation of the previous level with the low and high pass
+    filters and keeps every second output. Only outputs whose filter support lies completely inside
+    the window are kept (no edge extension), so a window always gives the same coefficients
+    whether it is decomposed offline or while streaming (see WaveletStream).
+
+    The coefficients are returned in pywt order: [cA<level>, cD<level>, ..., cD1]
+    The features have shape (windows, (level + 1) * len(STATISTICS)), float32,
+    ordered by band then statistic, see WaveletFeatures.names
+    """
+    # Increase when the computed features change, used to invalidate cached features
+    version = 1
+
+    def __init__(self, wavelet="db4", level=6):
+        """
+        :param wavelet: name of the wavelet, see FILTER_BANKS
+        :param level: number of decomposition levels
+        """
+        if wavelet not in FILTER_BANKS:
+            raise ValueError("Unknown wavelet {}, choose from {}".format(wavelet, sorted(FILTER_BANKS)))
+        lo, hi = FILTER_BANKS[wavelet]
+
+        self.wavelet = wavelet
+        self.level = level
+        # Reversed filters, turns the convolution into a sum of strided slices
+        self._lo = np.array(lo[::-1], dtype=np.float32)
+        self._hi = np.array(hi[::-1], dtype=np.float32)
+        self.filter_length = len(lo)
+
+        self.bands = ["cA{}".format(level)] + ["cD{}".format(j) for j in range(level, 0, -1)]
+        self.names = ["{}_{}".format(band, stat) for band in self.bands for stat in STATISTICS]
+
+    def params(self):
+        """
+        :return: dict of the parameters that determine the features
+        """
+        return {"wavelet": self.wavelet, "level": self.level}
+
+    def size(self, n):
+        """
+        :param n: window length in samples
+        :return: number of features per window
+        """
+        return len(self.names)
+
+    def lengths(self, n):
+        """
+        Number of coefficients per band for windows of n samples
+        :param n: window length in samples
+        :return: list of lengths in pywt order [cA<level>, cD<level>, ..., cD1]
+        """
+        lengths = []
+        for j in range(self.level):
+            n = (n - self.filter_length) // 2 + 1
+            if n < 1:
+                raise ValueError("Window too short for a level {} decomposition".format(self.level))
+            lengths.append(n)
+        return [lengths[-1]] + lengths[::-1]
+
+    def step(self, x):
+        """
+        A single decomposition level along axis 1
+        :param x: 2-D float32 array (n, samples)
+        :return: approximation and detail coefficients, each (n, (samples - filter_length) // 2 + 1)
+        """
+        m = (x.shape[1] - self.filter_length) // 2 + 1
+        if m < 1:
+            empty = np.empty((x.shape[0], 0), dtype=np.float32)
+            return empty, empty
+        stop = 2 * (m - 1) + 1
+        approximation = self._lo[0] * x[:, 0:stop:2]
+        detail = self._hi[0] * x[:, 0:stop:2]
+        for k in range(1, self.filter_length):
+            approximation += self._lo[k] * x[:, k:k + stop:2]
+            detail += self._hi[k] * x[:, k:k + stop:2]
+        return approximation, detail
+
+    def decompose(self, windows):
+        """
+        Decomposes a batch of windows
+        :param windows: 2-D array (n, samples)
+        :return: list of float32 coefficient arrays in pywt order, shapes (n, lengths(samples)[i])
+        """
+        approximation = np.asarray(windows, dtype=np.float32)
+        self.lengths(approximation.shape[1])
+        details = []
+        for j in range(self.level):
+            approximation, detail = self.step(approximation)
+            details.append(detail)
+        return [approximation] + details[::-1]
+
+    def statistics(self, coefficients):
+        """
+        Per band statistics of decomposed windows
+        :param coefficients: list of coefficient arrays as returned by decompose
+        :return: float32 array (n, level + 1, len(STATISTICS))
+        """
+        n = coefficients[0].shape[0]
+        features = np.empty((n, len(coefficients), len(STATISTICS)), dtype=np.float32)
+        for i, c in enumerate(coefficients):
+            magnitude = np.abs(c)
+            features[:, i, 0] = np.sum(c * c, axis=1)
+            features[:, i, 1] = np.mean(magnitude, axis=1)
+            features[:, i, 2] = np.std(c, axis=1)
+            features[:, i, 3] = np.max(magnitude, axis=1)
+        return features
+
+    def transform(self, windows):
+        """
+        Wavelet features of a batch of windows
+        :param windows: 2-D array (n, samples), e.g. the rows of a recording
+        :return: float32 array (n, (level + 1) * len(STATISTICS)), columns as in self.names
+        """
+        features = self.statistics(self.decompose(windows))
+        return features.reshape(features.shape[0], -1)
+
+    def __call__(self, windows):
+        return self.transform(windows)
+
+
+class WaveletStream:
+    """
+    Streaming wavelet features over a sliding window of raw samples
+
+    Every level keeps the coefficients of the current window and the inputs that have not been
+    filtered yet. Each hop only the coefficients of the new samples are computed,
+    the coefficients shared with the previous window are reused.
+
+    The window and hop must be multiples of 2 ** level so each window starts at the same phase
+    of the downsampling, the features are then equal to WaveletFeatures.transform of the window.
+    """
+
+    def __init__(self, window=1024, hop=64, wavelet="db4", level=6):
+        """
+        :param window: number of samples in the sliding window
+        :param hop: number of samples between emitted feature vectors
+        :param wavelet: name of the wavelet, see FILTER_BANKS
+        :param level: number of decomposition levels
+        """
+        step = 2 ** level
+        if window % step != 0 or hop % step != 0:
+            raise ValueError("Window and hop must be multiples of {}".format(step))
+
+        self.features = WaveletFeatures(wavelet, level)
+        self.window = window
+        self.hop = hop
+        self.names = self.features.names
+
+        lengths = self.features.lengths(window)
+        # Coefficient lengths per level in decomposition order (cD1 first), approximation last
+        self._lengths = lengths[:0:-1] + [lengths[0]]
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all levels
+        """
+        self._inputs = [np.empty((1, 0), dtype=np.float32) for _ in range(self.features.level)]
+        self._details = [np.empty((1, 0), dtype=np.float32) for _ in range(self.features.level)]
+        self._approximation = np.empty((1, 0), dtype=np.float32)
+        self._until_hop = self.hop
+        self.count = 0
+        self.latest = None
+
+    def push(self, samples):
+        """
+        Add raw samples and compute the features of every hop that completed
+        :param samples: a single sample or a sequence of samples
+        :return: sample counts at the end of each emitted window (n,) and the features (n, len(names))
+        """
+        samples = np.asarray(samples, dtype=np.float32).ravel()
+        indices = []
+        features = []
+
+        offset = 0
+        while offset < len(samples):
+            n = min(len(samples) - offset, self._until_hop)
+            self._inputs[0] = np.concatenate((self._inputs[0], samples[None, offset:offset + n]), axis=1)
+            self._until_hop -= n
+            self.count += n
+            offset += n
+
+            if self._until_hop == 0:
+                self._until_hop = self.hop
+                self._update()
+                if self.count >= self.window:
+                    indices.append(self.count)
+                    features.append(self._window_features())
+
+        if not features:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(self.names)), dtype=np.float32)
+        self.latest = features[-1]
+        return np.array(indices, dtype=np.int64), np.stack(features)
+
+    def _update(self):
+        """
+        Runs the new inputs through all levels
+        """
+        for j in range(self.features.level):
+            x = self._inputs[j]
+            approximation, detail = self.features.step(x)
+            consumed = 2 * approximation.shape[1]
+            self._inputs[j] = x[:, consumed:]
+
+            self._details[j] = np.concatenate((self._details[j], detail), axis=1)[:, -self._lengths[j]:]
+            if j + 1 < self.features.level:
+                self._inputs[j + 1] = np.concatenate((self._inputs[j + 1], approximation), axis=1)
+            else:
+                self._approximation = np.concatenate(
+                    (self._approximation, approximation), axis=1)[:, -self._lengths[-1]:]
+
+    def _window_features(self):
+        coefficients = [self._approximation] + self._details[::-1]
+        return self.features.statistics(coefficients)[0].reshape(-1)
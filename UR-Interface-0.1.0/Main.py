@@ -2,22 +2,37 @@
 # import numpy as np
 import time
 
+from Communication.ThinkGearConnection import ThinkGearConnection
+from EEG.BandPower import BandPower
+from EEG.InferenceService import InferenceService
 from Robot.UR.URRobot import URRobot
+from Robot.UR.MotionExecutor import MotionExecutor
+from Diagnostics.Startup import Startup
+from Diagnostics.Tracer import tracer
 
 # Start camera and view it
 # camera = Camera().start()
 # camera.show()
+# Detect coins in the background
+# detection = DetectionStage(camera, HoughDetector()).start()
+# calibration = Calibration.load('calibration.json')    # or Calibration.default()
 
 host = "192.168.0.11"
-robot = URRobot(host)
-
-# Set TCP offset
-robot.set_tcp((0.05, -0.05, 0.295, 0, 0, 0))
-time.sleep(0.5)
-
-# Set the starting position ((-0.10, -0.8, 0.3, 0, 3.14, 0))
-robot.reset_position()
-time.sleep(2)
+robot = URRobot(host, connect=False)
+startup = Startup()
+
+# Connect, set the TCP offset and go to the starting position ((-0.10, -0.8, 0.3, 0, 3.14, 0))
+# reset_position returns as soon as the position is reached
+with startup.phase("robot connect"):
+    connected = robot.connect()
+if not connected:
+    startup.print_report()
+    raise SystemExit("Robot not reachable at {}".format(host))
+with startup.phase("robot home"):
+    home = robot.reset_position()
+startup.print_report()
+if not home:
+    raise SystemExit("Starting position not reached")
 print(robot.is_up())
 print(robot.is_down())
 # robot.change_magnet_state()
@@ -29,25 +44,72 @@ print(robot.is_down())
 # robot.move_forward()     # (x+5, y+50, z)
 
 
+# Executes the commands on its own thread, a newer command preempts the move in flight
+executor = MotionExecutor(robot).start()
+
+
 def process_commands(command):
-    if command == 1:
-        robot.move_right()
-    elif command == 2:
-        robot.move_left()
-    elif command == 3:
-        robot.move_down()
-    elif command == 4:
-        robot.move_up()
-    elif command == 5:
-        robot.move_backward()
-    elif command == 6:
-        robot.move_forward()
-    elif command == 7:
-        robot.change_magnet_state()
-    elif command == 8:
-        robot.reset_position()
-    else:
-        robot.stopj()
+    """
+    Queues a command for the robot and returns immediately, see MotionExecutor
+    1-6 move right, left, down, up, backward and forward, 7 toggles the magnet, 8 resets the position,
+    any other command stops the arm
+    """
+    executor.submit(command)
+
+
+# Commands for the classes of the left/right classifier
+class_commands = {"left": 2, "right": 1}
+
+
+def process_prediction(prediction, threshold=0.7):
+    """
+    Turns the latest prediction of the InferenceService into a command
+    :param prediction: Prediction as returned by InferenceService.latest()
+    :param threshold: minimum probability of the predicted class to move
+    """
+    with tracer.span("decision"):
+        command = None
+        if prediction is not None and prediction.probability >= threshold:
+            command = class_commands[prediction.label]
+    if command is not None:
+        process_commands(command)
+
+
+def classify_stream(headset, band_power, service):
+    """
+    Classifies the raw samples of the headset and turns every new prediction into a command
+    :param headset: ThinkGearConnection opened with raw=True
+    :param band_power: BandPower computing the features of the sliding window
+    :param service: started InferenceService
+    """
+    last = None
+    for packet in headset.packets():
+        if 'rawEeg' in packet:
+            indices, features = band_power.push(packet['rawEeg'])
+            for index, window in zip(indices, features):
+                service.submit(window, int(index))
+        prediction = service.latest()
+        if prediction is not None and prediction is not last:
+            last = prediction
+            process_prediction(prediction)
+
+
+# Classify the live stream and poll the latest prediction
+# The window of 700 samples matches the columns 300:1000 of the training rows, BandPower computes the
+# FFTFeatures(taper='hann', log=True, bands=BANDS) the classifier is trained on 16 times per second
+with startup.phase("headset connect"):
+    headset = ThinkGearConnection(raw=True).connect()
+band_power = BandPower(fs=512, window=700, rate=16, log=True)
+with startup.phase("classifier load"):
+    service = InferenceService.load('scaler.pkl', 'classifier.pkl').start()
+try:
+    classify_stream(headset, band_power, service)
+finally:
+    print('Connection closed, shutting down')
+    service.stop()
+    executor.stop()
+    robot.stopj()
+    headset.disconnect()
 
 
 """
@@ -83,8 +145,7 @@ def process_frame(frame):
 	return frame, circle_data
 """
 
-# Todo: Create class around the get_camera_position_data function
-# Todo: Create offset input for the camera
+# Replaced by Vision.Calibration, kept for reference
 """
 def get_camera_position_data(tcp_position, circles):
 	
@@ -144,10 +205,10 @@ def bin_picking_2d_coin():
 	while True:
 		key = cv2.waitKey(1)
 
-		# Processes a camera frame to look for circles
+		# Takes the latest circles of the detection stage
 		if key == 102:  # f
-			frame = camera.read()  # create snapshot for processing
-			frame, circles = process_frame(frame)  # process the frame and search for circles
+			result = detection.latest()
+			circles = result.circles[None] if result is not None and len(result.circles) else None
 
 		elif key == 32:  # space
 			# Circle has been found, time to pick it up
@@ -157,7 +218,7 @@ def bin_picking_2d_coin():
 
 				# Align the TCP with the object
 				tcp_position = robot.get_tcp_position()
-				pose = get_camera_position_data(tcp_position, circles)
+				pose = calibration.pick(circles[0], tcp_position)
 				robot.movel(pose)
 				time.sleep(4)
 
@@ -212,6 +273,7 @@ def bin_picking_2d_coin():
 					print("Returning Home")
 					state = 0
 		elif key == 27:  # escape
+			detection.stop()
 			camera.stop_view()
 			camera.stop()
 			break
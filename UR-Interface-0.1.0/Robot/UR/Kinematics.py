@@ -0,0 +1,335 @@
+"""
+Forward and inverse kinematics of the UR arms, to validate poses without the robot
+
+Poses are (x, y, z, rx, ry, rz) in m and radians like URScript poses, joints are 6 angles in radians.
+All functions take batches, one pose or joint position per row.
+
+Validate the starting position and the draw_* figures from the UR-Interface-0.1.0 directory:
+    python -m Robot.UR.Kinematics [UR10]
+"""
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Denavit-Hartenberg parameters of the UR arms in m and radians (Universal Robots, DH parameters for calculations
+# of kinematics and dynamics), the joints rotate about z: T = Rz(q) Tz(d) Tx(a) Rx(alpha)
+DH = namedtuple("DH", "d a alpha")
+PRESETS = {
+    "UR3": DH((0.1519, 0, 0, 0.11235, 0.08535, 0.0819), (0, -0.24365, -0.21325, 0, 0, 0),
+              (np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0)),
+    "UR5": DH((0.089159, 0, 0, 0.10915, 0.09465, 0.0823), (0, -0.425, -0.39225, 0, 0, 0),
+              (np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0)),
+    "UR10": DH((0.1273, 0, 0, 0.163941, 0.1157, 0.0922), (0, -0.612, -0.5723, 0, 0, 0),
+               (np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0)),
+}
+
+# Result of Kinematics.check, one entry per pose
+# joints: (n, 6) solution closest to the reference joints, NaN when there is none,
+# reachable / within_limits / singular / ok: (n,) booleans, margins: (n, 3) shoulder, elbow and wrist margin
+Validation = namedtuple("Validation", "joints reachable within_limits singular ok margins")
+
+# The translations of the URRobot.draw_* figures from the starting position, in m
+FIGURES = {
+    "square": ((0, -0.1, 0), (0.1, 0, 0), (0, 0.1, 0)),
+    "rectangle": ((0, -0.1, 0), (0.25, 0, 0), (0, 0.1, 0)),
+    "triangle": ((-0.15, -np.sqrt(0.2 ** 2 - 0.15 ** 2), 0), (0.15, 0, 0)),
+}
+
+
+def pose_to_matrix(poses):
+    """
+    :param poses: (n, 6) or (6,) poses, rotation as axis-angle
+    :return: (n, 4, 4) homogeneous transforms
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 6)
+    vector = poses[:, 3:]
+    angle = np.linalg.norm(vector, axis=1)
+    axis = vector / np.where(angle > 1e-12, angle, 1.0)[:, None]
+    x, y, z = axis.T
+    zero = np.zeros_like(x)
+    k = np.stack((zero, -z, y, z, zero, -x, -y, x, zero), axis=1).reshape(-1, 3, 3)
+    s, c = np.sin(angle)[:, None, None], np.cos(angle)[:, None, None]
+    matrices = np.tile(np.eye(4), (len(poses), 1, 1))
+    matrices[:, :3, :3] += s * k + (1 - c) * np.matmul(k, k)
+    matrices[:, :3, 3] = poses[:, :3]
+    return matrices
+
+
+def matrix_to_pose(matrices):
+    """
+    :param matrices: (n, 4, 4) homogeneous transforms
+    :return: (n, 6) poses, rotation as axis-angle with an angle in [0, pi]
+    """
+    r = matrices[:, :3, :3]
+    cos = np.clip((np.trace(r, axis1=1, axis2=2) - 1) / 2, -1, 1)
+    angle = np.arccos(cos)
+    w = np.stack((r[:, 2, 1] - r[:, 1, 2], r[:, 0, 2] - r[:, 2, 0], r[:, 1, 0] - r[:, 0, 1]), axis=1)
+    sin = np.sin(angle)
+    vector = w * np.where(sin > 1e-6, angle / (2 * np.where(sin > 1e-6, sin, 1)), 0.5)[:, None]
+
+    # near pi sin is too small, the axis follows from R + R^T = 2 cos I + 2 (1 - cos) k k^T
+    # and its sign from w = 2 sin k
+    near = cos < -0.99
+    if np.any(near):
+        rn, cn = r[near], cos[near][:, None]
+        rows = np.arange(len(rn))
+        squares = (np.diagonal(rn, axis1=1, axis2=2) - cn) / (1 - cn)
+        largest = np.argmax(squares, axis=1)
+        length = np.sqrt(np.clip(squares[rows, largest], 1e-12, None))
+        axis = (rn[rows, largest] + rn[rows, :, largest]) / (2 * (1 - cn) * length[:, None])
+        axis[rows, largest] = length
+        axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+        axis[np.sum(axis * w[near], axis=1) < 0] *= -1
+        vector[near] = axis * angle[near][:, None]
+    return np.concatenate((matrices[:, :3, 3], vector), axis=1)
+
+
+class Kinematics:
+    """
+    Vectorised kinematics of a UR arm with a TCP offset
+
+    forward() gives the TCP poses of joint positions, inverse() all (up to 8) joint solutions of TCP poses.
+    check() validates candidate poses: reachable, a solution within the joint limits and not close to a
+    singularity. check_path() follows a linear path through waypoints like movel, so the draw_* figures can be
+    validated before they are sent.
+
+    Example:
+    kinematics = Kinematics("UR10", tcp=URRobot.home_tcp)
+    result = kinematics.check(candidate_poses)
+    poses = candidate_poses[result.ok]
+    """
+
+    def __init__(self, model="UR10", tcp=(0, 0, 0, 0, 0, 0), limits=None, shoulder=0.05, elbow=0.1, wrist=0.1):
+        """
+        :param model: name of a preset (UR3, UR5, UR10) or a DH tuple
+        :param tcp: TCP offset from the flange as set with set_tcp
+        :param limits: (6, 2) minimum and maximum joint angles within +-2 pi, +-2 pi for every joint when None
+        :param shoulder: minimum distance in m of the wrist from the shoulder singularity
+        :param elbow: minimum |sin| of the elbow angle, the arm is stretched or folded below it
+        :param wrist: minimum |sin| of wrist 2, wrist 1 and 3 are aligned below it
+        """
+        if not isinstance(model, DH) and model not in PRESETS:
+            raise ValueError("Unknown model {}, choose from {}".format(model, list(PRESETS)))
+        self.dh = model if isinstance(model, DH) else PRESETS[model]
+        self.d = np.array(self.dh.d, dtype=np.float64)
+        self.a = np.array(self.dh.a, dtype=np.float64)
+        self.alpha = np.array(self.dh.alpha, dtype=np.float64)
+        self.tcp = pose_to_matrix(tcp)[0]
+        self.tcp_inverse = np.linalg.inv(self.tcp)
+        self.limits = np.array(limits if limits is not None else [(-2 * np.pi, 2 * np.pi)] * 6, dtype=np.float64)
+        self.thresholds = np.array((shoulder, elbow, wrist))
+
+    def _joint_transforms(self, q, joint):
+        """
+        :param q: (...) angles of one joint
+        :return: (..., 4, 4) transforms of that joint
+        """
+        c, s = np.cos(q), np.sin(q)
+        ca, sa = np.cos(self.alpha[joint]), np.sin(self.alpha[joint])
+        zero, one = np.zeros_like(q), np.ones_like(q)
+        a, d = self.a[joint], self.d[joint]
+        return np.stack((c, -s * ca, s * sa, a * c,
+                         s, c * ca, -c * sa, a * s,
+                         zero, zero + sa, zero + ca, zero + d,
+                         zero, zero, zero, one), axis=-1).reshape(q.shape + (4, 4))
+
+    def forward_matrices(self, joints):
+        """
+        :param joints: (..., 6) joint angles
+        :return: (..., 4, 4) TCP transforms
+        """
+        joints = np.asarray(joints, dtype=np.float64)
+        t = self._joint_transforms(joints[..., 0], 0)
+        for joint in range(1, 6):
+            t = np.matmul(t, self._joint_transforms(joints[..., joint], joint))
+        return np.matmul(t, self.tcp)
+
+    def forward(self, joints):
+        """
+        :param joints: (n, 6) or (6,) joint angles
+        :return: (n, 6) TCP poses
+        """
+        return matrix_to_pose(self.forward_matrices(np.asarray(joints, dtype=np.float64).reshape(-1, 6)))
+
+    def inverse(self, poses):
+        """
+        All joint solutions of TCP poses (Hawkins, Analytic inverse kinematics for the UR-5/UR-10)
+        :param poses: (n, 6) or (6,) TCP poses
+        :return: (n, 8, 6) joint angles in [-pi, pi) and (n, 8) booleans, False where a solution does not exist
+        """
+        target = pose_to_matrix(poses)
+        t06 = np.matmul(target, self.tcp_inverse)
+        n = len(t06)
+        d1, d4, d5, d6 = self.d[0], self.d[3], self.d[4], self.d[5]
+        a2, a3 = self.a[1], self.a[2]
+        solutions = np.full((n, 8, 6), np.nan)
+
+        x6, y6, z6, p06 = t06[:, :3, 0], t06[:, :3, 1], t06[:, :3, 2], t06[:, :3, 3]
+        p05 = p06 - d6 * z6
+        psi = np.arctan2(p05[:, 1], p05[:, 0])
+        with np.errstate(invalid="ignore"):
+            phi = np.arccos(d4 / np.hypot(p05[:, 0], p05[:, 1]))
+        for i, shoulder in enumerate((1, -1)):
+            q1 = psi + shoulder * phi + np.pi / 2
+            s1, c1 = np.sin(q1), np.cos(q1)
+            wrist_cos = (p06[:, 0] * s1 - p06[:, 1] * c1 - d4) / d6
+            wrist_cos = np.where(np.abs(wrist_cos) <= 1 + 1e-9, np.clip(wrist_cos, -1, 1), np.nan)
+            for j, wrist in enumerate((1, -1)):
+                q5 = wrist * np.arccos(wrist_cos)
+                s5, c5 = np.sin(q5), np.cos(q5)
+                safe = np.where(np.abs(s5) > 1e-9, s5, 1.0)
+                q6 = np.where(np.abs(s5) > 1e-9, np.arctan2((-y6[:, 0] * s1 + y6[:, 1] * c1) / safe,
+                                                            (x6[:, 0] * s1 - x6[:, 1] * c1) / safe), 0.0)
+                s6, c6 = np.sin(q6)[:, None], np.cos(q6)[:, None]
+                # origin and x axis of frame 4 in the base frame, z4 = -y5 and x4 = c5 x5 - s5 z5
+                p04 = p05 + d5 * (s6 * x6 + c6 * y6)
+                x4 = c5[:, None] * (c6 * x6 - s6 * y6) - s5[:, None] * z6
+                # joints 2, 3 and 4 move in the x-y plane of frame 1, a planar two link arm
+                x = c1 * p04[:, 0] + s1 * p04[:, 1]
+                y = p04[:, 2] - d1
+                q234 = np.arctan2(x4[:, 2], c1 * x4[:, 0] + s1 * x4[:, 1])
+                elbow_cos = (x ** 2 + y ** 2 - a2 ** 2 - a3 ** 2) / (2 * a2 * a3)
+                elbow_cos = np.where(np.abs(elbow_cos) <= 1 + 1e-9, np.clip(elbow_cos, -1, 1), np.nan)
+                for k, elbow in enumerate((1, -1)):
+                    q3 = elbow * np.arccos(elbow_cos)
+                    q2 = np.arctan2(y, x) - np.arctan2(a3 * np.sin(q3), a2 + a3 * np.cos(q3))
+                    solutions[:, 4 * i + 2 * j + k] = np.stack((q1, q2, q3, q234 - q2 - q3, q5, q6), axis=1)
+
+        with np.errstate(invalid="ignore"):
+            solutions = (solutions + np.pi) % (2 * np.pi) - np.pi     # wrap to [-pi, pi), NaN stays NaN
+        return solutions, ~np.isnan(solutions).any(axis=2)
+
+    def _choose(self, solutions, valid, near):
+        """
+        Moves every angle by a multiple of 2 pi within the limits, as close as possible to the reference,
+        and selects the solution closest to the reference
+        :param solutions: (n, m, 6) joint angles in [-pi, pi)
+        :param valid: (n, m) booleans
+        :param near: (n, 6) reference joint angles
+        :return: (n, 6) joints, NaN where no solution fits the limits
+        """
+        near = near[:, None]
+        # the representation closest to the reference, moved by a turn when it lies outside the limits
+        angles = near + (solutions - near + np.pi) % (2 * np.pi) - np.pi
+        lower, upper = self.limits[:, 0], self.limits[:, 1]
+        angles = np.where(angles > upper, angles - 2 * np.pi, angles)
+        angles = np.where(angles < lower, angles + 2 * np.pi, angles)
+        fits = valid & ((angles >= lower) & (angles <= upper)).all(axis=2)
+        cost = np.where(fits, np.sum((angles - near) ** 2, axis=2), np.inf)
+        chosen = np.argmin(cost, axis=1)
+        joints = angles[np.arange(len(angles)), chosen]
+        joints[~np.isfinite(cost[np.arange(len(cost)), chosen])] = np.nan
+        return joints
+
+    def solve(self, poses, near=None):
+        """
+        :param poses: (n, 6) TCP poses
+        :param near: (6,) or (n, 6) reference joints, e.g. the current joints, zeros when None
+        :return: (n, 6) joints within the limits closest to the reference, NaN where there is none
+        """
+        solutions, valid = self.inverse(poses)
+        near = np.broadcast_to(np.zeros(6) if near is None else np.asarray(near, dtype=np.float64),
+                               (len(solutions), 6))
+        return self._choose(solutions, valid, near)
+
+    def margins(self, joints):
+        """
+        Distance from the singularities, the Jacobian determinant is a2 a3 sin(q3) sin(q5) times the shoulder term
+        :param joints: (n, 6) joint angles
+        :return: (n, 3) shoulder term in m, |sin| of the elbow and |sin| of wrist 2
+        """
+        q = np.asarray(joints, dtype=np.float64).reshape(-1, 6)
+        a2, a3, d5 = self.a[1], self.a[2], self.d[4]
+        shoulder = a2 * np.cos(q[:, 1]) + a3 * np.cos(q[:, 1] + q[:, 2]) + d5 * np.sin(q[:, 1:4].sum(axis=1))
+        return np.abs(np.stack((shoulder, np.sin(q[:, 2]), np.sin(q[:, 4])), axis=1))
+
+    def check(self, poses, near=None):
+        """
+        Validates candidate poses
+        :param poses: (n, 6) TCP poses in m
+        :param near: reference joints, see solve
+        :return: Validation
+        """
+        solutions, valid = self.inverse(poses)
+        near = np.broadcast_to(np.zeros(6) if near is None else np.asarray(near, dtype=np.float64),
+                               (len(solutions), 6))
+        joints = self._choose(solutions, valid, near)
+        reachable = valid.any(axis=1)
+        within_limits = ~np.isnan(joints).any(axis=1)
+        with np.errstate(invalid="ignore"):
+            margins = self.margins(joints)
+            singular = within_limits & (margins < self.thresholds).any(axis=1)
+        return Validation(joints, reachable, within_limits, singular, within_limits & ~singular, margins)
+
+    def check_path(self, waypoints, near=None, step=0.005, max_joint_step=0.2):
+        """
+        Validates a linear path through waypoints, as movel moves between them
+        The orientation is interpolated on the rotation vector, exact for paths with a constant orientation
+        :param waypoints: (m, 6) TCP poses in m
+        :param near: joints at the start, zeros when None
+        :param step: maximum distance between checked poses in m
+        :param max_joint_step: maximum change of a joint between checked poses in radians,
+        larger steps mean a flip of the arm configuration near a singularity
+        :return: (k, 6) joints along the path and a list of (pose index, problem), empty if the path is valid
+        """
+        waypoints = np.asarray(waypoints, dtype=np.float64).reshape(-1, 6)
+        poses = [waypoints[:1]]
+        for start, end in zip(waypoints[:-1], waypoints[1:]):
+            count = max(int(np.ceil(np.linalg.norm(end[:3] - start[:3]) / step)), 1)
+            fractions = np.arange(1, count + 1)[:, None] / count
+            poses.append(start + fractions * (end - start))
+        poses = np.concatenate(poses)
+
+        solutions, valid = self.inverse(poses)
+        joints = np.full((len(poses), 6), np.nan)
+        problems = []
+        previous = np.zeros(6) if near is None else np.asarray(near, dtype=np.float64)
+        for i in range(len(poses)):
+            current = self._choose(solutions[i:i + 1], valid[i:i + 1], previous[None])[0]
+            if np.isnan(current).any():
+                problems.append((i, "unreachable" if not valid[i].any() else "joint limits"))
+                break
+            if i > 0 and np.abs(current - previous).max() > max_joint_step:
+                problems.append((i, "joint step {:.2f} rad".format(np.abs(current - previous).max())))
+            with np.errstate(invalid="ignore"):
+                if (self.margins(current) < self.thresholds).any():
+                    problems.append((i, "singularity"))
+            joints[i] = previous = current
+        return joints, problems
+
+
+def figure_waypoints(name, start=(-0.1, -0.8, 0.3, 0, 3.14, 0)):
+    """
+    :param name: key of FIGURES
+    :param start: starting position of the figure, URRobot.go_to_starting_position
+    :return: (m, 6) waypoints of the figure including the return to the start
+    """
+    start = np.asarray(start, dtype=np.float64)
+    waypoints = [start]
+    for translation in FIGURES[name]:
+        waypoint = waypoints[-1].copy()
+        waypoint[:3] += translation
+        waypoints.append(waypoint)
+    waypoints.append(start)
+    return np.array(waypoints)
+
+
+if __name__ == '__main__':
+    from Robot.UR.URRobot import URRobot
+
+    kinematics = Kinematics(sys.argv[1] if len(sys.argv) > 1 else "UR10", tcp=URRobot.home_tcp)
+    home = kinematics.check(URRobot.home_pose)
+    print("Starting position: {}, joints {}".format("ok" if home.ok[0] else "NOT ok", np.round(home.joints[0], 3)))
+    for figure in FIGURES:
+        joints, problems = kinematics.check_path(figure_waypoints(figure), near=home.joints[0])
+        print("{}: {} poses, {}".format(figure, len(joints), problems[:3] if problems else "ok"))
+
+    random = np.random.RandomState(7)
+    candidates = np.tile(np.array(URRobot.home_pose, dtype=np.float64), (10000, 1))
+    candidates[:, :3] += random.uniform(-0.3, 0.3, size=(10000, 3))
+    start = time.perf_counter()
+    result = kinematics.check(candidates, near=home.joints[0])
+    print("Checked {} candidate poses in {:.1f} ms, {} ok".format(
+        len(candidates), (time.perf_counter() - start) * 1000, int(result.ok.sum())))
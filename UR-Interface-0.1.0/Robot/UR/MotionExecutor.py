@@ -0,0 +1,204 @@
+import time
+from collections import deque, namedtuple
+from threading import Thread, Condition, current_thread
+
+import numpy as np
+
+from Diagnostics.Tracer import tracer
+
+# A command as it was executed
+# command: the submitted command, submitted / started / finished: time.perf_counter() stamps,
+# preempted: True if a newer command ended the move before its duration,
+# result: return value of the action, or the exception it raised
+CommandRecord = namedtuple("CommandRecord", "command submitted started finished preempted result")
+
+# An action of a command: the function to call, seconds the arm moves after it was sent, and if it is a motion.
+# Pending motions are replaced by newer commands, other actions (the magnet) are always executed
+Action = namedtuple("Action", "function duration motion")
+
+
+def default_actions(robot):
+    """
+    The commands of Main.process_commands
+    :param robot: URRobot
+    :return: dict of command to Action, unknown commands stop the arm
+    """
+    return {
+        1: Action(lambda: robot.move_right(wait=False), 10.0, True),
+        2: Action(lambda: robot.move_left(wait=False), 10.0, True),
+        3: Action(lambda: robot.move_down(wait=False), 10.0, True),
+        4: Action(lambda: robot.move_up(wait=False), 10.0, True),
+        5: Action(lambda: robot.move_backward(wait=False), 10.0, True),
+        6: Action(lambda: robot.move_forward(wait=False), 10.0, True),
+        7: Action(robot.change_magnet_state, 0.0, False),
+        8: Action(lambda: robot.reset_position(wait=False), 7.5, True),
+    }
+
+
+class MotionExecutor:
+    """
+    Executes robot commands on its own thread, so the caller never waits for the arm
+
+    Commands are submitted to a queue and submit() returns at once. A move is sent to the robot without waiting,
+    the executor then waits for the duration of the move. A newer motion command preempts the move in flight:
+    it is sent immediately and the robot replaces the running move with the new target, the stop command
+    (any unknown command) sends stopj. Motion commands that are still pending when a newer command
+    arrives are dropped, the newest intent wins instead of replaying old commands late.
+    Magnet commands are never dropped and do not end a move.
+
+    Example:
+    executor = MotionExecutor(robot).start()
+    executor.submit(1)
+    print(executor.statistics())
+    """
+
+    def __init__(self, robot, actions=None, coalesce=True, history=1000):
+        """
+        :param robot: URRobot
+        :param actions: dict of command to Action, default_actions(robot) when None
+        :param coalesce: drop pending motion commands when a newer command is submitted
+        :param history: number of executed commands kept for the statistics
+        """
+        self.robot = robot
+        self.actions = actions if actions is not None else default_actions(robot)
+        self.coalesce = coalesce
+
+        self._pending = deque()
+        self._condition = Condition()
+        self.records = deque(maxlen=history)
+        self.submitted = 0
+        self.superseded = 0     # pending commands dropped for a newer command
+        self.preempted = 0      # moves ended before their duration by a newer command
+        self.busy = False
+
+        self.thread = None
+        self.running = False
+
+    def action(self, command):
+        """
+        :return: the Action of a command, stopj for an unknown command
+        """
+        return self.actions.get(command) or Action(self.robot.stopj, 0.0, True)
+
+    def start(self):
+        """
+        Start executing submitted commands
+        :return: self as object
+        """
+        if self.running:
+            return None
+        self.running = True
+        self.thread = Thread(target=self._update, args=(), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the executor thread, pending commands are dropped. The arm is not stopped, call robot.stopj()
+        """
+        if self.running:
+            self.running = False
+            with self._condition:
+                self._condition.notify_all()
+            if self.thread is not current_thread():
+                self.thread.join(1)
+
+    def submit(self, command):
+        """
+        Queue a command, returns immediately
+        :param command: command number as used by Main.process_commands
+        """
+        with self._condition:
+            if self.coalesce:
+                kept = deque(item for item in self._pending if not self.action(item[0]).motion)
+                self.superseded += len(self._pending) - len(kept)
+                self._pending = kept
+            self._pending.append((command, time.perf_counter(), tracer.current()))
+            self.submitted += 1
+            self._condition.notify_all()
+
+    def _execute(self, command, trace):
+        """
+        Runs the action of a command on the trace of the thread that submitted it, so the send_script span
+        is recorded on the packet that led to the command
+        """
+        started = time.perf_counter()
+        action = self.action(command)
+        tracer.activate(trace)
+        try:
+            result = action.function()
+        except Exception as error:  # recorded as the result, the executor keeps running
+            print("Command {} failed: {!r}".format(command, error))
+            result = error
+        finally:
+            tracer.activate(None)
+        return action, started, result
+
+    def _update(self):
+        while self.running:
+            with self._condition:
+                self.busy = False
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._pending or not self.running)
+                if not self.running:
+                    break
+                command, submitted, trace = self._pending.popleft()
+                self.busy = True
+            action, started, result = self._execute(command, trace)
+            preempted = False
+            if action.motion and result is not False and not isinstance(result, Exception):
+                preempted = self._wait_for_move(started + action.duration)
+            self._record(command, submitted, started, preempted, result)
+
+    def _wait_for_move(self, end):
+        """
+        Waits until the move is done or a newer motion command arrives, magnet commands are executed meanwhile
+        :return: True if the move was preempted
+        """
+        while self.running:
+            with self._condition:
+                remaining = end - time.perf_counter()
+                if remaining <= 0 or not self._condition.wait_for(lambda: self._pending or not self.running,
+                                                                  remaining):
+                    return False
+                if not self.running:
+                    return False
+                command, submitted, trace = self._pending[0]
+                if self.action(command).motion:
+                    return True
+                self._pending.popleft()
+            action, started, result = self._execute(command, trace)
+            self._record(command, submitted, started, False, result)
+        return False
+
+    def _record(self, command, submitted, started, preempted, result):
+        with self._condition:
+            self.records.append(CommandRecord(command, submitted, started, time.perf_counter(), preempted, result))
+            self.preempted += preempted
+
+    def wait_idle(self, timeout=None):
+        """
+        Waits until all submitted commands have been executed and the last move is done
+        :return: Boolean, True if idle
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self.busy, timeout)
+
+    def statistics(self):
+        """
+        Queue wait and execution time of the last executed commands
+        :return: dict with counts and the 50th and 90th percentile and maximum in milliseconds
+        """
+        with self._condition:
+            records = list(self.records)
+            counts = {"submitted": self.submitted, "executed": len(records), "superseded": self.superseded,
+                      "preempted": self.preempted, "pending": len(self._pending),
+                      "failed": sum(isinstance(record.result, Exception) for record in records)}
+        if not records:
+            return counts
+        wait = np.array([record.started - record.submitted for record in records]) * 1000
+        execution = np.array([record.finished - record.started for record in records]) * 1000
+        for name, values in (("wait", wait), ("execution", execution)):
+            p50, p90 = np.percentile(values, (50, 90))
+            counts.update({name + "_p50": p50, name + "_p90": p90, name + "_max": float(values.max())})
+        return counts
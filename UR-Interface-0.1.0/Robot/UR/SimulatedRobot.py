@@ -0,0 +1,118 @@
+import math
+
+from Diagnostics.Clock import SimulatedClock
+from Robot.UR.Kinematics import Kinematics
+from Robot.UR.URRobot import URRobot
+
+
+class SimulatedRobot(URRobot):
+    """
+    A URRobot without a robot, for replays and dry runs of the control scripts
+
+    The TCP moves in a straight line at the speed of the move on the time of the clock, stopj() holds it
+    where it is. All other functions of URRobot (move_*, is_up, is_down, draw_*, ...) work on the simulated
+    position. Every command is recorded with its time in commands, two replays of the same session give
+    the same commands.
+
+    Example:
+    clock = SimulatedClock()
+    robot = SimulatedRobot(clock)
+    robot.move_down_abs()
+    clock.advance_to(5)
+    print(robot.get_tcp_position(), robot.commands)
+    """
+
+    def __init__(self, clock=None, pose=URRobot.home_pose):
+        """
+        :param clock: SimulatedClock, a new one starting at 0 when None
+        :param pose: starting pose in m and radians
+        """
+        super().__init__("127.0.0.1", connect=False, clock=clock if clock is not None else SimulatedClock())
+        self.commands = []      # (time, name, arguments)
+        self.tcp = self.home_tcp
+        self._start = tuple(float(value) for value in pose)
+        self._target = self._start
+        self._started = self.clock.time()
+        self._duration = 0.0
+
+    def _record(self, name, *arguments):
+        self.commands.append((self.clock.time(), name, arguments))
+
+    def _pose(self):
+        """
+        :return: the pose in m on the straight line from the start to the target of the current move
+        """
+        elapsed = self.clock.time() - self._started
+        if elapsed >= self._duration:
+            return self._target
+        fraction = elapsed / self._duration
+        return tuple(s + fraction * (t - s) for s, t in zip(self._start, self._target))
+
+    def _move(self, pose, v):
+        self._start = self._pose()
+        self._target = tuple(float(value) for value in pose)
+        self._started = self.clock.time()
+        length = math.sqrt(sum((t - s) ** 2 for s, t in zip(self._start[:3], self._target[:3])))
+        self._duration = length / v if v > 0 else 0.0
+
+    def connect(self):
+        return True
+
+    def is_connected(self):
+        return True
+
+    def movel(self, pose, a=0.1, v=0.1, joint_p=False):
+        if joint_p:
+            return self.movej(pose, a, v)
+        self._record("movel", *pose)
+        self._move(pose, v)
+        return True
+
+    def movej(self, q, a=0.1, v=0.1, joint_p=True):
+        """
+        Joint positions are converted with the UR10 kinematics, the TCP follows a straight line to the target
+        """
+        if joint_p:
+            pose = Kinematics("UR10", tcp=self.tcp).forward(q)[0]
+        else:
+            pose = q
+        self._record("movej", *q)
+        self._move(pose, v)
+        return True
+
+    def stopj(self, a=1.5):
+        self._record("stopj")
+        self._start = self._target = self._pose()
+        self._duration = 0.0
+        return True
+
+    def set_tcp(self, pose):
+        self._record("set_tcp", *pose)
+        self.tcp = tuple(pose)
+        return True
+
+    def set_io(self, io, value):
+        self._record("set_io", io, bool(value))
+        return True
+
+    def get_tcp_position(self):
+        """
+        :return: 6 Floats - position (x, y, z) in mm and rotation (Rx, Ry, Rz) in radians, like URRobot
+        """
+        pose = self._pose()
+        return pose[0] * 1000, pose[1] * 1000, pose[2] * 1000, pose[3], pose[4], pose[5]
+
+    def reset_position(self, wait=True, timeout=15.0):
+        """
+        Sends the offset and the move as separate commands, the simulation does not run the script of URRobot
+        """
+        self.set_tcp(self.home_tcp)
+        self.movel(self.home_pose)
+        self.refresh_movement_count()
+        if wait:
+            return self.wait_for_pose(self.home_pose, timeout=timeout)
+        return True
+
+    def _send_script(self, _script):
+        self._record("script", _script.decode() if isinstance(_script, bytes) else _script)
+        return True
@@ -1,10 +1,12 @@
 from Communication.SocketConnection import SocketConnection
 from Robot.UR.URModbusServer import URModbusServer
 from Robot.UR.URScript import URScript
+from Diagnostics.Tracer import tracer
+from Diagnostics.Startup import wait_until
+from Diagnostics.Clock import clock as wall_clock
+from Robot.UR.Kinematics import figure_waypoints
 import math
 
-import time
-
 
 class URRobot:
     """
@@ -12,10 +14,21 @@ class URRobot:
     SecondaryPort used for sending commands
     ModbusServer used for retrieving info
     """
-    def __init__(self, host):
+
+    # Default position of the arm, see reset_position
+    home_tcp = (0.05, -0.05, 0.295, 0, 0, 0)
+    home_pose = (-0.1, -0.8, 0.3, 0, 3.14, 0)
+
+    def __init__(self, host, connect=True, clock=None):
+        """
+        :param host: IP address of the robot
+        :param connect: connect the secondary port now, when False it is connected by connect()
+        or on the first command, so it can be opened in parallel with other connections
+        :param clock: Diagnostics.Clock used for the waits after a move, the wall clock when None
+        """
+        self.clock = clock if clock is not None else wall_clock
         self.secondaryPort = 30002
         self.secondaryInterface = SocketConnection(host, self.secondaryPort)
-        self.secondaryInterface.connect()
         self.URModbusServer = URModbusServer(host)
         self.URScript = URScript()
 
@@ -29,7 +42,6 @@ class URRobot:
 
         # variable to memorize the state of the magnet: true if active, false otherwise
         self.is_magnet_active = False
-        self.set_io(8, False)
 
         # variables representing the minimum and maximum values for the X, Y & Z axis, which the arm can reach (in mm)
         self.max_x = 100.00  # to right, 2 moves
@@ -39,6 +51,13 @@ class URRobot:
         self.min_y = -850.00
         self.min_z = 6
 
+        # optional Robot.UR.Workspace with obstacles, moves must keep the clearance in m from them
+        self.workspace = None
+        self.clearance = 0.01
+        # optional Robot.UR.Kinematics, moves and draw_* figures must stay within the joint limits and
+        # away from singularities
+        self.kinematics = None
+
         # Max safe values of acceleration and velocity are 0.4
         # DO NOT USE THE FOLLOWING VALUES
         # MAX a=1.3962634015954636
@@ -48,6 +67,25 @@ class URRobot:
         self.acceleration = 0.1
         self.velocity = 0.1
 
+        if connect:
+            self.connect()
+
+    def connect(self):
+        """
+        Opens the secondary port and switches the magnet off
+        :return: Boolean, True if the connection is open
+        """
+        self.secondaryInterface.connect()
+        if self.secondaryInterface.opened:
+            self.set_io(8, False)
+        return self.secondaryInterface.opened
+
+    def is_connected(self):
+        """
+        :return: Boolean, True if the secondary port is open
+        """
+        return self.secondaryInterface.opened
+
     def movel(self, pose, a=0.1, v=0.1, joint_p=False):
         """Move to position (linear in tool-space)
 
@@ -123,8 +161,11 @@ class URRobot:
         :param _script: formatted script to send
         :return: Boolean to check if the script has been send
         """
+        if not self.secondaryInterface.opened and not self.connect():
+            return False
         try:
-            self.secondaryInterface.send(_script)
+            with tracer.span("send_script"):
+                self.secondaryInterface.send(_script)
         except OSError as error:
             print("OS error: {0}".format(error))
             return False
@@ -158,9 +199,11 @@ class URRobot:
            -KEEP IN MIND THAT ONE COMMAND OVERWRITES THE OTHER, SO WAITING TIME IS NEEDED BETWEEN MOVEMENTS
     """
 
-    def move_right(self):
+    def move_right(self, wait=True):
         """
         Function to move the robot to the right 10cm, with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((0.10, 0.0, 0.0))
@@ -170,14 +213,19 @@ class URRobot:
             self.translate(vector)
             self.right_moves += 1
             self.left_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
-    def move_left(self):
+    def move_left(self, wait=True):
         """
         Function to move the robot to the left 10cm, with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((-0.10, 0.0, 0.0))
@@ -187,14 +235,19 @@ class URRobot:
             self.translate(vector)
             self.left_moves += 1
             self.right_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
-    def move_up(self):
+    def move_up(self, wait=True):
         """
         Function to move the robot up 9.8cm and backwards 2cm , with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((0.0, 0.02, 0.098))
@@ -204,14 +257,19 @@ class URRobot:
             self.translate(vector)
             self.up_moves += 1
             self.down_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
-    def move_down(self):
+    def move_down(self, wait=True):
         """
         Function to move the robot down 9.8cm and forward 2cm, with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((0.0, -0.02, -0.098))
@@ -221,14 +279,19 @@ class URRobot:
             self.translate(vector)
             self.down_moves += 1
             self.up_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
-    def move_forward(self):
+    def move_forward(self, wait=True):
         """
         Function to move the robot forward with 5 cm, with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((0.0, -0.05, 0.0))
@@ -238,14 +301,19 @@ class URRobot:
             self.translate(vector)
             self.forward_moves += 1
             self.backward_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
-    def move_backward(self):
+    def move_backward(self, wait=True):
         """
         Function to move the robot backwards 5 cm, with a waiting time of 10 seconds between movements.
+        :param wait: Boolean, sleep for the duration of the move, False to return when the move has been sent
+        :return: Boolean, False if the move was outside the boundaries and the arm was stopped
         """
 
         vector = list((0.0, 0.05, 0.0))
@@ -255,10 +323,13 @@ class URRobot:
             self.translate(vector)
             self.backward_moves += 1
             self.forward_moves -= 1
-            time.sleep(10)
+            if wait:
+                self.clock.sleep(10)
+            return True
         else:
             self.stopj()
             print("Stopped")
+            return False
 
     def change_magnet_state(self):
         """
@@ -282,16 +353,37 @@ class URRobot:
         self.forward_moves = 0
         self.backward_moves = 0
 
-    def reset_position(self):
+    def reset_position(self, wait=True, timeout=15.0):
         """
         Resets the position of the robotic arm back to a default position.
+        The TCP offset and the move are sent as one program, so the move can not interrupt setting the offset.
+        :param wait: Boolean, wait until the position has been reached
+        :param timeout: maximum seconds to wait
+        :return: Boolean, False if the position was not reached in time
         """
 
-        self.set_tcp((0.05, -0.05, 0.295, 0, 0, 0))
-        time.sleep(0.5)
-        self.movel((-0.1, -0.8, 0.3, 0, 3.14, 0))
+        script = "def reset_position():\n  " + URScript.set_tcp(self.home_tcp) + \
+                 "  " + URScript.movel(self.home_pose) + "end\n"
+        self._send_script(script.encode())
         self.refresh_movement_count()
-        time.sleep(7)
+        if wait:
+            return self.wait_for_pose(self.home_pose, timeout=timeout)
+        return True
+
+    def wait_for_pose(self, pose, tolerance=2.0, timeout=15.0, interval=0.1):
+        """
+        Waits on the clock of the robot until the TCP is at a position, instead of sleeping for the duration
+        of the move
+        :param pose: target pose as sent to movel, position in m
+        :param tolerance: maximum distance in mm per axis
+        :param timeout: maximum seconds to wait
+        :param interval: seconds between position requests
+        :return: Boolean, True if the position was reached
+        """
+        def reached():
+            position = self.get_tcp_position()
+            return all(abs(position[i] - pose[i] * 1000) <= tolerance for i in range(3))
+        return wait_until(reached, timeout, interval, self.clock)
 
     def get_x_position(self):
         """
@@ -320,6 +412,8 @@ class URRobot:
     def is_within_boundaries(self, vector):
         """
         Function to check if a certain movement will result in the arm crossing the set boundaries.
+        When a workspace is set, the straight move to the next position must also keep the clearance from its obstacles.
+        When kinematics are set, the move must also stay within the joint limits and away from singularities.
         :param vector: Three floating point values representing distances in m (X, Y, Z)
         :return: 1, if the movement is possible, 0 if not
         """
@@ -330,6 +424,16 @@ class URRobot:
         z = next_position[2] * 1000
         print("The next position would be: x={}, y={}, z={}".format(x, y, z))
         if self.min_x < x < self.max_x and self.min_y < y < self.max_y and self.min_z < z < self.max_z:
+            if self.workspace is not None:
+                current = [next_position[i] - vector[i] for i in range(3)]
+                if not self.workspace.segment_free(current, next_position[:3], self.clearance):
+                    print("Move crosses an obstacle")
+                    return 0
+            current = [next_position[i] - vector[i] for i in range(3)] + next_position[3:]
+            problems = self.path_problems([current, next_position])
+            if problems:
+                print("Move not possible: {}".format(problems[0][1]))
+                return 0
             print("Inside boundaries")
             return 1
         else:
@@ -363,6 +467,30 @@ class URRobot:
         # vector = list(next_x, next_y, next_z)
         return next_x, next_y, next_z
 
+    def path_problems(self, waypoints):
+        """
+        Checks a linear path through poses with the kinematics, does nothing when no kinematics are set
+        :param waypoints: poses in m, the first is the current pose
+        :return: list of (pose index, problem), empty if the path is possible
+        """
+        if self.kinematics is None:
+            return []
+        near = self.kinematics.solve(waypoints[0])[0]
+        if any(math.isnan(angle) for angle in near):
+            near = None
+        return self.kinematics.check_path(waypoints, near=near)[1]
+
+    def check_figure(self, name):
+        """
+        Checks the path of a draw_* figure from the starting position before it is sent
+        :param name: square, rectangle or triangle
+        :return: Boolean, True if the figure can be drawn
+        """
+        problems = self.path_problems(figure_waypoints(name))
+        if problems:
+            print("Can not draw the {}: {} at pose {}".format(name, problems[0][1], problems[0][0]))
+        return not problems
+
     def go_to_starting_position(self):
         """
         The starting point for the arm when drawing figures
@@ -372,59 +500,71 @@ class URRobot:
     def draw_square(self):
         """
         Funciton for the arm to move in a square shape
+        :return: Boolean, False if the figure was not possible and nothing was sent
         """
+        if not self.check_figure("square"):
+            return False
         self.go_to_starting_position()  # A
         print("A")
         length = 0.1
-        time.sleep(5)
+        self.clock.sleep(5)
         self.translate((0, -length, 0))  # B
         print("B")
-        time.sleep(5)
+        self.clock.sleep(5)
         self.translate((length, 0, 0))  # C
         print("C")
-        time.sleep(5)
+        self.clock.sleep(5)
         self.translate((0, length, 0))  # D
         print("D")
-        time.sleep(5)
+        self.clock.sleep(5)
         self.go_to_starting_position()  # go back to A
         print("Back to A")
+        return True
 
     def draw_rectangle(self):
         """
         Funciton for the arm to move in a rectangle shape
+        :return: Boolean, False if the figure was not possible and nothing was sent
         """
+        if not self.check_figure("rectangle"):
+            return False
         self.go_to_starting_position()  # A
         length = 0.1
         width = 0.25
-        time.sleep(10)
+        self.clock.sleep(10)
         self.translate((0, -length, 0))  # B
-        time.sleep(10)
+        self.clock.sleep(10)
         self.translate((width, 0, 0))  # C
-        time.sleep(10)
+        self.clock.sleep(10)
         self.translate((0, length, 0))  # D
-        time.sleep(10)
+        self.clock.sleep(10)
         self.go_to_starting_position()  # go back to A
+        return True
 
     def draw_triangle(self):
         """
         Function for the arm to move in a triangle shape
+        :return: Boolean, False if the figure was not possible and nothing was sent
         """
+        if not self.check_figure("triangle"):
+            return False
         self.go_to_starting_position()  # A
         base_length = 0.3
         side_length = 0.2
         x_b = base_length/2
         y_b = math.sqrt(math.pow(side_length, 2) - math.pow(base_length/2), 2)
-        time.sleep(10)
+        self.clock.sleep(10)
         print("A")
         self.translate((-x_b, -y_b, 0))
-        time.sleep(10)
+        self.clock.sleep(10)
         print("B")
         self.translate((x_b, 0, 0))
-        time.sleep(10)
+        self.clock.sleep(10)
         print("C")
         self.go_to_starting_position()
-        time.sleep(10)
+        self.clock.sleep(10)
         print("Back to A")
+        return True
 
     def move_to_pose(self):
         """
@@ -438,10 +578,10 @@ class URRobot:
                 vector = self.recalculate_position(vector)
             if self.is_within_boundaries(vector):
                 self.translate(vector)
-                time.sleep(3)
+                self.clock.sleep(3)
             else:
                 self.stopj()
-                time.sleep(10)
+                self.clock.sleep(10)
                 self.reset_position()
 
     def move_down_abs(self):
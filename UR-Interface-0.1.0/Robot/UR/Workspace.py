@@ -0,0 +1,235 @@
+"""
+Workspace of the arm as a signed distance field, to check points and moves without the robot
+
+The allowed region is a box with obstacles in it: boxes (the table, fixtures) and vertical cylinders (bins).
+The distance to the nearest obstacle or to the border of the region is computed once on a voxel grid, a query
+interpolates the grid and costs the same for every point. All coordinates are in m like URScript poses.
+
+A workspace file is JSON:
+    {"bounds": {"minimum": [-0.3, -0.85, 0.006], "maximum": [0.1, -0.75, 0.4]}, "resolution": 0.005,
+     "boxes": [{"minimum": [...], "maximum": [...]}],
+     "cylinders": [{"centre": [x, y], "radius": 0.05, "bottom": 0.0, "top": 0.1}]}
+
+Check the draw_* figures and time the queries from the UR-Interface-0.1.0 directory:
+    python -m Robot.UR.Workspace [workspace.json]
+"""
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# An obstacle or the allowed region, axis aligned: minimum and maximum corner (x, y, z)
+Box = namedtuple("Box", "minimum maximum")
+
+# A vertical obstacle: centre (x, y), radius and the z of the bottom and top
+Cylinder = namedtuple("Cylinder", "centre radius bottom top")
+
+
+def box_distance(points, box):
+    """
+    :param points: (..., 3) points
+    :return: (...) signed distance to the box, negative inside
+    """
+    minimum, maximum = np.asarray(box.minimum, dtype=np.float64), np.asarray(box.maximum, dtype=np.float64)
+    q = np.abs(points - (minimum + maximum) / 2) - (maximum - minimum) / 2
+    return np.linalg.norm(np.maximum(q, 0), axis=-1) + np.minimum(q.max(axis=-1), 0)
+
+
+def cylinder_distance(points, cylinder):
+    """
+    :param points: (..., 3) points
+    :return: (...) signed distance to the cylinder, negative inside
+    """
+    radial = np.hypot(points[..., 0] - cylinder.centre[0], points[..., 1] - cylinder.centre[1]) - cylinder.radius
+    axial = np.abs(points[..., 2] - (cylinder.bottom + cylinder.top) / 2) - (cylinder.top - cylinder.bottom) / 2
+    return np.hypot(np.maximum(radial, 0), np.maximum(axial, 0)) + np.minimum(np.maximum(radial, axial), 0)
+
+
+class Workspace:
+    """
+    Signed distance field of the space the TCP may move through
+
+    distance() is positive in free space: the distance to the nearest obstacle or border of the region,
+    negative inside an obstacle or outside the region. Segments are checked by sampling them, a sample
+    with distance d clears a ball of radius d, so a segment is free when every sample clears the half
+    step to its neighbours plus the required clearance. The interpolated distance is accurate to a fraction of
+    the resolution near edges and corners, keep the clearance above the resolution.
+
+    Example:
+    workspace = Workspace.load('workspace.json')
+    workspace.segment_free(current, target, clearance=0.01)
+    workspace.check_path(figure_waypoints("square"))
+    """
+
+    def __init__(self, bounds, boxes=(), cylinders=(), resolution=0.005):
+        """
+        :param bounds: Box or (minimum, maximum) of the allowed region
+        :param boxes: obstacles as Box or (minimum, maximum)
+        :param cylinders: obstacles as Cylinder or (centre, radius, bottom, top)
+        :param resolution: size of a voxel in m
+        """
+        self.bounds = Box(*(tuple(float(v) for v in corner) for corner in bounds))
+        self.boxes = [Box(*(tuple(float(v) for v in corner) for corner in box)) for box in boxes]
+        self.cylinders = [Cylinder(tuple(float(v) for v in c[0]), float(c[1]), float(c[2]), float(c[3]))
+                          for c in cylinders]
+        if resolution <= 0 or np.any(np.array(self.bounds.maximum) <= np.array(self.bounds.minimum)):
+            raise ValueError("The bounds need a positive size and resolution, got {} and {}".format(
+                self.bounds, resolution))
+        self.resolution = float(resolution)
+        self._build()
+
+    def _build(self):
+        """
+        Evaluates the obstacles on the grid, one voxel of margin around the bounds
+        """
+        minimum, maximum = np.array(self.bounds.minimum), np.array(self.bounds.maximum)
+        self.origin = minimum - self.resolution
+        self.shape = tuple(int(n) for n in np.ceil((maximum - minimum) / self.resolution).astype(int) + 3)
+        axes = [self.origin[i] + self.resolution * np.arange(self.shape[i]) for i in range(3)]
+        points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+
+        field = -box_distance(points, self.bounds)
+        for box in self.boxes:
+            field = np.minimum(field, box_distance(points, box))
+        for cylinder in self.cylinders:
+            field = np.minimum(field, cylinder_distance(points, cylinder))
+        self.field = field
+        self._limit = np.array(self.shape) - 1.0
+        self._strides = np.array((self.shape[1] * self.shape[2], self.shape[2], 1))
+        self._flat = field.ravel()
+        # offsets of the 8 corners of a voxel in the flat field, and their (dx, dy, dz)
+        corners = np.array([(i, j, k) for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+        self._corners = corners
+        self._corner_offsets = corners.dot(self._strides)
+
+    @classmethod
+    def from_robot(cls, robot, **kwargs):
+        """
+        The box of the min_* and max_* boundaries of a URRobot, in mm, without obstacles
+        :param kwargs: boxes, cylinders and resolution, see __init__
+        """
+        return cls(((robot.min_x / 1000, robot.min_y / 1000, robot.min_z / 1000),
+                    (robot.max_x / 1000, robot.max_y / 1000, robot.max_z / 1000)), **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            data = json.load(file)
+        bounds = data["bounds"]
+        return cls((bounds["minimum"], bounds["maximum"]),
+                   [(box["minimum"], box["maximum"]) for box in data.get("boxes", [])],
+                   [(c["centre"], c["radius"], c["bottom"], c["top"]) for c in data.get("cylinders", [])],
+                   data.get("resolution", 0.005))
+
+    def save(self, path):
+        """
+        Writes the description of the workspace as JSON under a temporary name and renames it,
+        the field is built again on load
+        """
+        data = {"bounds": self.bounds._asdict(), "resolution": self.resolution,
+                "boxes": [box._asdict() for box in self.boxes],
+                "cylinders": [cylinder._asdict() for cylinder in self.cylinders]}
+        with open(path + ".tmp", "w") as file:
+            json.dump(data, file, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def distance(self, points):
+        """
+        Trilinear interpolation of the field
+        :param points: (n, 3) or (3,) points in m
+        :return: (n,) signed distances in m, a float for a single point, -inf outside the grid
+        """
+        points = np.asarray(points, dtype=np.float64)
+        single = points.ndim == 1
+        position = (points.reshape(-1, 3) - self.origin) / self.resolution
+        outside = ((position < 0) | (position > self._limit)).any(axis=1)
+        position = np.clip(position, 0, self._limit)
+        cell = np.minimum(position.astype(int), self._limit.astype(int) - 1)
+        fraction = position - cell
+        values = self._flat[cell.dot(self._strides)[:, None] + self._corner_offsets]
+        weights = np.prod(np.where(self._corners, fraction[:, None], 1 - fraction[:, None]), axis=2)
+        distance = np.sum(values * weights, axis=1)
+        distance[outside] = -np.inf
+        return float(distance[0]) if single else distance
+
+    def contains(self, points, clearance=0.0):
+        """
+        :return: (n,) booleans, True where a point is at least clearance m away from obstacles and borders
+        """
+        return self.distance(points) > clearance
+
+    def sweep(self, starts, ends, step=None):
+        """
+        Smallest distance along straight segments, as a movel between two positions
+        :param starts: (m, 3) start points
+        :param ends: (m, 3) end points
+        :param step: distance between samples in m, the resolution when None
+        :return: (m,) lower bound of the distance to obstacles and borders along each segment
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+        step = self.resolution if step is None else float(step)
+        lengths = np.linalg.norm(ends - starts, axis=1)
+        counts = np.ceil(lengths / step).astype(int) + 1
+        segment = np.repeat(np.arange(len(starts)), counts)
+        first = np.cumsum(counts) - counts
+        fractions = (np.arange(counts.sum()) - first[segment]) / np.maximum(counts - 1, 1)[segment]
+        samples = starts[segment] + fractions[:, None] * (ends - starts)[segment]
+        distances = np.minimum.reduceat(self.distance(samples), first)
+        # between two samples a point is at most half the spacing away from one of them
+        return distances - lengths / np.maximum(counts - 1, 1) / 2
+
+    def segment_free(self, start, end, clearance=0.0):
+        """
+        :param start: (3,) current position in m
+        :param end: (3,) target position in m
+        :return: Boolean, True if the straight move keeps the clearance
+        """
+        return bool(self.sweep(start, end)[0] > clearance)
+
+    def check_path(self, waypoints, clearance=0.0):
+        """
+        Checks the straight moves between waypoints
+        :param waypoints: (m, 3) positions or (m, 6) poses in m
+        :return: list of (segment index, distance) of the segments that do not keep the clearance,
+        empty if the path is free
+        """
+        waypoints = np.asarray(waypoints, dtype=np.float64)
+        waypoints = waypoints.reshape(-1, waypoints.shape[-1])[:, :3]
+        distances = self.sweep(waypoints[:-1], waypoints[1:])
+        return [(int(i), float(distances[i])) for i in np.flatnonzero(~(distances > clearance))]
+
+
+if __name__ == '__main__':
+    from Robot.UR.Kinematics import FIGURES, figure_waypoints
+    from Robot.UR.URRobot import URRobot
+
+    if len(sys.argv) > 1:
+        workspace = Workspace.load(sys.argv[1])
+    else:
+        # the figures need more room than the boundaries of URRobot, a table below the figures and a bin
+        workspace = Workspace(((-0.4, -1.0, 0.0), (0.4, -0.5, 0.5)),
+                              boxes=[((-0.4, -1.0, 0.0), (0.4, -0.5, 0.05))],
+                              cylinders=[((0.25, -0.6), 0.08, 0.0, 0.25)])
+    print("Workspace {} voxels of {} mm".format(workspace.shape, workspace.resolution * 1000))
+    for figure in FIGURES:
+        problems = workspace.check_path(figure_waypoints(figure), clearance=0.01)
+        print("{}: {}".format(figure, problems if problems else "ok"))
+
+    random = np.random.RandomState(7)
+    minimum, maximum = np.array(workspace.bounds.minimum), np.array(workspace.bounds.maximum)
+    points = random.uniform(minimum, maximum, size=(10000, 3))
+    start = time.perf_counter()
+    inside = workspace.contains(points, clearance=0.01)
+    print("Checked {} points in {:.1f} ms, {} free".format(
+        len(points), (time.perf_counter() - start) * 1000, int(inside.sum())))
+
+    # a streaming velocity mode checks the move of one control tick
+    position, velocity, tick = np.array(URRobot.home_pose[:3]), np.array((0.1, 0, 0)), 0.008
+    start = time.perf_counter()
+    for _ in range(1000):
+        workspace.segment_free(position, position + velocity * tick, clearance=0.01)
+    print("One control tick checked in {:.1f} us".format((time.perf_counter() - start) * 1000))
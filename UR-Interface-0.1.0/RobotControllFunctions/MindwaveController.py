@@ -0,0 +1,182 @@
+from enum import Enum, auto
+
+from Diagnostics.Clock import clock as wall_clock
+from Diagnostics.Tracer import tracer
+from EEG.BlinkDetector import BlinkDetector
+
+
+class Motion(Enum):
+    DOWN = auto()
+    UP = auto()
+
+
+class MindwaveController:
+    """
+    The decision logic of simple_mindwave_move: attention moves the arm down, meditation moves it up,
+    a double blink changes the magnet and the arm stops when no eSense packet arrived for the cutoff.
+
+    With raw output enabled, blinks are detected in the raw samples by a BlinkDetector, right after
+    the second blink starts. The blinkStrength packets of the connector are only used while no raw
+    samples arrive.
+
+    All times come from the clock, so the same logic runs live on the wall clock and on a SimulatedClock
+    for a replay of a recorded session faster than real time.
+
+    Example:
+    controller = MindwaveController(robot)
+    for packet in headset.packets():
+        controller.process(packet)
+    controller.close()
+    """
+
+    def __init__(self, robot, clock=None, threshold=40, blink_threshold=50, move_interval=2.0,
+                 double_blink=3.0, cutoff=15.0, blink_detector=None, raw_timeout=1.0, verbose=True):
+        """
+        :param robot: URRobot or SimulatedRobot
+        :param clock: Diagnostics.Clock, the wall clock when None
+        :param threshold: attention or meditation needed to move
+        :param blink_threshold: blinkStrength counted as a blink
+        :param move_interval: seconds between decisions
+        :param double_blink: maximum seconds between the blinks of a double blink
+        :param cutoff: seconds without eSense packets after which the arm stops
+        :param blink_detector: EEG.BlinkDetector for the rawEeg samples, a default one when None
+        :param raw_timeout: seconds without rawEeg samples after which blinkStrength is used again
+        :param verbose: print the decisions
+        """
+        self.robot = robot
+        self.clock = clock if clock is not None else wall_clock
+        self.threshold = threshold
+        self.blink_threshold = blink_threshold
+        self.move_interval = move_interval
+        self.double_blink = double_blink
+        self.cutoff = cutoff
+        self.blink_detector = blink_detector if blink_detector is not None else BlinkDetector()
+        self.raw_timeout = raw_timeout
+        self.verbose = verbose
+
+        self.valid = False
+        self.last_move = -1000000.0
+        self.last_blink = -1000000.0
+        self.last_raw = -1000000.0
+        self.attention = self.meditation = 0
+        self.motion = Motion.DOWN
+        self.cut_off = False
+        self.stop_task = None
+
+    def _print(self, message):
+        if self.verbose:
+            print(message)
+
+    def _stop(self):
+        self.cut_off = True
+        self._print('No new data, stopping')
+        self.robot.stopj()
+
+    def refresh_stop_task(self):
+        """
+        Reschedules robot cutoff to cutoff seconds from now
+        """
+        if self.stop_task is not None:
+            self.stop_task.cancel()
+        self.stop_task = self.clock.call_later(self.cutoff, self._stop)
+        self.cut_off = False
+
+    def process(self, packet):
+        """
+        Handles one packet of the headset
+        :param packet: dict as returned by ThinkGearConnection.read_packet
+        """
+        robot = self.robot
+        now = self.clock.time()
+
+        # raw samples only feed the blink detector, they arrive at 512 Hz
+        if 'rawEeg' in packet:
+            self.process_raw(packet['rawEeg'], now)
+            return
+
+        # process blinks of the connector when there is no raw signal
+        if now - self.last_raw > self.raw_timeout and 'blinkStrength' in packet \
+                and packet['blinkStrength'] > self.blink_threshold:
+            self._print(f"Blink, last was {now - self.last_blink} seconds ago")
+            # detect double blink and change magnet
+            if (now - self.last_blink) < self.double_blink:
+                self.last_blink = -1000000.0
+                robot.change_magnet_state()
+                self._print(f'Changed magnet state, magnet is now {"on" if robot.is_magnet_active else "off"}')
+            else:
+                self.last_blink = now
+
+        # process general data packets
+        if 'eSense' in packet:
+            self.refresh_stop_task()  # new packet, delay cutoff
+            with tracer.span("features"):
+                self.attention = packet['eSense']['attention']
+                self.meditation = packet['eSense']['meditation']
+
+                # if both = 0, connection is not established yet or has been lost
+                self.valid = (self.attention + self.meditation) > 0
+
+        # threshold decision, sends the move to the robot
+        with tracer.span("decision"):
+            if now - self.last_move > self.move_interval:
+                self.last_move = now
+                self._decide()
+
+        if self.motion == Motion.DOWN and robot.is_down():
+            robot.stopj()
+            self._print('Stopping, switching to UP')
+            self.motion = Motion.UP
+        else:
+            if self.motion == Motion.UP and robot.is_up():
+                robot.stopj()
+                self._print('Stopping, switching to DOWN')
+                self.motion = Motion.DOWN
+
+    def process_raw(self, samples, now=None):
+        """
+        Detects blinks in raw samples and changes the magnet on a double blink
+        :param samples: a raw sample or a sequence of samples
+        :param now: time of the samples on the clock, now when None
+        """
+        now = self.clock.time() if now is None else now
+        if now - self.last_raw > self.raw_timeout:
+            # first samples or the raw stream was interrupted, the filter starts over
+            self.blink_detector.reset(now)
+        self.last_raw = now
+        for event in self.blink_detector.push(samples):
+            if event.kind == "double":
+                self.robot.change_magnet_state()
+                self._print(f'Double blink, magnet is now {"on" if self.robot.is_magnet_active else "off"}')
+
+    def _decide(self):
+        robot = self.robot
+        if self.valid and not self.cut_off:
+            if self.motion == Motion.DOWN:
+                if self.attention >= self.threshold:  # move down while attention over threshold
+                    robot.move_down_abs()
+                    self._print('Moving down')
+                else:
+                    robot.stopj()
+                    self._print(f'Stopping, attention at {self.attention}')
+            else:
+                if self.motion == Motion.UP:
+                    if self.meditation >= self.threshold:  # move up while meditation over threshold
+                        robot.move_up_abs()
+                        self._print('Moving up')
+                    else:
+                        robot.stopj()
+                        self._print(f'Stopping, meditation at {self.meditation}')
+                else:  # unknown (or None) motion, stop
+                    robot.stopj()
+                    self._print('No motion, stopping')
+        else:  # invalid state, stop
+            robot.stopj()
+            self._print('Waiting for valid data')
+
+    def close(self):
+        """
+        Cancels the cutoff and stops the arm
+        """
+        if self.stop_task is not None:
+            self.stop_task.cancel()
+        self.robot.stopj()
@@ -0,0 +1,191 @@
+"""
+Mapping from camera pixels to robot poses
+
+The camera is mounted on the tool. A calibration maps a pixel to the offset in mm of the point below it
+from the TCP, measured in the base frame while the tool has the reference orientation. Record the
+correspondences by moving the TCP over a coin and noting the pixel of the coin before the move and the
+offset of the move, then fit them from the UR-Interface-0.1.0 directory:
+    python -m Vision.Calibration points.csv calibration.json [affine]
+
+points.csv has a header and one correspondence per line: u,v,dx,dy
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+
+def rotation(axis_angle):
+    """
+    :param axis_angle: (rx, ry, rz) rotation vector in radians as used by URScript
+    :return: 3 x 3 rotation matrix
+    """
+    axis_angle = np.asarray(axis_angle, dtype=np.float64)
+    angle = np.linalg.norm(axis_angle)
+    if angle < 1e-12:
+        return np.eye(3)
+    kx, ky, kz = axis_angle / angle
+    k = np.array(((0, -kz, ky), (kz, 0, -kx), (-ky, kx, 0)))
+    return np.eye(3) + np.sin(angle) * k + (1 - np.cos(angle)) * k.dot(k)
+
+
+def _normalise(points):
+    """
+    Similarity transform moving the points to the origin with a mean distance of sqrt(2), for a stable fit
+    """
+    mean = points.mean(axis=0)
+    distance = np.mean(np.linalg.norm(points - mean, axis=1))
+    scale = np.sqrt(2) / distance if distance > 0 else 1.0
+    return np.array(((scale, 0, -scale * mean[0]), (0, scale, -scale * mean[1]), (0, 0, 1)))
+
+
+def fit_homography(source, target):
+    """
+    Direct linear transform fit of a homography
+    :param source: (n, 2) points, n >= 4
+    :param target: (n, 2) points
+    :return: 3 x 3 matrix with H[2, 2] = 1
+    """
+    ts, tt = _normalise(source), _normalise(target)
+    s = np.c_[source, np.ones(len(source))].dot(ts.T)
+    t = np.c_[target, np.ones(len(target))].dot(tt.T)
+    zeros = np.zeros((len(s), 3))
+    rows = np.concatenate((np.c_[zeros, -s, t[:, 1:2] * s], np.c_[s, zeros, -t[:, 0:1] * s]))
+    h = np.linalg.svd(rows)[2][-1].reshape(3, 3)
+    h = np.linalg.inv(tt).dot(h).dot(ts)
+    return h / h[2, 2]
+
+
+def fit_affine(source, target):
+    """
+    Least squares fit of an affine map
+    :param source: (n, 2) points, n >= 3
+    :param target: (n, 2) points
+    :return: 3 x 3 matrix with last row (0, 0, 1)
+    """
+    a = np.linalg.lstsq(np.c_[source, np.ones(len(source))], target, rcond=None)[0]
+    return np.r_[a.T, ((0, 0, 1),)]
+
+
+class Calibration:
+    """
+    Converts detections to robot poses in one vectorised call
+
+    matrix maps a pixel (u, v) to the offset (dx, dy) in mm from the TCP while the tool has the reference
+    orientation. For another orientation the offsets are rotated along with the tool, the map holds for the
+    TCP height at which it was recorded.
+
+    Example:
+    calibration = Calibration.load('calibration.json')
+    circles = detection.latest().circles
+    poses = calibration.poses(circles, robot.get_tcp_position())
+    robot.movel(calibration.pick(circles, robot.get_tcp_position()))
+    """
+
+    def __init__(self, matrix, reference=(0, 3.14, 0), pick_z=-23.0):
+        """
+        :param matrix: 3 x 3 pixel to offset map
+        :param reference: (rx, ry, rz) of the TCP while the correspondences were recorded
+        :param pick_z: height of the pick poses in mm
+        """
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+        if self.matrix.shape != (3, 3):
+            raise ValueError("A calibration matrix is 3 x 3, not {}".format(self.matrix.shape))
+        self.reference = tuple(float(value) for value in reference)
+        self.pick_z = float(pick_z)
+        self._reference_inverse = rotation(self.reference).T
+
+    @classmethod
+    def default(cls):
+        """
+        The fixed calibration of Main.py.get_camera_position_data: 28.5 cm over the 1280 pixel width,
+        image centre (640, 360) and a camera offset of (47, 50) mm
+        """
+        scale = 285.0 / 1280
+        return cls(((0, -scale, 360 * scale + 47), (-scale, 0, 640 * scale + 50), (0, 0, 1)))
+
+    @classmethod
+    def fit(cls, pixels, offsets, affine=False, **kwargs):
+        """
+        :param pixels: (n, 2) recorded pixels
+        :param offsets: (n, 2) offsets in mm from the TCP of the same points
+        :param affine: fit an affine map instead of a homography, when the camera looks straight down
+        :param kwargs: reference and pick_z, see __init__
+        :return: Calibration
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+        needed = 3 if affine else 4
+        if len(pixels) < needed or len(pixels) != len(offsets):
+            raise ValueError("Fitting needs at least {} pairs of pixels and offsets, got {} and {}".format(
+                needed, len(pixels), len(offsets)))
+        matrix = fit_affine(pixels, offsets) if affine else fit_homography(pixels, offsets)
+        return cls(matrix, **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            data = json.load(file)
+        return cls(data["matrix"], data["reference"], data["pick_z"])
+
+    def save(self, path):
+        """
+        Writes the calibration as JSON under a temporary name and renames it
+        """
+        data = {"matrix": self.matrix.tolist(), "reference": self.reference, "pick_z": self.pick_z}
+        with open(path + ".tmp", "w") as file:
+            json.dump(data, file, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def offsets(self, pixels):
+        """
+        :param pixels: (n, 2) pixels, or (n, 3) circles of which the radius is ignored
+        :return: (n, 2) offsets in mm from the TCP at the reference orientation
+        """
+        pixels = np.asarray(pixels, dtype=np.float64)
+        pixels = pixels.reshape(-1, pixels.shape[-1] if pixels.ndim else 2)[:, :2]
+        mapped = pixels.dot(self.matrix[:, :2].T) + self.matrix[:, 2]
+        return mapped[:, :2] / mapped[:, 2:]
+
+    def errors(self, pixels, offsets):
+        """
+        :return: distance in mm between the mapped pixels and the recorded offsets
+        """
+        return np.linalg.norm(self.offsets(pixels) - np.asarray(offsets, dtype=np.float64), axis=1)
+
+    def poses(self, pixels, tcp_position):
+        """
+        Pick poses for all detections at once
+        :param pixels: (n, 2) pixels or (n, 3) circles
+        :param tcp_position: current TCP as returned by URRobot.get_tcp_position, mm and radians
+        :return: (n, 6) poses for URRobot.movel, in metres and radians, with the orientation of the TCP
+        """
+        tcp_position = np.asarray(tcp_position, dtype=np.float64)
+        offsets = self.offsets(pixels)
+        turn = rotation(tcp_position[3:6]).dot(self._reference_inverse)
+        moved = np.c_[offsets, np.zeros(len(offsets))].dot(turn.T)
+        poses = np.empty((len(offsets), 6))
+        poses[:, :2] = (tcp_position[:2] + moved[:, :2]) / 1000
+        poses[:, 2] = self.pick_z / 1000
+        poses[:, 3:] = tcp_position[3:6]
+        return poses
+
+    def pick(self, pixels, tcp_position):
+        """
+        The pose of the detection closest to the TCP, the shortest move
+        :return: 6-tuple for URRobot.movel, None if there are no detections
+        """
+        poses = self.poses(pixels, tcp_position)
+        if len(poses) == 0:
+            return None
+        distance = np.linalg.norm(poses[:, :2] * 1000 - np.asarray(tcp_position[:2], dtype=np.float64), axis=1)
+        return tuple(float(value) for value in poses[int(np.argmin(distance))])
+
+
+if __name__ == '__main__':
+    points = np.loadtxt(sys.argv[1], delimiter=",", skiprows=1, ndmin=2)
+    calibration = Calibration.fit(points[:, :2], points[:, 2:4], affine="affine" in sys.argv[3:])
+    errors = calibration.errors(points[:, :2], points[:, 2:4])
+    print("Fitted {} points, error mean {:.2f} mm, max {:.2f} mm".format(len(points), errors.mean(), errors.max()))
+    calibration.save(sys.argv[2])
@@ -1,6 +1,10 @@
-from threading import Thread, Lock
-from queue import Queue
+from threading import Thread, Lock, current_thread
+import time
 #import cv2
+import numpy as np
+
+from Vision.FrameMailbox import FrameMailbox
+from Vision.FramePool import FramePool
 
 
 class Camera:
@@ -10,24 +14,41 @@ class Camera:
     Viewing of the stream has been implemented in a separate thread.
 
     A frame can be read by using camera.read()
+    Frames are captured into the preallocated buffers of a FramePool, camera.read_frame() returns the latest
+    frame without copying it, camera.lease_frame() keeps it from being overwritten
     Camera can be started with camera.start() and viewed with camera.show()
     Camera can be stopped with camera.stop() and the view with camera.end()
+
+    Consumers subscribe with camera.subscribe(), which returns a FrameMailbox with the latest frame,
+    or with maxsize > 1 a bounded queue of frames. camera.statistics() counts the captured frames and the
+    dropped and consumed frames and frame ages per subscriber.
     """
 
-    def __init__(self, src=0, width=1280, height=720):
+    def __init__(self, src=0, width=1280, height=720, buffers=3, fps=None):
         """
-        :param src: defines which camera to use
+        :param src: defines which camera to use, 0 for the first camera device, or a source with the read interface
+        of cv2.VideoCapture such as a Vision.FrameSource
         :param width: define the width in pixels
         :param height: define the height in pixels
+        :param buffers: number of preallocated frame buffers
+        :param fps: maximum number of frames captured per second, None to capture as fast as the stream delivers
         """
-        if src is 0:
+        if hasattr(src, "read"):
+            self.stream = src
+        elif src is 0:
             self.stream = cv2.VideoCapture(src)
             self.stream.set(cv2.CAP_PROP_FRAME_WIDTH, width)
             self.stream.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
         else:
             self.stream = self._cap_stream()
 
-        (self.grabbed, self.frame) = self.stream.read()
+        (self.grabbed, frame) = self.stream.read()
+        if frame is None:
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.pool = FramePool(frame.shape, frame.dtype, buffers)
+        np.copyto(self.pool.acquire(), frame)
+        self.pool.publish(0, time.perf_counter())
+        self.sequence = 1   # sequence number of the next frame
 
         self.frame_width = width
         self.frame_height = height
@@ -38,9 +59,14 @@ class Camera:
         self.polling = False    # Check for the polling thread to see if it's running
         self.viewing = False    # Check for the viewing thread to see if it's running
 
-        self.Q_view = Queue(maxsize=10)     # Polling thread stores frames here for video show thread
+        self.fps = fps
+        self.captured = 0       # frames captured since start()
+        self.failed = 0         # reads that returned no frame
+        self.started = None
 
-        self.read_lock = Lock()
+        self.subscribers = []
+        self.subscribers_lock = Lock()
+        self.view_mailbox = None    # latest frame for the video show thread
 
     def start(self):
         """
@@ -49,40 +75,125 @@ class Camera:
         """
         if self.polling:
             return None
-        self.thread_video_poll = Thread(target=self._update, args=())
+        self.thread_video_poll = Thread(target=self._update, args=(), daemon=True)
         self.polling = True
+        self.started = time.perf_counter()
         self.thread_video_poll.start()
         return self
 
     def stop(self):
         """
-        Stops camera stream capture and view
+        Stops camera stream capture and view, can be called from any thread including the capture thread
+        Subscribers waiting for a frame are woken up and receive None
         """
         self.end()
         if self.polling:
             self.polling = False
-            if self.thread_video_poll.is_alive():
+            if self.thread_video_poll is not current_thread() and self.thread_video_poll.is_alive():
                 self.thread_video_poll.join(1)
+        with self.subscribers_lock:
+            for mailbox in self.subscribers:
+                mailbox.close()
+
+    def subscribe(self, maxsize=1):
+        """
+        Registers a consumer of the captured frames
+        A queue holds leased buffers, the frame pool grows by up to maxsize buffers for it
+        :param maxsize: 1 to only receive the latest frame, more to queue frames (the oldest is dropped when full)
+        :return: FrameMailbox
+        """
+        mailbox = FrameMailbox(maxsize)
+        with self.subscribers_lock:
+            self.subscribers.append(mailbox)
+        return mailbox
+
+    def unsubscribe(self, mailbox):
+        """
+        Removes a consumer and releases its frames
+        """
+        with self.subscribers_lock:
+            if mailbox in self.subscribers:
+                self.subscribers.remove(mailbox)
+        mailbox.close()
 
     def _update(self):
+        interval = 1.0 / self.fps if self.fps else 0
+        deadline = time.perf_counter()
         while self.polling:
             if not self.grabbed:
                 self.stop()
-            else:
-                (grabbed, frame) = self.stream.read()
-                with self.read_lock:
-                    (self.grabbed, self.frame) = grabbed, frame
-                if not self.Q_view.full():
-                    self.Q_view.put(frame)
+                break
+            if interval:
+                deadline += interval
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:  # too slow for the target rate, do not try to catch up
+                    deadline = time.perf_counter()
+
+            buffer = self.pool.acquire()
+            (grabbed, image) = self.stream.read(buffer)
+            if not grabbed:
+                self.pool.cancel()
+                self.failed += 1
+                self.grabbed = False
+                continue
+            if image is not buffer:  # the capture could not write into the buffer, e.g. another size
+                if image.shape != buffer.shape:
+                    self.pool.cancel()
+                    self.failed += 1
+                    print("Camera: frame of {} does not fit the buffers of {}".format(image.shape, buffer.shape))
+                    continue
+                np.copyto(buffer, image)
+            frame = self.pool.publish(self.sequence, time.perf_counter())
+            self.sequence += 1
+            self.captured += 1
+            with self.subscribers_lock:
+                for mailbox in self.subscribers:
+                    mailbox.put(frame)
+
+    def statistics(self):
+        """
+        :return: dict with the captured and failed frames, the capture rate and the statistics of every subscriber
+        """
+        elapsed = time.perf_counter() - self.started if self.started is not None else 0
+        with self.subscribers_lock:
+            subscribers = [mailbox.statistics() for mailbox in self.subscribers]
+        return {"captured": self.captured, "failed": self.failed,
+                "fps": self.captured / elapsed if elapsed else 0.0,
+                "allocations": self.pool.allocations, "subscribers": subscribers}
+
+    @property
+    def frame(self):
+        """
+        Read-only view of the latest frame
+        """
+        return self.pool.latest_frame().image
 
     def read(self):
         """
         Reads single frame from the camera stream
-        :return: frame
+        :return: writable copy of the latest frame
+        """
+        with self.pool.lease_latest() as frame:
+            return frame.copy()
+
+    def read_frame(self):
+        """
+        Latest frame without copying the pixels
+        The buffer is reused after newer frames, use lease_frame() to keep it longer
+        :return: Frame with a read-only image, sequence number and timestamp
         """
-        with self.read_lock:
-            frame = self.frame.copy()
-        return frame
+        return self.pool.latest_frame()
+
+    def lease_frame(self):
+        """
+        Latest frame, kept until the lease is released:
+        with camera.lease_frame() as frame:
+            process(frame.image)
+        :return: FrameLease
+        """
+        return self.pool.lease_latest()
 
     def show(self):
         """ View camera stream
@@ -96,7 +207,8 @@ class Camera:
         """
         if self.viewing:
             return None
-        self.thread_video_show = Thread(target=self._view, args=())
+        self.view_mailbox = self.subscribe()
+        self.thread_video_show = Thread(target=self._view, args=(), daemon=True)
         self.viewing = True
         self.thread_video_show.start()
 
@@ -106,14 +218,18 @@ class Camera:
         """
         if self.viewing:
             self.viewing = False
-            cv2.destroyWindow("Video")
-            if self.thread_video_show.is_alive():
+            self.unsubscribe(self.view_mailbox)
+            if self.thread_video_show is not current_thread() and self.thread_video_show.is_alive():
                 self.thread_video_show.join(1)
+            cv2.destroyWindow("Video")
 
     def _view(self):
         while self.viewing:
-            frame = self.Q_view.get()
-            cv2.imshow("Video", frame)
+            lease = self.view_mailbox.get(timeout=0.1)
+            if lease is None:
+                continue
+            with lease as frame:
+                cv2.imshow("Video", frame.image)
             if cv2.waitKey(1) == 27:
                 self.end()
                 break
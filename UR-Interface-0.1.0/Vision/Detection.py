@@ -0,0 +1,351 @@
+import time
+from collections import deque, namedtuple
+from threading import Thread, Lock
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # the NumpyDetector works without OpenCV
+    cv2 = None
+
+# Result of one processed frame
+# sequence / timestamp: of the camera frame, circles: float32 array (n, 3) of x, y, radius in full frame pixels,
+# coarse: True if the downscaled pass ran on this frame, done: time.perf_counter() when the result was published
+Detection = namedtuple("Detection", "sequence timestamp circles coarse done")
+
+
+def grayscale(image):
+    """
+    :param image: BGR image (h, w, 3) or a grayscale image
+    :return: float32 grayscale image
+    """
+    if image.ndim == 2:
+        return image.astype(np.float32)
+    b, g, r = image[..., 0], image[..., 1], image[..., 2]
+    return np.float32(0.114) * b + np.float32(0.587) * g + np.float32(0.299) * r
+
+
+def downscale(gray, factor):
+    """
+    Averages blocks of factor x factor pixels, the edge rows and columns that do not fill a block are dropped
+    Pixel (x, y) of the result is centred on pixel (x * factor + (factor - 1) / 2, ...) of the input
+    """
+    h, w = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    blocks = gray[:h, :w].reshape(h // factor, factor, w // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def suppress(circles, scores, min_dist, max_circles):
+    """
+    Keeps the strongest circles that are at least min_dist apart
+    :return: float32 array (n, 3)
+    """
+    kept = []
+    for i in np.argsort(-scores, kind="stable"):
+        if all((circles[i, 0] - x) ** 2 + (circles[i, 1] - y) ** 2 >= min_dist ** 2 for x, y, _ in kept):
+            kept.append(circles[i])
+            if len(kept) == max_circles:
+                break
+    return np.array(kept, dtype=np.float32).reshape(-1, 3)
+
+
+class NumpyDetector:
+    """
+    Circle detector in pure NumPy, the reference for HoughDetector and usable without OpenCV
+
+    Sobel gradients are thresholded into edge points. Every edge point votes for the centres at distance r
+    along its gradient, on both sides because coins can be lighter or darker than the background.
+    The votes of a centre are divided by the circumference. The edge is 1 to 2 edge points wide, a full
+    circle scores about 1.5 from a radius of 25 pixels up, the same for every radius, smaller circles
+    score higher.
+    """
+
+    def __init__(self, edge=100.0, min_score=0.35, max_circles=8, spread=0.04):
+        """
+        :param edge: minimum Sobel gradient magnitude of an edge point
+        :param min_score: minimum score of a circle, see above
+        :param max_circles: maximum number of circles returned
+        :param spread: error of the gradient direction in radians, the votes of a centre spread over
+        a square of spread * r pixels around it
+        """
+        self.edge = edge
+        self.min_score = min_score
+        self.max_circles = max_circles
+        self.spread = spread
+
+    grayscale = staticmethod(grayscale)
+    downscale = staticmethod(downscale)
+
+    def detect(self, gray, min_radius, max_radius, min_dist):
+        """
+        :param gray: grayscale image
+        :param min_radius: smallest radius in pixels
+        :param max_radius: largest radius in pixels
+        :param min_dist: minimum distance between the centres of two circles
+        :return: float32 array (n, 3) of x, y, radius, strongest first
+        """
+        g = gray.astype(np.float32, copy=False)
+        h, w = g.shape
+        if h < 3 or w < 3:
+            return np.zeros((0, 3), dtype=np.float32)
+        dx = g[:, 2:] - g[:, :-2]
+        dy = g[2:, :] - g[:-2, :]
+        gx = dx[:-2] + 2 * dx[1:-1] + dx[2:]
+        gy = dy[:, :-2] + 2 * dy[:, 1:-1] + dy[:, 2:]
+        magnitude = np.hypot(gx, gy)
+        ys, xs = np.nonzero(magnitude >= self.edge)
+        if len(xs) == 0:
+            return np.zeros((0, 3), dtype=np.float32)
+        ux = gx[ys, xs] / magnitude[ys, xs]
+        uy = gy[ys, xs] / magnitude[ys, xs]
+        xs, ys = xs + 1.0, ys + 1.0
+
+        radii = np.arange(max(int(np.floor(min_radius)), 1), int(np.ceil(max_radius)) + 1)
+        offsets = np.concatenate((radii, -radii))[:, None]
+        cx = np.rint(xs + offsets * ux).astype(np.int64)
+        cy = np.rint(ys + offsets * uy).astype(np.int64)
+        r = np.tile(np.arange(len(radii)), 2)[:, None].repeat(len(xs), axis=1)
+        inside = (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+        votes = np.bincount((r[inside] * h + cy[inside]) * w + cx[inside], minlength=len(radii) * h * w)
+        votes = votes.reshape(len(radii), h, w).astype(np.int32)
+
+        # the edge is about 2 pixels wide and rounding spreads the votes of a centre over neighbouring radii,
+        # sum them over 3 radii. The error of the gradient direction spreads them over a square that grows
+        # with the radius, sum them over a box of half size spread * r with an integral image
+        padded = np.pad(votes, ((1, 1), (0, 0), (0, 0)))
+        votes = padded[:-2] + padded[1:-1] + padded[2:]
+        half = np.maximum(np.rint(radii * self.spread).astype(np.int64), 1)
+        box = np.empty((len(radii), h, w), dtype=np.float32)
+        for k in np.unique(half):
+            layers = half == k
+            rows = np.pad(votes[layers].cumsum(axis=1), ((0, 0), (k + 1, k), (0, 0)), mode="edge")
+            rows[:, :k + 1] = 0
+            rows = rows[:, 2 * k + 1:] - rows[:, :h]
+            columns = np.pad(rows.cumsum(axis=2), ((0, 0), (0, 0), (k + 1, k)), mode="edge")
+            columns[:, :, :k + 1] = 0
+            box[layers] = columns[:, :, 2 * k + 1:] - columns[:, :, :w]
+        scores = box / (2 * np.pi * radii[:, None, None])
+        best = scores.max(axis=0)
+        ys, xs = np.nonzero(best >= self.min_score)
+        if len(xs) == 0:
+            return np.zeros((0, 3), dtype=np.float32)
+        circles = np.stack((xs, ys, radii[scores[:, ys, xs].argmax(axis=0)]), axis=1).astype(np.float32)
+        return suppress(circles, best[ys, xs], min_dist, self.max_circles)
+
+
+class HoughDetector:
+    """
+    The OpenCV detection of Main.py: median blur, Canny and HoughCircles
+    """
+
+    def __init__(self, blur=5, canny=(100, 150), param1=85, param2=11, max_circles=8):
+        """
+        :param blur: aperture of the median blur
+        :param canny: low and high threshold of the Canny edge detector
+        :param param1: HoughCircles param1
+        :param param2: HoughCircles param2, the accumulator threshold
+        :param max_circles: maximum number of circles returned
+        """
+        if cv2 is None:
+            raise ValueError("HoughDetector needs OpenCV, use NumpyDetector instead")
+        self.blur = blur
+        self.canny = canny
+        self.param1 = param1
+        self.param2 = param2
+        self.max_circles = max_circles
+
+    @staticmethod
+    def grayscale(image):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+    @staticmethod
+    def downscale(gray, factor):
+        return cv2.resize(gray, (gray.shape[1] // factor, gray.shape[0] // factor), interpolation=cv2.INTER_AREA)
+
+    def detect(self, gray, min_radius, max_radius, min_dist):
+        """
+        See NumpyDetector.detect
+        """
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        edges = cv2.Canny(cv2.medianBlur(gray, self.blur), self.canny[0], self.canny[1])
+        circles = cv2.HoughCircles(edges, cv2.HOUGH_GRADIENT, 1, max(min_dist, 1), param1=self.param1,
+                                   param2=self.param2, minRadius=int(min_radius), maxRadius=int(np.ceil(max_radius)))
+        if circles is None:
+            return np.zeros((0, 3), dtype=np.float32)
+        return circles[0, :self.max_circles].astype(np.float32)
+
+
+class DetectionStage:
+    """
+    Detects coins in the camera frames on worker threads
+
+    Every frame starts with a coarse pass on a downscaled copy, which finds candidates at a fraction of the cost.
+    Every candidate is refined at full resolution in a region of interest around it. Once coins have been found
+    the coarse pass only runs every coarse_every frames, the frames in between only refine the regions around
+    the previous hits. The control loop polls the latest result with latest(), which is thread safe.
+
+    Example:
+    detection = DetectionStage(camera, HoughDetector()).start()
+    result = detection.latest()
+    if result is not None and len(result.circles) == 1:
+        x, y, r = result.circles[0]
+    """
+
+    def __init__(self, camera=None, detector=None, min_radius=50, max_radius=70, min_dist=500, factor=4,
+                 coarse_every=5, margin=16, workers=2):
+        """
+        :param camera: started Vision.Camera, None to only use process()
+        :param detector: NumpyDetector, HoughDetector or an object with the same methods, NumpyDetector when None
+        :param min_radius: smallest coin radius in full frame pixels
+        :param max_radius: largest coin radius in full frame pixels
+        :param min_dist: minimum distance between two coins in full frame pixels
+        :param factor: downscale factor of the coarse pass, 1 to detect at full resolution only
+        :param coarse_every: the coarse pass runs at least every coarse_every frames while coins are tracked
+        :param margin: pixels a coin may move between frames and the error of a coarse position
+        :param workers: number of detection threads
+        """
+        self.camera = camera
+        self.detector = detector if detector is not None else NumpyDetector()
+        self.min_radius = min_radius
+        self.max_radius = max_radius
+        self.min_dist = min_dist
+        self.factor = factor
+        self.coarse_every = coarse_every
+        self.margin = margin
+        self.workers = workers
+
+        self._lock = Lock()
+        self._latest = None
+        self._hits = np.zeros((0, 3), dtype=np.float32)
+        self._since_coarse = 0
+        self._latencies = deque(maxlen=1000)     # capture to result
+        self._durations = deque(maxlen=1000)     # processing time
+        self.processed = 0
+        self.coarse = 0
+
+        self.mailbox = None
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        """
+        Start detecting the frames of the camera
+        :return: self as object
+        """
+        if self.running:
+            return None
+        self.running = True
+        self.mailbox = self.camera.subscribe()
+        self.threads = [Thread(target=self._update, args=(), daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the detection threads
+        """
+        if self.running:
+            self.running = False
+            self.camera.unsubscribe(self.mailbox)
+            for thread in self.threads:
+                thread.join(1)
+
+    def _update(self):
+        while self.running:
+            lease = self.mailbox.get(timeout=0.1)
+            if lease is None:
+                continue
+            with lease as frame:
+                self.process(frame.image, frame.sequence, frame.timestamp)
+
+    def _coarse(self, image):
+        factor = self.factor
+        small = self.detector.downscale(self.detector.grayscale(image), factor)
+        circles = self.detector.detect(small, self.min_radius / factor, self.max_radius / factor,
+                                       self.min_dist / factor)
+        circles[:, :2] = circles[:, :2] * factor + (factor - 1) / 2
+        circles[:, 2] *= factor
+        return circles
+
+    def _refine(self, image, candidate):
+        """
+        Detects the strongest circle in the region of interest around a candidate, only the region is converted
+        to grayscale
+        :return: float32 array (3,) in full frame pixels, None if no circle was found
+        """
+        x, y, r = candidate
+        half = int(np.ceil(min(r + self.margin, self.max_radius) + self.margin))
+        left, top = max(int(x) - half, 0), max(int(y) - half, 0)
+        roi = self.detector.grayscale(image[top:int(y) + half + 1, left:int(x) + half + 1])
+        circles = self.detector.detect(roi, max(r - self.margin, self.min_radius),
+                                       min(r + self.margin, self.max_radius), self.min_dist)
+        if len(circles) == 0:
+            return None
+        return circles[0] + np.array((left, top, 0), dtype=np.float32)
+
+    def process(self, image, sequence=0, timestamp=None):
+        """
+        Detects the coins in a frame on the calling thread and publishes the result
+        :param image: BGR or grayscale frame
+        :param sequence: sequence number of the frame
+        :param timestamp: time.perf_counter() of the capture, now when None
+        :return: Detection
+        """
+        start = time.perf_counter()
+        timestamp = start if timestamp is None else timestamp
+        with self._lock:
+            previous = self._hits
+            coarse = len(previous) == 0 or self._since_coarse + 1 >= self.coarse_every
+            self._since_coarse = 0 if coarse else self._since_coarse + 1
+
+        if coarse and self.factor == 1:  # a full resolution pass needs no refinement
+            circles = list(self.detector.detect(self.detector.grayscale(image), self.min_radius, self.max_radius, self.min_dist))
+        else:
+            candidates = [(candidate, False) for candidate in previous]
+            if coarse:
+                candidates += [(candidate, True) for candidate in self._coarse(image)]
+            circles = []
+            for candidate, found in candidates:
+                circle = self._refine(image, candidate)
+                if circle is None and found:  # keep the coarse circle, a previous hit that is gone is dropped
+                    circle = candidate
+                if circle is not None and all((circle[0] - x) ** 2 + (circle[1] - y) ** 2 >= self.min_dist ** 2
+                                              for x, y, _ in circles):
+                    circles.append(circle)
+        circles = np.array(circles, dtype=np.float32).reshape(-1, 3)
+        done = time.perf_counter()
+
+        detection = Detection(sequence, timestamp, circles, coarse, done)
+        with self._lock:
+            if self._latest is None or sequence >= self._latest.sequence:
+                self._latest = detection
+                self._hits = circles
+            self.processed += 1
+            self.coarse += coarse
+            self._latencies.append(done - timestamp)
+            self._durations.append(done - start)
+        return detection
+
+    def latest(self):
+        """
+        :return: the most recent Detection, None if no frame has been processed yet
+        """
+        with self._lock:
+            return self._latest
+
+    def latency(self):
+        """
+        Detection latency over the last 1000 frames
+        :return: dict with the 50th, 90th and 99th percentile in milliseconds from capture to result (p50, ...)
+        and of the processing time alone (process_p50, ...)
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            durations = np.array(self._durations)
+        if len(latencies) == 0:
+            return {}
+        p50, p90, p99 = np.percentile(latencies * 1000, (50, 90, 99))
+        d50, d90, d99 = np.percentile(durations * 1000, (50, 90, 99))
+        return {"p50": p50, "p90": p90, "p99": p99, "process_p50": d50, "process_p90": d90, "process_p99": d99}
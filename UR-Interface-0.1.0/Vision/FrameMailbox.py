@@ -0,0 +1,90 @@
+import time
+from collections import deque
+from threading import Condition
+
+import numpy as np
+
+
+class FrameMailbox:
+    """
+    Delivers captured frames from the capture thread to one consumer
+
+    With maxsize 1 the mailbox only holds the latest frame, a consumer always gets the newest frame
+    and never works through a backlog. With a larger maxsize it is a bounded queue for consumers
+    that need every frame, when it is full the oldest frame is dropped.
+    Frames are held with a lease of the FramePool, get() hands the lease to the consumer.
+
+    Example:
+    mailbox = camera.subscribe()
+    lease = mailbox.get(timeout=1)
+    if lease is not None:
+        with lease as frame:
+            process(frame.image)
+    """
+
+    def __init__(self, maxsize=1):
+        """
+        :param maxsize: number of frames held, 1 for a latest-frame mailbox
+        """
+        self.maxsize = maxsize
+        self._leases = deque()
+        self._condition = Condition()
+        self.closed = False
+
+        self.delivered = 0              # frames put in the mailbox
+        self.dropped = 0                # frames replaced before they were taken
+        self.consumed = 0               # frames taken by the consumer
+        self.ages = deque(maxlen=1000)  # seconds from capture to get() of the last frames
+
+    def put(self, frame):
+        """
+        Adds a frame, called by the capture thread, never blocks
+        :param frame: Frame of a FramePool
+        """
+        try:
+            lease = frame.lease()
+        except ValueError:  # overwritten already
+            self.dropped += 1
+            return
+        with self._condition:
+            if self.closed:
+                lease.release()
+                return
+            self._leases.append(lease)
+            self.delivered += 1
+            if len(self._leases) > self.maxsize:
+                self._leases.popleft().release()
+                self.dropped += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Takes the oldest frame of the mailbox (the latest frame for maxsize 1), waits for one when empty
+        :param timeout: maximum seconds to wait, None to wait until a frame arrives or the mailbox is closed
+        :return: FrameLease, the consumer releases it. None on a timeout or when the mailbox was closed
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._leases or self.closed, timeout) or not self._leases:
+                return None
+            lease = self._leases.popleft()
+            self.consumed += 1
+        self.ages.append(time.perf_counter() - lease.frame.timestamp)
+        return lease
+
+    def close(self):
+        """
+        Releases the held frames and wakes a waiting consumer
+        """
+        with self._condition:
+            self.closed = True
+            while self._leases:
+                self._leases.popleft().release()
+            self._condition.notify_all()
+
+    def statistics(self):
+        """
+        :return: dict with the delivered, dropped and consumed frames and the mean and 95th percentile frame age
+        """
+        ages = np.array(self.ages) if self.ages else np.zeros(1)
+        return {"delivered": self.delivered, "dropped": self.dropped, "consumed": self.consumed,
+                "age_mean": float(np.mean(ages)), "age_p95": float(np.percentile(ages, 95))}
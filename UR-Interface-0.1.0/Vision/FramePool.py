@@ -0,0 +1,191 @@
+from threading import Lock
+
+import numpy as np
+
+
+class Frame:
+    """
+    A captured frame in a buffer of a FramePool
+
+    image is a read-only view of the buffer, no pixels are copied.
+    Without a lease the buffer is reused once newer frames fill the other buffers of the pool,
+    at 30 fps with 3 buffers that is after about 60 ms. A consumer that keeps a frame longer takes a lease:
+
+    with frame.lease():
+        process(frame.image)
+    """
+
+    def __init__(self, pool, index, image, sequence, timestamp):
+        self.pool = pool
+        self.index = index
+        self.image = image
+        self.sequence = sequence    # number of the frame since the capture started
+        self.timestamp = timestamp  # time.perf_counter() at which the frame was read
+
+    def lease(self):
+        """
+        Keeps the buffer from being reused until the lease is released
+        :return: FrameLease, use as a context manager or call release()
+        """
+        return FrameLease(self)
+
+    def valid(self):
+        """
+        :return: True if the buffer still holds this frame
+        """
+        return self.pool.sequence(self.index) == self.sequence
+
+    def copy(self):
+        """
+        :return: a writable copy of the pixels
+        """
+        return self.image.copy()
+
+
+class FrameLease:
+    """
+    Holds a buffer of a FramePool, see Frame.lease()
+    """
+
+    def __init__(self, frame):
+        """
+        :param frame: Frame to lease, raises ValueError if its buffer already holds a newer frame
+        """
+        if not frame.pool.hold(frame.index, frame.sequence):
+            raise ValueError("Frame {} has been overwritten, lease it sooner".format(frame.sequence))
+        self.frame = frame
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.frame.pool.release(self.frame.index)
+
+    def __enter__(self):
+        return self.frame
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class FramePool:
+    """
+    Preallocated frame buffers, reused for every capture
+
+    The capture thread writes into a free buffer (acquire), then publishes it as the latest frame.
+    A buffer is free when it is not the latest frame and holds no leases. With the default of 3 buffers
+    the capture thread always has a buffer while one is read and one is leased,
+    when all buffers are leased an extra buffer is allocated so the capture never blocks.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, buffers=3):
+        """
+        :param shape: shape of a frame, e.g. (720, 1280, 3)
+        :param dtype: type of the pixels
+        :param buffers: number of preallocated buffers, at least 2
+        """
+        if buffers < 2:
+            raise ValueError("A frame pool needs at least 2 buffers")
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.buffers = [np.empty(self.shape, dtype=self.dtype) for _ in range(buffers)]
+        self._views = [self._view(buffer) for buffer in self.buffers]
+        self._leases = [0] * buffers
+        self._sequences = [-1] * buffers
+        self._published = [-1] * buffers   # value of published when the buffer was last published
+        self._writing = None
+        self._latest = None
+        self.latest = None
+        self._lock = Lock()
+        self.allocations = 0    # buffers allocated after the start because all buffers were leased
+        self.published = 0
+
+    @staticmethod
+    def _view(buffer):
+        view = buffer.view()
+        view.flags.writeable = False
+        return view
+
+    def acquire(self):
+        """
+        Selects the free buffer that was published longest ago for the next capture, so an unleased frame
+        stays valid until all other buffers have been written
+        :return: the writable buffer
+        """
+        with self._lock:
+            free = [index for index, leases in enumerate(self._leases)
+                    if leases == 0 and index != self._latest and index != self._writing]
+            if free:
+                index = min(free, key=self._published.__getitem__)
+            else:
+                index = len(self.buffers)
+                self.buffers.append(np.empty(self.shape, dtype=self.dtype))
+                self._views.append(self._view(self.buffers[index]))
+                self._leases.append(0)
+                self._sequences.append(-1)
+                self._published.append(-1)
+                self.allocations += 1
+            self._writing = index
+            self._sequences[index] = -1
+            return self.buffers[index]
+
+    def publish(self, sequence, timestamp):
+        """
+        Makes the acquired buffer the latest frame
+        :return: the published Frame
+        """
+        with self._lock:
+            index, self._writing = self._writing, None
+            self._sequences[index] = sequence
+            self._latest = index
+            self._published[index] = self.published
+            self.published += 1
+            self.latest = Frame(self, index, self._views[index], sequence, timestamp)
+            return self.latest
+
+    def cancel(self):
+        """
+        Gives back the acquired buffer, e.g. when the capture failed
+        """
+        with self._lock:
+            self._writing = None
+
+    def latest_frame(self):
+        """
+        :return: the latest published Frame, None before the first frame
+        """
+        with self._lock:
+            return self.latest
+
+    def lease_latest(self):
+        """
+        Leases the latest frame, a newer frame is taken when it was overwritten before the lease was added
+        :return: FrameLease, None before the first frame
+        """
+        while True:
+            frame = self.latest_frame()
+            if frame is None:
+                return None
+            try:
+                return FrameLease(frame)
+            except ValueError:  # replaced in the meantime, lease the newer frame
+                continue
+
+    def sequence(self, index):
+        with self._lock:
+            return self._sequences[index]
+
+    def hold(self, index, sequence):
+        """
+        Adds a lease to a buffer if it still holds the frame
+        :return: True if the lease was added
+        """
+        with self._lock:
+            if self._sequences[index] != sequence:
+                return False
+            self._leases[index] += 1
+            return True
+
+    def release(self, index):
+        with self._lock:
+            self._leases[index] -= 1
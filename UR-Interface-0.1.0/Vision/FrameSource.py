@@ -0,0 +1,216 @@
+"""
+Frame sources to run the camera without a camera device
+
+A source has the read interface of cv2.VideoCapture, read(image=None) returns (grabbed, image) and
+fills image when it is given, so it can be passed to Camera as src:
+    camera = Camera(SyntheticSource(1280, 720)).start()
+    camera = Camera(ReplaySource('frames.npy')).start()
+"""
+import glob
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # image directories need OpenCV, .npy frames do not
+    cv2 = None
+
+
+def _pace(previous, fps):
+    """
+    Waits until a frame is due, like a camera delivering fps frames per second
+    :param previous: time.perf_counter() at which the previous frame was due, None for the first frame
+    :return: the time at which this frame was due
+    """
+    now = time.perf_counter()
+    due = now if previous is None else max(previous + 1.0 / fps, now - 1.0 / fps)
+    if due > now:
+        time.sleep(due - now)
+    return due
+
+
+class SyntheticSource:
+    """
+    A generated scene of coins moving over a table
+
+    The coins are filled circles that move in a straight line and bounce off the borders of the frame.
+    truth(index) returns the circles of a recent frame to check a detector against.
+    """
+
+    def __init__(self, width=1280, height=720, circles=3, radius=(50, 70), speed=4.0, noise=4.0, fps=None,
+                 frames=None, seed=7):
+        """
+        :param width: width of a frame in pixels
+        :param height: height of a frame in pixels
+        :param circles: number of coins
+        :param radius: (smallest, largest) radius of the coins in pixels
+        :param speed: movement of a coin per frame in pixels
+        :param noise: standard deviation of the gaussian noise, 0 for none
+        :param fps: frames per second delivered like a camera, None to deliver frames as fast as they are read
+        :param frames: number of frames before read() fails like a closed stream, None for no end
+        :param seed: seed of the scene
+        """
+        random = np.random.RandomState(seed)
+        self.shape = (height, width, 3)
+        self.radii = random.uniform(radius[0], radius[1], size=circles)
+        self.centres = random.uniform((radius[1], radius[1]), (width - radius[1], height - radius[1]),
+                                      size=(circles, 2))
+        angles = random.uniform(0, 2 * np.pi, size=circles)
+        self.velocities = speed * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        self.fps = fps
+        self.frames = frames
+        self.index = 0
+        self.history = deque(maxlen=256)    # (index, circles) of the last frames
+        self._next = None
+
+        # a lit table with a gradient, and a few noise images that are cycled to keep generation cheap
+        rows = np.linspace(70, 110, height, dtype=np.float32)[:, None, None]
+        self.background = np.broadcast_to(rows, self.shape).astype(np.uint8)
+        self.noise = [random.normal(0, noise, size=self.shape).astype(np.int16) for _ in range(4)] if noise else []
+        self.colour = np.array((200, 190, 170), dtype=np.uint8)
+
+    def set(self, prop, value):
+        """
+        Accepted like cv2.VideoCapture.set, the size is fixed at construction
+        """
+        return False
+
+    def truth(self, index):
+        """
+        :param index: number of a frame since the start
+        :return: float32 array (n, 3) of x, y, radius of the coins in that frame, None if it is no longer kept
+        """
+        for frame, circles in self.history:
+            if frame == index:
+                return circles
+        return None
+
+    def _move(self):
+        height, width = self.shape[:2]
+        self.centres += self.velocities
+        for axis, size in ((0, width), (1, height)):
+            low = self.centres[:, axis] < self.radii
+            high = self.centres[:, axis] > size - self.radii
+            self.velocities[low | high, axis] *= -1
+            self.centres[:, axis] = np.clip(self.centres[:, axis], self.radii, size - self.radii)
+
+    def read(self, image=None):
+        """
+        Renders the next frame
+        :param image: optional uint8 buffer of the frame shape to render into
+        :return: (True, image), (False, None) after the last frame
+        """
+        if self.frames is not None and self.index >= self.frames:
+            return False, None
+        if self.fps:
+            self._next = _pace(self._next, self.fps)
+        if image is None or image.shape != self.shape:
+            image = np.empty(self.shape, dtype=np.uint8)
+
+        if self.noise:
+            np.add(self.background, self.noise[self.index % len(self.noise)], out=image, casting="unsafe")
+        else:
+            np.copyto(image, self.background)
+        height, width = self.shape[:2]
+        for (x, y), r in zip(self.centres, self.radii):
+            top, bottom = max(int(y - r), 0), min(int(y + r) + 2, height)
+            left, right = max(int(x - r), 0), min(int(x + r) + 2, width)
+            ys, xs = np.ogrid[top:bottom, left:right]
+            image[top:bottom, left:right][(xs - x) ** 2 + (ys - y) ** 2 <= r * r] = self.colour
+
+        self.history.append((self.index, np.c_[self.centres, self.radii].astype(np.float32)))
+        self.index += 1
+        self._move()
+        return True, image
+
+    def release(self):
+        pass
+
+
+class ReplaySource:
+    """
+    Replays recorded frames from a .npy stack (frames, height, width, 3) or a directory of .npy or image files
+
+    A .npy stack is memory-mapped, frames are read from disk when they are replayed.
+    """
+
+    def __init__(self, path, fps=None, loop=True):
+        """
+        :param path: .npy file or directory with frame files, sorted by name
+        :param fps: frames per second, None to deliver frames as fast as they are read
+        :param loop: start again after the last frame, when False read() fails like a closed stream
+        """
+        if os.path.isdir(path):
+            self.stack = None
+            self.paths = sorted(glob.glob(os.path.join(path, "*.npy")))
+            if not self.paths and cv2 is not None:
+                self.paths = sorted(p for extension in ("png", "jpg", "bmp")
+                                    for p in glob.glob(os.path.join(path, "*." + extension)))
+            count = len(self.paths)
+        else:
+            self.stack = np.load(path, mmap_mode="r")
+            count = len(self.stack)
+        if count == 0:
+            raise ValueError("No frames in {}".format(path))
+        self.count = count
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        self._next = None
+
+    def set(self, prop, value):
+        return False
+
+    def _frame(self, position):
+        if self.stack is not None:
+            return self.stack[position]
+        path = self.paths[position]
+        return np.load(path) if path.endswith(".npy") else cv2.imread(path)
+
+    def read(self, image=None):
+        """
+        :param image: optional buffer of the frame shape to copy into
+        :return: (True, image), (False, None) after the last frame when not looping
+        """
+        if not self.loop and self.index >= self.count:
+            return False, None
+        if self.fps:
+            self._next = _pace(self._next, self.fps)
+        frame = self._frame(self.index % self.count)
+        self.index += 1
+        if image is None or image.shape != frame.shape:
+            return True, np.array(frame)
+        np.copyto(image, frame)
+        return True, image
+
+    def release(self):
+        self.stack = None
+
+
+def record(source, path, frames):
+    """
+    Writes frames of a source to a .npy stack for ReplaySource, one frame in memory at a time
+    :param source: SyntheticSource, cv2.VideoCapture or any object with read()
+    :param path: .npy file to write
+    :param frames: number of frames
+    :return: number of frames written, frames after a failed read are left black
+    """
+    grabbed, frame = source.read()
+    if not grabbed:
+        return 0
+    stack = np.lib.format.open_memmap(path, mode="w+", dtype=frame.dtype, shape=(frames,) + frame.shape)
+    stack[0] = frame
+    for i in range(1, frames):
+        grabbed, image = source.read(stack[i])
+        if not grabbed:
+            break
+        if image is not stack[i]:
+            stack[i] = image
+    else:
+        i = frames
+    stack.flush()
+    del stack
+    return i
@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+from EEG.Ingest import CLIPPED, DUPLICATES, FLAT, HEADSET_RATE, iter_csv, quality
+
+RECORDING = os.path.join(os.path.dirname(__file__), "..", "..", "RawData_Collection", "rawData_Robert.csv")
+
+
+def test_recorded_rows_pass():
+    samples, _ = next(iter_csv(RECORDING, chunk_rows=16))
+    result = quality(samples)
+    assert np.all(result["flags"] == 0)
+    assert np.all(np.abs(result["effective_rate"] - HEADSET_RATE) < 0.25 * HEADSET_RATE)
+
+
+def test_lost_values_and_clipping_are_flagged():
+    samples, _ = next(iter_csv(RECORDING, chunk_rows=3))
+    samples = samples.copy()
+    row = samples[0]
+    values = row[np.flatnonzero(np.diff(row, prepend=row[0] - 1))]
+    samples[0] = np.repeat(values[::3], 3 * len(row) // len(values) + 1)[:len(row)]  # two of three values lost
+    samples[1, 200:400] = samples[1, 200]       # the connection stalled
+    samples[2, 500] = 2047
+    flags = quality(samples)["flags"]
+    assert flags[0] & DUPLICATES
+    assert flags[1] & FLAT
+    assert flags[2] == CLIPPED